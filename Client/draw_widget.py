@@ -1,9 +1,51 @@
+from contextlib import contextmanager
+
 from PyQt5.QtWidgets import QWidget
-from PyQt5.QtGui import QPainter, QPen, QPixmap, QColor, QCursor, QBitmap, QImage
-from PyQt5.QtCore import Qt, QPoint, pyqtSignal
+from PyQt5.QtGui import QPainter, QPen, QPixmap, QColor, QCursor, QBitmap, QImage, QPolygon
+from PyQt5.QtCore import (
+    Qt, QPoint, QRect, QTimer, QObject, QThread, QMutex, pyqtSignal, pyqtSlot
+)
+
+from strokes import Stroke, item_points, smooth
+
+# === 笔迹分块参数 ===
+# 画手端把鼠标采样点攒成折线块再发送，而不是每次移动发一条线段
+POLY_FLUSH_MS = 30      # 最长攒点时间
+POLY_MAX_POINTS = 32    # 单块最多点数（含起点）
+
+# === 笔迹简化参数（像素） ===
+# 发送前对每块做距离阈值 + RDP 简化，设为 0 关闭对应步骤；本地显示与历史仍用原始采样点
+SIMPLIFY_MIN_DIST = 2.0   # 与上一个保留点距离不足此值的抖动点丢弃
+SIMPLIFY_EPSILON = 1.0    # 偏离弦线不超过此值的近共线点丢弃
+
+# === 撤销快照参数 ===
+# 每提交 N 笔保存一张绘画层快照，撤销时从最近的快照开始重放，代价与历史总长无关
+CHECKPOINT_INTERVAL = 20
+MAX_CHECKPOINTS = 8     # 超出后丢弃最旧的快照，控制内存占用
+
+# 同一帧内到达的远程笔迹合并成一批交给渲染线程
+FRAME_MS = 16
+
+class RenderWorker(QObject):
+    """
+    渲染线程：把远程笔迹光栅化到 QImage 绘画层上
+    GUI 线程只负责把画好的区域贴到屏幕上，大量笔迹涌入时聊天和按钮依然流畅
+    """
+    rendered = pyqtSignal(QRect)  # 需要重绘的区域
+
+    def __init__(self, canvas):
+        super().__init__()
+        self.canvas = canvas
+
+    @pyqtSlot(int, list)
+    def render(self, generation, ops):
+        dirty = self.canvas._apply_remote_ops(generation, ops)
+        if dirty is not None and not dirty.isEmpty():
+            self.rendered.emit(dirty)
 
 class DrawWidget(QWidget):
     local_draw = pyqtSignal(dict)
+    _render_requested = pyqtSignal(int, list)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -17,7 +59,9 @@ class DrawWidget(QWidget):
         # 1. 网格层：只存背景和网格，永远不变
         self._grid_layer = QPixmap(800, 600)
         # 2. 绘画层：背景透明，只存笔迹
-        self._drawing_layer = QPixmap(800, 600)
+        #    用 QImage 而不是 QPixmap，渲染线程才能在上面作画；读写都要持有 _layer_lock
+        self._drawing_layer = QImage(800, 600, QImage.Format_ARGB32_Premultiplied)
+        self._layer_lock = QMutex()
         
         # 初始化图层
         self._init_layers()
@@ -27,10 +71,42 @@ class DrawWidget(QWidget):
         self.pen_color = QColor("#000000")
         self.pen_width = 3
         
-        # 历史记录
+        # 历史记录：已完成的 Stroke（颜色/笔宽各一份，坐标在 array('h') 里）
         self.history = []
-        self.current_stroke = []
-        self.remote_stroke_buffer = []
+        # 撤销快照：[(已包含的笔画数, 绘画层副本), ...]，按笔画数递增
+        self._checkpoints = []
+        # 中途加入时服务器给的底图（较早的笔画），history 从它之上开始
+        self._base_image = None
+        self.current_stroke = None        # 本地正在画的一笔
+        self.remote_stroke_buffer = None  # 远程正在画的一笔，收到 end 时记入历史
+
+        # current_stroke 中尚未发出的部分从这个坐标下标开始（即上一块的末点），保证块与块首尾相连
+        self._chunk_start = 0
+        self.simplify_min_dist = SIMPLIFY_MIN_DIST
+        self.simplify_epsilon = SIMPLIFY_EPSILON
+        # 接收端可选：用样条插值把简化后的折线画得更圆滑
+        self.smooth_remote = False
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setInterval(POLY_FLUSH_MS)
+        self._flush_timer.timeout.connect(self._flush_pending_points)
+
+        # 本帧内尚未交给渲染线程的远程操作（按到达顺序，含 end/undo/clear）
+        self._remote_pending = []
+        self._frame_timer = QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.setInterval(FRAME_MS)
+        self._frame_timer.timeout.connect(self._flush_remote_frame)
+
+        # 画布代数：本地清空时递增，渲染线程据此丢弃清空前排队的旧批次
+        self._generation = 0
+
+        # === 渲染线程 ===
+        self._render_thread = QThread(self)
+        self._render_worker = RenderWorker(self)
+        self._render_worker.moveToThread(self._render_thread)
+        self._render_requested.connect(self._render_worker.render)
+        self._render_worker.rendered.connect(self._on_rendered)
+        self._render_thread.start()
         
         self._interactive = False
         self.setAttribute(Qt.WA_StaticContents)
@@ -110,13 +186,30 @@ class DrawWidget(QWidget):
         else:
             self.setCursor(Qt.ArrowCursor)
 
+    @contextmanager
+    def _locked_layer(self):
+        """持有绘画层锁：GUI 线程与渲染线程互斥访问绘画层、历史和快照"""
+        self._layer_lock.lock()
+        try:
+            yield
+        finally:
+            self._layer_lock.unlock()
+
+    def stop_render_thread(self):
+        """窗口关闭前调用，结束渲染线程"""
+        self._render_thread.quit()
+        self._render_thread.wait(1000)
+
     # === 重写绘图事件 (关键：叠加图层) ===
     def paintEvent(self, event):
+        # 只合成需要重绘的区域，笔迹更新时通常只是一小块
+        rect = event.rect()
         painter = QPainter(self)
         # 1. 先画网格层 (底)
-        painter.drawPixmap(0, 0, self._grid_layer)
+        painter.drawPixmap(rect, self._grid_layer, rect)
         # 2. 再画笔迹层 (顶)
-        painter.drawPixmap(0, 0, self._drawing_layer)
+        with self._locked_layer():
+            painter.drawImage(rect, self._drawing_layer, rect)
 
     def resizeEvent(self, event):
         """窗口大小改变时，扩展图层"""
@@ -136,29 +229,27 @@ class DrawWidget(QWidget):
             # 实际生产中应只画新增部分，这里偷懒重置一下
             p.end()
             self._grid_layer = new_grid
-            self._init_layers() # 重新铺满网格
+            with self._locked_layer():
+                self._init_layers() # 重新铺满网格
 
             # 扩展绘画层
-            new_draw = QPixmap(new_w, new_h)
-            new_draw.fill(Qt.transparent)
-            p = QPainter(new_draw)
-            p.drawPixmap(0, 0, self._drawing_layer)
-            p.end()
-            self._drawing_layer = new_draw
+            with self._locked_layer():
+                new_draw = QImage(new_w, new_h, QImage.Format_ARGB32_Premultiplied)
+                new_draw.fill(Qt.transparent)
+                p = QPainter(new_draw)
+                p.drawImage(0, 0, self._drawing_layer)
+                p.end()
+                self._drawing_layer = new_draw
 
         super().resizeEvent(event)
 
     # === 核心画线逻辑 ===
-    def _draw_line_on_pixmap(self, data):
-        """在绘画层上画线"""
-        start = QPoint(data.get("x1"), data.get("y1"))
-        end = QPoint(data.get("x2"), data.get("y2"))
-        color_str = data.get("color", "#000000")
-        width = data.get("width", 3)
-
+    def _begin_layer_painter(self):
         painter = QPainter(self._drawing_layer) # 注意：只画在顶层
         painter.setRenderHint(QPainter.Antialiasing)
+        return painter
 
+    def _apply_pen(self, painter, color_str, width):
         # === 核心：橡皮擦逻辑判断 ===
         # 如果颜色等于背景色，说明是橡皮擦模式
         # 此时我们要把 CompositionMode 设为 Clear (变透明)
@@ -174,23 +265,111 @@ class DrawWidget(QWidget):
             pen = QPen(QColor(color_str), width, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
 
         painter.setPen(pen)
+
+    @staticmethod
+    def _stroke_bounds(rect, width):
+        """几何包围盒外扩半个笔宽（加抗锯齿余量），即需要重绘的区域"""
+        margin = int(width) // 2 + 2
+        return rect.normalized().adjusted(-margin, -margin, margin, margin)
+
+    def _draw_line_on_pixmap(self, data, painter=None):
+        """在绘画层上画线，返回受影响的区域；传入 painter 时复用之"""
+        start = QPoint(data.get("x1"), data.get("y1"))
+        end = QPoint(data.get("x2"), data.get("y2"))
+        color_str = data.get("color", "#000000")
+        width = data.get("width", 3)
+
+        own_painter = painter is None
+        if own_painter:
+            painter = self._begin_layer_painter()
+        self._apply_pen(painter, color_str, width)
         painter.drawLine(start, end)
-        painter.end()
+        if own_painter:
+            painter.end()
+        return self._stroke_bounds(QRect(start, end), width)
+
+    def _draw_polyline_on_pixmap(self, data, painter=None):
+        """在绘画层上画一整块折线：一次 drawPolyline，返回受影响的区域"""
+        pts = data.get("points", [])
+        if len(pts) < 4:
+            return QRect()
+        polygon = QPolygon([QPoint(pts[i], pts[i + 1]) for i in range(0, len(pts) - 1, 2)])
+        color_str = data.get("color", "#000000")
+        width = data.get("width", 3)
+
+        own_painter = painter is None
+        if own_painter:
+            painter = self._begin_layer_painter()
+        self._apply_pen(painter, color_str, width)
+        painter.drawPolyline(polygon)
+        if own_painter:
+            painter.end()
+        return self._stroke_bounds(polygon.boundingRect(), width)
+
+    def _draw_item(self, data, painter=None):
+        """按 action 分发：poly 为折线块，move 为旧版单线段"""
+        if data.get("action") == "poly":
+            return self._draw_polyline_on_pixmap(data, painter)
+        return self._draw_line_on_pixmap(data, painter)
+
+    def _draw_stroke(self, stroke, painter):
+        """直接从 Stroke 的坐标缓冲区重放一整笔"""
+        self._apply_pen(painter, stroke.color, stroke.width)
+        for pts in stroke.polylines():
+            painter.drawPolyline(QPolygon(pts.tolist()))
 
     def _redraw_from_history(self):
-        """重绘历史：先清空绘画层，再重放"""
+        """重绘历史：从最近的快照恢复绘画层，只重放其后的笔画（调用方需持有 _layer_lock）"""
+        # 丢弃已被撤销的笔画之后的快照
+        while self._checkpoints and self._checkpoints[-1][0] > len(self.history):
+            self._checkpoints.pop()
+
         self._drawing_layer.fill(Qt.transparent) # 只清空顶层，网格层不动
-        
-        for stroke in self.history:
-            for seg in stroke:
-                self._draw_line_on_pixmap(seg)
-        self.update()
+        start = 0
+        snapshot = self._base_image
+        if self._checkpoints:
+            start, snapshot = self._checkpoints[-1]
+        if snapshot is not None:
+            # 图层可能已因窗口放大而变大，按原尺寸贴回左上角
+            painter = QPainter(self._drawing_layer)
+            painter.setCompositionMode(QPainter.CompositionMode_Source)
+            painter.drawImage(0, 0, snapshot)
+            painter.end()
+
+        painter = self._begin_layer_painter()
+        for stroke in self.history[start:]:
+            self._draw_stroke(stroke, painter)
+        painter.end()
+
+    def _commit_stroke(self, stroke):
+        """笔画完成后记入历史，每 CHECKPOINT_INTERVAL 笔保存一张快照（调用方需持有 _layer_lock）"""
+        self.history.append(stroke)
+        if len(self.history) % CHECKPOINT_INTERVAL == 0:
+            self._checkpoints.append((len(self.history), self._drawing_layer.copy()))
+            if len(self._checkpoints) > MAX_CHECKPOINTS:
+                self._checkpoints.pop(0)
+
+    def _clear_history(self):
+        self.history.clear()
+        self._checkpoints.clear()
+        self._base_image = None
+
+    def _flush_pending_points(self):
+        """把当前笔画中尚未发出的点作为一个 poly 块发出"""
+        stroke = self.current_stroke
+        if stroke is None or len(stroke.points) - self._chunk_start < 4:
+            return
+        self.local_draw.emit(stroke.chunk(self._chunk_start, self.simplify_min_dist, self.simplify_epsilon))
+        # 下一块从本块末点开始
+        self._chunk_start = len(stroke.points) - 2
 
     # === 接口 ===
     def set_interactive(self, enabled):
         self._interactive = enabled
         if not enabled:
             self._last_pos = None
+            self._flush_timer.stop()
+            self.current_stroke = None
             self.setCursor(Qt.ArrowCursor)
         else:
             # 恢复当前工具的光标
@@ -215,15 +394,16 @@ class DrawWidget(QWidget):
         self.set_eraser_cursor() # 切换光标
 
     def undo(self):
-        if self.history:
+        with self._locked_layer():
+            if not self.history:
+                return
             self.history.pop()
             self._redraw_from_history()
-            self.local_draw.emit({"action": "undo"})
+        self.update()
+        self.local_draw.emit({"action": "undo"})
 
     def clear_all(self):
-        self.history.clear()
-        self._drawing_layer.fill(Qt.transparent) # 清空顶层
-        self.update()
+        self._clear_local_canvas()
         self.local_draw.emit({"action": "clear"})
 
     # === 鼠标事件 ===
@@ -231,7 +411,10 @@ class DrawWidget(QWidget):
         if not self._interactive: return
         if event.button() == Qt.LeftButton:
             self._last_pos = event.pos()
-            self.current_stroke = []
+            self.current_stroke = Stroke(self.pen_color.name(), self.pen_width)
+            self.current_stroke.add_point(self._last_pos.x(), self._last_pos.y())
+            self._chunk_start = 0
+            self._flush_timer.start()
 
     def mouseMoveEvent(self, event):
         if not self._interactive: return
@@ -244,40 +427,140 @@ class DrawWidget(QWidget):
                 "color": self.pen_color.name(),
                 "width": self.pen_width
             }
-            self._draw_line_on_pixmap(segment)
-            self.current_stroke.append(segment)
-            self.update() # 触发 paintEvent 合成图层
-            self.local_draw.emit(segment)
+            # 本地立即画出（只刷新线段所在区域），网络端按块发送
+            with self._locked_layer():
+                dirty = self._draw_line_on_pixmap(segment)
+            self.update(dirty)
+            stroke = self.current_stroke
+            stroke.add_point(curr_pos.x(), curr_pos.y())
+            if len(stroke.points) - self._chunk_start >= POLY_MAX_POINTS * 2:
+                self._flush_pending_points()
             self._last_pos = curr_pos
 
     def mouseReleaseEvent(self, event):
         if not self._interactive: return
         if event.button() == Qt.LeftButton:
-            if self.current_stroke:
-                self.history.append(self.current_stroke)
-                self.current_stroke = []
+            self._flush_timer.stop()
+            self._flush_pending_points()
+            stroke = self.current_stroke
+            self.current_stroke = None
+            # 只点了一下没有移动的不算一笔
+            if stroke is not None and len(stroke) >= 2:
+                with self._locked_layer():
+                    self._commit_stroke(stroke)
                 self.local_draw.emit({"action": "end"})
             self._last_pos = None
 
     # === 远程绘图处理 ===
+    def load_base_image(self, data):
+        """铺上服务器发来的 PNG 底图（中途加入时），之后的笔画画在它上面"""
+        image = QImage.fromData(data, "PNG")
+        if image.isNull():
+            return
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        with self._locked_layer():
+            self._base_image = image
+            self._redraw_from_history()
+        self.update()
+
     def draw_remote_line(self, data):
-        action = data.get("action")
-        if action == "move":
-            self._draw_line_on_pixmap(data)
-            self.update()
-            self.remote_stroke_buffer.append(data)
-        elif action == "end":
-            if self.remote_stroke_buffer:
-                self.history.append(self.remote_stroke_buffer)
-                self.remote_stroke_buffer = []
-        elif action == "undo":
-            if self.history:
-                self.history.pop()
-                self._redraw_from_history()
-        elif action == "clear":
-            self.clear_all_local_only()
+        self.draw_remote_batch([data])
+
+    def draw_remote_batch(self, ops):
+        """一次接收多条远程绘图操作"""
+        # 所有远程操作按到达顺序攒到本帧末尾，再整批交给渲染线程
+        self._remote_pending.extend(
+            d for d in ops if d.get("action") in ("move", "poly", "end", "undo", "clear")
+        )
+        if self._remote_pending and not self._frame_timer.isActive():
+            self._frame_timer.start()
+
+    def _flush_remote_frame(self):
+        self._frame_timer.stop()
+        if not self._remote_pending:
+            return
+        ops = self._remote_pending
+        self._remote_pending = []
+        self._render_requested.emit(self._generation, ops)
+
+    def _on_rendered(self, rect):
+        self.update(rect)
+
+    def _apply_remote_ops(self, generation, ops):
+        """
+        在渲染线程中执行：一个 QPainter 画完整批笔迹，返回需要重绘的区域
+        批次早于最近一次本地清空时直接丢弃，返回 None
+        """
+        with self._locked_layer():
+            if generation != self._generation:
+                return None
+            dirty = QRect()
+            painter = None
+            for data in ops:
+                action = data.get("action")
+                if action in ("move", "poly"):
+                    if action == "poly" and self.smooth_remote:
+                        data = self._smoothed(data)
+                    if painter is None:
+                        painter = self._begin_layer_painter()
+                    dirty = dirty.united(self._draw_item(data, painter))
+                    self._buffer_remote_item(data)
+                    continue
+
+                # 结束 / 撤销 / 清空前先结束本段绘制
+                if painter is not None:
+                    painter.end()
+                    painter = None
+                if action == "end":
+                    if self.remote_stroke_buffer is not None:
+                        self._commit_stroke(self.remote_stroke_buffer)
+                        self.remote_stroke_buffer = None
+                elif action == "undo":
+                    if self.history:
+                        self.history.pop()
+                        self._redraw_from_history()
+                        dirty = self._drawing_layer.rect()
+                elif action == "clear":
+                    self._clear_history()
+                    self._drawing_layer.fill(Qt.transparent)
+                    dirty = self._drawing_layer.rect()
+            if painter is not None:
+                painter.end()
+            return dirty
+
+    @staticmethod
+    def _smoothed(data):
+        pts = item_points(data)
+        if pts is None:
+            return data
+        return dict(data, points=smooth(pts).tolist())
+
+    def _buffer_remote_item(self, data):
+        """远程 poly / move 块并入正在画的一笔（调用方需持有 _layer_lock）"""
+        pts = item_points(data)
+        if pts is None:
+            return
+        color = data.get("color", "#000000")
+        width = data.get("width", 3)
+        stroke = self.remote_stroke_buffer
+        if stroke is not None and not stroke.matches(color, width):
+            # 正常客户端一笔之内不会换笔；真遇到时先把前半截记为一笔
+            self._commit_stroke(stroke)
+            stroke = None
+        if stroke is None:
+            stroke = self.remote_stroke_buffer = Stroke(color, width)
+        stroke.extend(pts)
+
+    def _clear_local_canvas(self):
+        """清空画布并作废所有尚未渲染的远程批次"""
+        self._frame_timer.stop()
+        self._remote_pending = []
+        with self._locked_layer():
+            self._generation += 1
+            self._clear_history()
+            self.remote_stroke_buffer = None
+            self._drawing_layer.fill(Qt.transparent) # 清空顶层
+        self.update()
 
     def clear_all_local_only(self):
-        self.history.clear()
-        self._drawing_layer.fill(Qt.transparent)
-        self.update()
\ No newline at end of file
+        self._clear_local_canvas()
@@ -6,11 +6,15 @@ from PyQt5.QtCore import QThread, pyqtSignal
 ROOT_DIR = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT_DIR))
 
-from Shared.protocol import encode_message, decode_stream
+from Shared.protocol import (
+    MSG_DRAW, MSG_WELCOME, FORMAT_JSON, FORMAT_BINARY,
+    encode_message, encode_draw_binary, FrameDecoder, decode_frame
+)
 
 class NetworkClient(QThread):
     # 信号定义
-    message_received = pyqtSignal(dict)
+    # 每次 recv 解出的所有消息合成一个列表发出，减少跨线程信号次数
+    messages_received = pyqtSignal(list)
     connected = pyqtSignal()
     disconnected = pyqtSignal()
     error_occurred = pyqtSignal(str)
@@ -21,6 +25,8 @@ class NetworkClient(QThread):
         self.port = port
         self.sock = None
         self._running = False
+        # 绘图数据编码，收到 MSG_WELCOME 后以服务器协商结果为准
+        self.draw_format = FORMAT_JSON
 
     def run(self):
         try:
@@ -33,17 +39,23 @@ class NetworkClient(QThread):
             self.disconnected.emit()
             return
 
-        buffer = ""
+        decoder = FrameDecoder()
         while self._running:
             try:
                 data = self.sock.recv(4096)
                 if not data:
                     break
                 
-                buffer += data.decode("utf-8", errors="ignore")
-                msgs, buffer = decode_stream(buffer)
-                for msg in msgs:
-                    self.message_received.emit(msg)
+                batch = []
+                for frame in decoder.feed(data):
+                    msg = decode_frame(frame)
+                    if msg is None:
+                        continue
+                    if msg.get("type") == MSG_WELCOME:
+                        self.draw_format = msg.get("draw_format", FORMAT_JSON)
+                    batch.append(msg)
+                if batch:
+                    self.messages_received.emit(batch)
             except OSError:
                 # socket 被关闭或网络错误
                 break
@@ -56,8 +68,13 @@ class NetworkClient(QThread):
     def send_message(self, obj):
         if not self.sock or not self._running:
             return
+        data = None
+        if self.draw_format == FORMAT_BINARY and obj.get("type") == MSG_DRAW:
+            data = encode_draw_binary(obj.get("data", {}))
+        if data is None:
+            data = encode_message(obj)
         try:
-            self.sock.sendall(encode_message(obj))
+            self.sock.sendall(data)
         except OSError as e:
             print(f"Send Error: {e}")
             self.error_occurred.emit("发送失败，网络连接可能已断开")
@@ -0,0 +1,170 @@
+"""
+strokes.py
+紧凑的笔画存储：每笔只记一次颜色和笔宽，坐标放在 array('h') 里。
+取代“每段一个 dict”的历史记录，长回合下对象数量少、内存碎片少；
+重放、撤销和发送都直接读这些缓冲区。
+"""
+
+from array import array
+
+COORD_MIN = -32768  # array('h') 的取值范围
+COORD_MAX = 32767
+
+def _coords(values):
+    """转成 array('h')；越界或非整数的坐标截断到 16 位范围"""
+    try:
+        return array("h", values)
+    except (OverflowError, TypeError):
+        return array("h", (int(min(max(v, COORD_MIN), COORD_MAX)) for v in values))
+
+def item_points(data):
+    """绘图 data 里的点：poly 取 points，旧版 move 取两端点；格式不对返回 None"""
+    if data.get("action") == "move":
+        values = [data.get("x1"), data.get("y1"), data.get("x2"), data.get("y2")]
+    else:
+        values = data.get("points")
+    if not isinstance(values, list) or len(values) < 4:
+        return None
+    try:
+        return _coords(values[:len(values) // 2 * 2])
+    except (TypeError, ValueError):
+        return None
+
+class Stroke:
+    """
+    一笔：颜色、笔宽 + 扁平坐标 [x0, y0, x1, y1, ...]
+    块与块首尾相接时直接续上；接不上的块另起一段折线，起点记在 breaks 里
+    """
+    __slots__ = ("color", "width", "points", "breaks")
+
+    def __init__(self, color, width):
+        self.color = color
+        self.width = width
+        self.points = array("h")
+        self.breaks = array("I")
+
+    def matches(self, color, width):
+        return self.color == color and self.width == width
+
+    def add_point(self, x, y):
+        self.points.extend(_coords((x, y)))
+
+    def extend(self, pts):
+        """追加一块折线点（array('h') 或列表）"""
+        points = self.points
+        if len(points) >= 2 and points[-2] == pts[0] and points[-1] == pts[1]:
+            points.extend(pts[2:])
+            return
+        if points:
+            self.breaks.append(len(points))
+        points.extend(pts)
+
+    def polylines(self):
+        """逐段产出坐标切片（每段至少两个点）"""
+        start = 0
+        for end in list(self.breaks) + [len(self.points)]:
+            if end - start >= 4:
+                yield self.points[start:end]
+            start = end
+
+    def chunk(self, start, min_dist=0, epsilon=0):
+        """从坐标下标 start 起的点打包成 poly 消息，供网络发送；可先简化（见 simplify）"""
+        points = self.points[start:]
+        if min_dist > 0 or epsilon > 0:
+            points = simplify(points, min_dist, epsilon)
+        return {
+            "action": "poly",
+            "color": self.color,
+            "width": self.width,
+            "points": points.tolist()
+        }
+
+    def __len__(self):
+        """点数"""
+        return len(self.points) // 2
+
+# === 画手端简化 / 接收端平滑 ===
+def simplify(points, min_dist=2.0, epsilon=1.0):
+    """
+    简化一块折线（扁平坐标），首尾两点保持不变以便块与块相接：
+    1. 距离阈值：丢掉离上一个保留点不足 min_dist 的抖动点
+    2. Ramer–Douglas–Peucker：去掉偏离弦线不超过 epsilon 的近共线点
+    任一参数 <= 0 时跳过对应步骤
+    """
+    n = len(points) // 2
+    if n <= 2:
+        return array("h", points)
+
+    # 1. 距离阈值
+    keep = [0]
+    if min_dist > 0:
+        limit = min_dist * min_dist
+        lx, ly = points[0], points[1]
+        for i in range(1, n - 1):
+            x, y = points[2 * i], points[2 * i + 1]
+            if (x - lx) * (x - lx) + (y - ly) * (y - ly) >= limit:
+                keep.append(i)
+                lx, ly = x, y
+    else:
+        keep.extend(range(1, n - 1))
+    keep.append(n - 1)
+
+    # 2. RDP（显式栈，避免长块递归过深）
+    if epsilon > 0 and len(keep) > 2:
+        mask = [False] * len(keep)
+        mask[0] = mask[-1] = True
+        stack = [(0, len(keep) - 1)]
+        eps2 = epsilon * epsilon
+        while stack:
+            first, last = stack.pop()
+            ax, ay = points[2 * keep[first]], points[2 * keep[first] + 1]
+            bx, by = points[2 * keep[last]], points[2 * keep[last] + 1]
+            dx, dy = bx - ax, by - ay
+            norm = dx * dx + dy * dy
+            best, best_d = -1, eps2
+            for k in range(first + 1, last):
+                px, py = points[2 * keep[k]] - ax, points[2 * keep[k] + 1] - ay
+                if norm:
+                    # 点到直线距离的平方：叉积² / |AB|²
+                    cross = px * dy - py * dx
+                    d = cross * cross / norm
+                else:
+                    d = px * px + py * py
+                if d > best_d:
+                    best, best_d = k, d
+            if best >= 0:
+                mask[best] = True
+                stack.append((first, best))
+                stack.append((best, last))
+        keep = [i for i, m in zip(keep, mask) if m]
+
+    out = array("h")
+    for i in keep:
+        out.append(points[2 * i])
+        out.append(points[2 * i + 1])
+    return out
+
+def smooth(points, spacing=4.0, max_steps=8):
+    """
+    Catmull-Rom 样条插值：经过所有原始点，段间按约 spacing 像素补点
+    块的首尾点各自重复一次作为虚拟控制点，因此块与块仍在原端点相接
+    """
+    n = len(points) // 2
+    if n <= 2:
+        return array("h", points)
+    xs = [points[0]] + list(points[0::2]) + [points[-2]]
+    ys = [points[1]] + list(points[1::2]) + [points[-1]]
+    out = array("h", points[:2])
+    for i in range(1, n):
+        x0, x1, x2, x3 = xs[i - 1], xs[i], xs[i + 1], xs[i + 2]
+        y0, y1, y2, y3 = ys[i - 1], ys[i], ys[i + 1], ys[i + 2]
+        length = abs(x2 - x1) + abs(y2 - y1)
+        steps = max(1, min(max_steps, int(length / spacing)))
+        for s in range(1, steps + 1):
+            t = s / steps
+            t2 = t * t
+            t3 = t2 * t
+            x = 0.5 * (2 * x1 + (x2 - x0) * t + (2 * x0 - 5 * x1 + 4 * x2 - x3) * t2 + (3 * x1 - x0 - 3 * x2 + x3) * t3)
+            y = 0.5 * (2 * y1 + (y2 - y0) * t + (2 * y0 - 5 * y1 + 4 * y2 - y3) * t2 + (3 * y1 - y0 - 3 * y2 + y3) * t3)
+            out.extend(_coords((round(x), round(y))))
+    return out
@@ -1,8 +1,9 @@
+import base64
 import sys
 from pathlib import Path
 from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QTextEdit, QLineEdit, QPushButton, QListWidget, QLabel,
+    QTextEdit, QLineEdit, QPushButton, QListWidget, QListWidgetItem, QLabel,
     QMessageBox, QGroupBox, QFrame, QGraphicsDropShadowEffect,
     QDialog
 )
@@ -85,8 +86,9 @@ class LoginDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Create Character")
-        self.setFixedSize(400, 250)
+        self.setFixedSize(400, 320)
         self.name = "Player"
+        self.room = DEFAULT_ROOM
         self.setStyleSheet("""
             QDialog { background-color: #1e1e2e; }
             QLabel { color: #cdd6f4; font-size: 16px; }
@@ -112,6 +114,10 @@ class LoginDialog(QDialog):
         self.input_name.setPlaceholderText("e.g., Drawing Master")
         self.input_name.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.input_name)
+        self.input_room = QLineEdit()
+        self.input_room.setPlaceholderText(f"Room (default: {DEFAULT_ROOM})")
+        self.input_room.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.input_room)
         btn_confirm = QPushButton("Enter Game")
         btn_confirm.setCursor(Qt.PointingHandCursor)
         btn_confirm.clicked.connect(self.accept_input)
@@ -121,6 +127,7 @@ class LoginDialog(QDialog):
         txt = self.input_name.text().strip()
         if txt:
             self.name = txt
+            self.room = self.input_room.text().strip() or DEFAULT_ROOM
             self.accept()
         else:
             self.input_name.setPlaceholderText("Nickname cannot be empty!")
@@ -131,10 +138,18 @@ class MainWindow(QMainWindow):
         self.host = host
         self.port = port
         self.player_name = ""
+        self.room = DEFAULT_ROOM
         self.is_drawer = False
         self.game_running = False
         self.scores = {} 
         self.ready_status = {}
+        # 玩家列表版本号（来自 Welcome / 完整列表），增量必须逐个递增
+        self.players_version = None
+        self._player_sync_pending = False
+        self._player_items = {}  # name -> QListWidgetItem，增量只改对应的行
+        # 批量处理消息期间，玩家列表只在批次末尾刷新一次
+        self._in_batch = False
+        self._player_list_dirty = False
 
         self.setWindowTitle("DrawGuess - Draw & Guess Online")
         self.resize(1200, 800)
@@ -297,7 +312,7 @@ class MainWindow(QMainWindow):
         self.net = NetworkClient(self.host, self.port)
         self.net.connected.connect(self.on_connected)
         self.net.disconnected.connect(self.on_disconnected)
-        self.net.message_received.connect(self.on_msg)
+        self.net.messages_received.connect(self.on_msgs)
         self.net.error_occurred.connect(lambda e: self.sys_msg(f"❌ Network Error: {e}"))
         self.net.start()
 
@@ -309,18 +324,98 @@ class MainWindow(QMainWindow):
         self.text_chat.append(f"<span style='color:{color}; font-weight:bold;'>{sender}:</span> <span style='color:#cdd6f4'>{text}</span>")
 
     def update_player_list(self):
-        self.list_players.clear()
-        sorted_players = sorted(self.scores.items(), key=lambda x: x[1], reverse=True)
-        for name, score in sorted_players:
-            status_icon = "⚪" # 默认白色圆点
-            if self.ready_status.get(name): 
-                status_icon = "🟢" # 准备好变绿
-            if self.game_running:
-                if name == self.current_drawer_name: status_icon = "🎨"
-                else: status_icon = "🤔"
-            display_text = f"{status_icon} {name}  Points: {score}"
-            if name == self.player_name: display_text += " (Me)"
-            self.list_players.addItem(display_text)
+        """按 scores / ready_status 整体对齐列表：增删行、刷新文字，不清空重建"""
+        if self._in_batch:
+            self._player_list_dirty = True
+            return
+        for name in list(self._player_items):
+            if name not in self.scores:
+                self._remove_player_item(name)
+        for name, _ in sorted(self.scores.items(), key=lambda x: (-x[1], x[0])):
+            self._sync_player_item(name)
+
+    def _player_text(self, name):
+        status_icon = "⚪" # 默认白色圆点
+        if self.ready_status.get(name): 
+            status_icon = "🟢" # 准备好变绿
+        if self.game_running:
+            if name == self.current_drawer_name: status_icon = "🎨"
+            else: status_icon = "🤔"
+        display_text = f"{status_icon} {name}  Points: {self.scores[name]}"
+        if name == self.player_name: display_text += " (Me)"
+        return display_text
+
+    def _sync_player_item(self, name):
+        """新增或刷新一行；分数变化时把这一行挪到按分数排序的新位置"""
+        key = (-self.scores[name], name)
+        row = sum(1 for other, score in self.scores.items()
+                  if other != name and other in self._player_items and (-score, other) < key)
+        item = self._player_items.get(name)
+        if item is None:
+            item = QListWidgetItem()
+            self._player_items[name] = item
+            self.list_players.insertItem(row, item)
+        elif self.list_players.row(item) != row:
+            self.list_players.takeItem(self.list_players.row(item))
+            self.list_players.insertItem(row, item)
+        item.setText(self._player_text(name))
+
+    def _remove_player_item(self, name):
+        item = self._player_items.pop(name, None)
+        if item is not None:
+            self.list_players.takeItem(self.list_players.row(item))
+
+    def update_ready_button(self):
+        """根据最新状态更新“准备”按钮"""
+        if not self.game_running:
+            my_ready = self.ready_status.get(self.player_name, False)
+            self.btn_ready.setEnabled(True)
+            
+            if my_ready:
+                self.btn_ready.setText("❌ Cancel Ready (Cancel)")
+                self.btn_ready.setStyleSheet("background-color: #e78284; color: #1e1e2e; border-bottom: 4px solid #b55a5c;")
+            else:
+                self.btn_ready.setText("🎮 Ready to Start (READY)")
+                self.btn_ready.setStyleSheet("background-color: #a6e3a1; color: #1e1e2e; border-bottom: 4px solid #589656;")
+        else:
+            self.btn_ready.setText("Game in progress...")
+            self.btn_ready.setEnabled(False)
+            self.btn_ready.setStyleSheet("background-color: #45475a; color: #a6adc8; border-bottom: none;")
+
+    def apply_player_delta(self, msg):
+        """应用一条玩家列表增量；版本号跳变说明漏了增量，向服务器请求完整列表"""
+        version = msg.get("version")
+        if self.players_version is None or not isinstance(version, int) or version <= self.players_version:
+            return  # 还没收到 Welcome，或已包含在完整列表里
+        if version != self.players_version + 1:
+            if not self._player_sync_pending:
+                self._player_sync_pending = True
+                self.net.send_message({"type": MSG_PLAYER_SYNC})
+            return
+        self.players_version = version
+
+        for change in msg.get("changes", []):
+            op = change.get("op")
+            name = change.get("name")
+            if op == "add":
+                self.scores[name] = change.get("score", 0)
+                self.ready_status[name] = change.get("is_ready", False)
+                self._sync_player_item(name)
+            elif op == "remove":
+                self.scores.pop(name, None)
+                self.ready_status.pop(name, None)
+                self._remove_player_item(name)
+            elif op == "set" and name in self.scores:
+                if change.get("field") == "score":
+                    self.scores[name] = change.get("value", 0)
+                elif change.get("field") == "is_ready":
+                    self.ready_status[name] = change.get("value", False)
+                self._sync_player_item(name)
+            elif op == "reset_ready":
+                for other in self.ready_status:
+                    self.ready_status[other] = False
+                self.update_player_list()
+        self.update_ready_button()
 
     def set_game_ui_state(self, is_drawer):
         self.is_drawer = is_drawer
@@ -341,10 +436,16 @@ class MainWindow(QMainWindow):
         dlg = LoginDialog(self)
         if dlg.exec_():
             self.player_name = dlg.name
-            self.net.send_message({"type": MSG_SET_NAME, "name": self.player_name})
+            self.room = dlg.room
         else:
             self.player_name = "Guest"
-            self.net.send_message({"type": MSG_SET_NAME, "name": self.player_name})
+        # formats 声明本端支持二进制绘图帧和 PNG 画布快照，由服务器在 MSG_WELCOME 中确认
+        self.net.send_message({
+            "type": MSG_SET_NAME,
+            "name": self.player_name,
+            "room": self.room,
+            "formats": [FORMAT_JSON, FORMAT_BINARY, SNAPSHOT_PNG, CANVAS_RESYNC]
+        })
 
     def on_disconnected(self):
         self.lbl_info.setText("❌ Server Disconnected")
@@ -368,6 +469,31 @@ class MainWindow(QMainWindow):
         # 暂时禁用按钮防止连点，等服务器广播回来再刷新
         self.btn_ready.setEnabled(False) 
 
+    def on_msgs(self, batch):
+        """处理网络线程一次发来的一批消息"""
+        self._in_batch = True
+        draw_ops = []
+        try:
+            for msg in batch:
+                # 连续的绘图消息合并成一次渲染调用
+                if msg.get("type") == MSG_DRAW:
+                    data = msg.get("data")
+                    if isinstance(data, dict):
+                        draw_ops.append(data)
+                    continue
+                if draw_ops:
+                    self.draw_widget.draw_remote_batch(draw_ops)
+                    draw_ops = []
+                self.on_msg(msg)
+            if draw_ops:
+                self.draw_widget.draw_remote_batch(draw_ops)
+        finally:
+            self._in_batch = False
+
+        if self._player_list_dirty:
+            self._player_list_dirty = False
+            self.update_player_list()
+
     def on_msg(self, msg):
         mtype = msg.get("type")
         
@@ -383,35 +509,48 @@ class MainWindow(QMainWindow):
                 name = p['name']
                 self.scores[name] = p['score']
                 self.ready_status[name] = p.get('is_ready', False)
+            self.players_version = msg.get("players_version" if mtype == MSG_WELCOME else "version")
+            self._player_sync_pending = False
             
             # 如果是 Welcome 消息，处理额外字段
             if mtype == MSG_WELCOME:
+                # 重名时服务器会改写昵称；换房间时也会重新收到 Welcome
+                self.player_name = msg.get("player_name", self.player_name)
+                self.room = msg.get("room", DEFAULT_ROOM)
                 self.game_running = msg.get("in_game", False)
                 self.current_drawer_name = msg.get("drawer")
-                self.sys_msg(f"Successfully joined the room! Players online: {len(self.scores)}")
-                self.lbl_info.setText(f"👤 {self.player_name}")
+                self.draw_widget.clear_all_local_only()
+                self.set_game_ui_state(False)
+                self.sys_msg(f"Successfully joined room <b>{self.room}</b>! Players online: {len(self.scores)}")
+                self.lbl_info.setText(f"👤 {self.player_name} | 🏠 {self.room}")
 
             # 刷新列表 UI
             self.update_player_list()
-            
-            # 根据最新状态更新“准备”按钮
-            if not self.game_running:
-                my_ready = self.ready_status.get(self.player_name, False)
-                self.btn_ready.setEnabled(True)
-                
-                if my_ready:
-                    self.btn_ready.setText("❌ Cancel Ready (Cancel)")
-                    self.btn_ready.setStyleSheet("background-color: #e78284; color: #1e1e2e; border-bottom: 4px solid #b55a5c;")
-                else:
-                    self.btn_ready.setText("🎮 Ready to Start (READY)")
-                    self.btn_ready.setStyleSheet("background-color: #a6e3a1; color: #1e1e2e; border-bottom: 4px solid #589656;")
-            else:
-                self.btn_ready.setText("Game in progress...")
-                self.btn_ready.setEnabled(False)
-                self.btn_ready.setStyleSheet("background-color: #45475a; color: #a6adc8; border-bottom: none;")
-                
-                if mtype == MSG_WELCOME and self.game_running:
-                    self.set_game_ui_state(False)
+            self.update_ready_button()
+
+            if mtype == MSG_WELCOME and self.game_running:
+                self.set_game_ui_state(False)
+
+        elif mtype == MSG_PLAYER_DELTA:
+            self.apply_player_delta(msg)
+
+        elif mtype == MSG_CANVAS_SNAPSHOT:
+            # 中途加入：服务器补发的本轮画布，紧跟在 Welcome 之后
+            # 可能带一张较早笔画的 PNG 底图，ops 是底图之后的笔画
+            # reset=True：本端网络落后、部分笔画被服务器丢弃，或画手撤销进了本端的底图，先清空再按快照重画
+            if msg.get("reset"):
+                if msg.get("room", self.room) != self.room:
+                    return
+                self.draw_widget.clear_all_local_only()
+            image = msg.get("image")
+            if image:
+                self.draw_widget.load_base_image(base64.b64decode(image))
+            self.draw_widget.draw_remote_batch(msg.get("ops", []))
+
+        elif mtype == MSG_ROOM_LIST:
+            rooms = msg.get("rooms", [])
+            lines = [f"{r['room']} ({r['players']} players{', playing' if r.get('in_game') else ''})" for r in rooms]
+            self.sys_msg("Rooms: " + ("; ".join(lines) if lines else "none"))
 
         elif mtype == MSG_PLAYER_JOIN:
             name = msg.get("player_name")
@@ -446,7 +585,8 @@ class MainWindow(QMainWindow):
             self.text_chat.append(f"<br><center><b style='color:#f9e2af; font-size:14px;'>=== Round {round_id} Started ===</b></center>")
             self.sys_msg(f"Drawer: <b style='color:#f38ba8'>{drawer}</b> | Hint: {hint}")
             
-            # Server 稍后会发 update_players 刷新列表状态
+            # 所有人的状态图标随之变化（画手/猜词），本地刷新即可；准备状态的清空由随后的增量同步
+            self.update_player_list()
 
         elif mtype == MSG_ASSIGN_WORD:
             word = msg.get("word")
@@ -459,12 +599,13 @@ class MainWindow(QMainWindow):
         elif mtype == MSG_ROUND_RESULT:
             winner = msg.get("winner")
             ans = msg.get("answer")
-            # 这里 scores 更新由 update_players 处理，这里只负责显示结果
+            # 分数变化由随后的 player_delta 同步，这里只负责显示结果
             
             self.game_running = False
             self.set_game_ui_state(False)
             self.text_chat.append(f"<center><b style='color:#a6e3a1; font-size:15px;'>🎉 {winner} guessed it correctly! 🎉</b></center>")
             self.text_chat.append(f"<center>The answer was: <b style='color:#fab387'>{ans}</b></center><br>")
+            self.update_player_list()
             
             # 按钮状态会由随后的 update_players 刷新重置
 
@@ -472,6 +613,21 @@ class MainWindow(QMainWindow):
         text = self.input_edit.text().strip()
         if not text: return
         self.input_edit.clear()
+        # 房间命令：/rooms 列出房间，/join <房间> 加入（不存在则创建），/create 新建房间
+        if text == "/rooms":
+            self.net.send_message({"type": MSG_ROOM_LIST})
+            return
+        if text == "/create":
+            self.net.send_message({"type": MSG_CREATE_ROOM})
+            return
+        if text.startswith("/join "):
+            self.net.send_message({"type": MSG_JOIN_ROOM, "room": text[6:].strip()})
+            return
+        # 本地显示命令：/smooth 开关对他人笔迹的样条平滑
+        if text == "/smooth":
+            self.draw_widget.smooth_remote = not self.draw_widget.smooth_remote
+            self.sys_msg(f"Stroke smoothing {'on' if self.draw_widget.smooth_remote else 'off'}")
+            return
         if self.game_running and not self.is_drawer:
             self.net.send_message({"type": MSG_GUESS, "text": text})
         else:
@@ -483,4 +639,5 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         self.net.stop()
         self.net.wait(1000)
+        self.draw_widget.stop_render_thread()
         super().closeEvent(event)
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""
+aio_engine.py
+asyncio 服务器引擎：所有连接共享一个事件循环，不再一连接一线程。
+游戏逻辑（GameState / _process_message）与线程引擎完全共用。
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from Shared.protocol import MSG_SET_NAME, FORMAT_JSON, FrameDecoder, parse_frame
+from connection import OutboundQueue, LAG_TIMEOUT
+
+# transport 自身缓冲区上限：超过后暂停写入，后续数据留在 OutboundQueue 中
+TRANSPORT_HIGH_WATER = 64 * 1024
+# 换房间移交前检查发送是否排空的间隔（秒）
+DRAIN_POLL = 0.01
+
+class AsyncClientConnection(asyncio.Protocol):
+    """
+    单个客户端连接。
+    对 GuessDrawServer 暴露与 ThreadedConnection 相同的 send / close 接口，
+    因此可以直接作为 GameState.clients 的键使用。
+    """
+    def __init__(self, server, connections):
+        self.server = server
+        self.connections = connections  # 引擎持有的全部连接，退出时统一关闭
+        self.transport = None
+        self.player_name = None
+        self.room = None                # 所在房间的 GameState
+        self.draw_format = FORMAT_JSON  # 握手时协商的绘图编码
+        self.snapshot_png = False       # 能否接收 PNG 画布快照
+        self.canvas_resync = False      # 落后时能否丢弃绘图帧、改发画布快照
+        self.rehome = None              # 分片模式下待移交的 (房间号, 昵称)
+        self.limiter = None             # 登录后由服务器设置的限流状态
+        self.decoder = FrameDecoder()
+        self.queue = OutboundQueue()
+        self._paused = False
+        self._flush_handle = None       # tick 模式下已排定的下一次批量写出
+        self._resync_scheduled = False  # 已排定补发画布
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=TRANSPORT_HIGH_WATER)
+        # asyncio 默认已为 TCP transport 开启 TCP_NODELAY，批量写出由下面的 tick 控制
+        self.connections.add(self)
+        self.server.metrics.inc("connections_opened")
+        print(f"[SERVER] 新连接: {transport.get_extra_info('peername')}")
+
+    def data_received(self, data):
+        if self.rehome is not None:
+            return
+        try:
+            frames = self.decoder.feed(data)
+            for i, frame in enumerate(frames):
+                if self.player_name is None:
+                    # 握手阶段：只认 MSG_SET_NAME
+                    msg = parse_frame(frame)
+                    if msg and msg.get("type") == MSG_SET_NAME:
+                        self.server.metrics.count_in(MSG_SET_NAME, len(frame))
+                        self.player_name = self.server._register_player(self, msg)
+                        self.server._welcome_player(self, self.player_name)
+                    continue
+                self.server._handle_frame(self, frame)
+                if self.rehome is not None:
+                    # 换到其他进程的房间：剩余数据随连接一起移交
+                    rest = b"".join(frames[i + 1:]) + self.decoder.pending()
+                    self.server._rehome(self, rest)
+                    return
+        except Exception as e:
+            print(f"[ERROR] {self.player_name}: {e}")
+            self.close()
+
+    def connection_lost(self, exc):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.connections.discard(self)
+        self.server.metrics.inc("connections_closed")
+        if self.player_name:
+            print(f"[SERVER] {self.player_name} 断开连接")
+            self.server._unregister_player(self, self.player_name)
+            self.player_name = None
+
+    # === 发送接口 ===
+    def send(self, data, droppable=False, bulk=False):
+        """droppable 表示落后时可丢弃的绘图帧，bulk 表示不计入积压上限的画布快照，见 OutboundQueue"""
+        if self.transport is None or self.transport.is_closing():
+            return
+        if not self.queue.push(data, droppable, bulk):
+            print(f"[SERVER] 断开慢客户端 {self.player_name}: 发送队列积压超限")
+            self.transport.abort()
+            return
+        if self._paused:
+            return
+        tick = self.server.write_tick
+        if not tick:
+            self._flush()
+        elif self._flush_handle is None:
+            # tick 模式：第一帧入队时排定一次写出，tick 秒内到达的帧一并发出
+            self._flush_handle = asyncio.get_running_loop().call_later(tick, self._flush_batch)
+
+    def _flush_batch(self):
+        self._flush_handle = None
+        if self._paused or self.transport.is_closing():
+            return
+        if self.queue:
+            # 整批一次写入（Python 3.12 起 writelines 直接走 sendmsg，之前拼接后一次 send）
+            frames = self.queue.pop_all()
+            self.transport.writelines(frames)
+            self.queue.done(sum(len(f) for f in frames))
+        self._check_resync()
+
+    def _flush(self):
+        # transport.write 超过高水位时会同步回调 pause_writing，循环随之停止
+        while self.queue and not self._paused:
+            frame = self.queue.popleft()
+            self.transport.write(frame)
+            self.queue.done(len(frame))
+        self._check_resync()
+
+    def _check_resync(self):
+        # send 可能正在房间画布锁内被调用，补发画布留到事件循环的下一轮
+        if self.queue.wants_resync() and not self._paused and not self._resync_scheduled:
+            self._resync_scheduled = True
+            asyncio.get_running_loop().call_soon(self._resync)
+
+    def _resync(self):
+        self._resync_scheduled = False
+        if self.transport is None or self.transport.is_closing():
+            return
+        if self.queue.wants_resync():
+            self.server.resync_canvas(self)
+
+    def resync_done(self, data):
+        """补发画布：快照 data 作为大块帧入队（不计入积压上限），之后的绘图帧恢复正常转发"""
+        self.queue.finish_resync()
+        if data is not None:
+            self.send(data, bulk=True)
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._flush()
+
+    def queue_stats(self):
+        stats = self.queue.stats()
+        if self.transport is not None:
+            stats["bytes"] += self.transport.get_write_buffer_size()
+        return stats
+
+    def detach(self, on_detached):
+        """
+        交出底层 socket：停止读取，等发送队列和 transport 写缓冲都排空后，
+        以 dup 出的新对象调用 on_detached(sock)，transport 随即丢弃，TCP 连接保持不变
+        接手的进程会往同一条 TCP 流继续写，先排空才不会留下半截帧；
+        LAG_TIMEOUT 内排不空（对端不收）时断开连接，以 None 调用
+        """
+        self.transport.pause_reading()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._paused:
+            self._flush()
+        loop = asyncio.get_running_loop()
+        self._wait_drained(on_detached, loop.time() + LAG_TIMEOUT)
+
+    def _wait_drained(self, on_detached, deadline):
+        transport = self.transport
+        if transport.is_closing():
+            on_detached(None)
+        elif not self.queue and transport.get_write_buffer_size() == 0:
+            sock = transport.get_extra_info("socket").dup()
+            transport.abort()
+            on_detached(sock)
+        elif asyncio.get_running_loop().time() > deadline:
+            print(f"[SERVER] 断开慢客户端 {self.player_name}: 换房间前发送队列未能排空")
+            transport.abort()
+            on_detached(None)
+        else:
+            asyncio.get_running_loop().call_later(DRAIN_POLL, self._wait_drained, on_detached, deadline)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+async def _serve(server):
+    loop = asyncio.get_running_loop()
+    connections = set()
+    server._aio_connections = connections
+    server._loop = loop
+
+    try:
+        if server.sock is None:
+            # 不监听端口（分片 worker）：连接全部经 adopt_socket 投递进来
+            while server.running:
+                await asyncio.sleep(0.5)
+            return
+        aio_server = await loop.create_server(
+            lambda: AsyncClientConnection(server, connections),
+            sock=server.sock
+        )
+        async with aio_server:
+            # 与线程引擎的 accept 超时一致：定期检查停止信号
+            while server.running:
+                await asyncio.sleep(0.5)
+    finally:
+        for conn in list(connections):
+            conn.close()
+        # 让 connection_lost 回调有机会执行
+        await asyncio.sleep(0)
+
+async def _adopt(server, sock, initial):
+    loop = asyncio.get_running_loop()
+    _, conn = await loop.connect_accepted_socket(
+        lambda: AsyncClientConnection(server, server._aio_connections),
+        sock=sock
+    )
+    if initial:
+        conn.data_received(initial)
+
+def adopt_socket(server, sock, initial=b""):
+    """从其他线程把一个已建立的 socket 交给正在运行的事件循环"""
+    asyncio.run_coroutine_threadsafe(_adopt(server, sock, initial), server._loop)
+
+def run_asyncio(server):
+    """在当前线程运行事件循环，直到 server.running 变为 False"""
+    try:
+        asyncio.run(_serve(server))
+    finally:
+        server._loop = None
@@ -0,0 +1,304 @@
+"""
+connection.py
+客户端连接与发送队列：每个连接一个有界发送队列，由自己的 writer 排空，
+广播方只负责入队，慢客户端不会拖住其他人。
+落后的接收方丢弃排队中的绘图帧，追上后改发一份画布快照；其余消息照常按序送达。
+"""
+
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from Shared.protocol import FORMAT_JSON
+
+# ---- 发送队列参数 ----
+HIGH_WATER = 256 * 1024        # 积压超过该字节数视为“落后”
+MAX_QUEUE_BYTES = 1024 * 1024  # 积压超过该字节数直接断开
+LAG_TIMEOUT = 5.0              # 持续落后超过该秒数断开
+IOV_MAX = 1024                 # 单次 sendmsg 最多携带的缓冲区数（Linux 的 UIO_MAXIOV）
+
+def set_nodelay(sock):
+    """
+    关闭 Nagle：服务器自己决定何时成批写出（writer 一次排空积压，或按 tick 攒批），
+    再叠加 Nagle 只会让小帧在等 ACK 时被延迟确认拖上几十毫秒。
+    也不使用 TCP_CORK：每批已经是一次 sendmsg，内核按整批切分报文段，不需要再塞住等待
+    """
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        pass  # 非 TCP socket
+
+def send_frames(sock, frames):
+    """
+    把多帧一次交给内核（sendmsg 即 writev 语义，省去拼接拷贝），处理部分写入；
+    没有 sendmsg 的平台拼接后 sendall
+    """
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(frames))
+        return
+    views = [memoryview(f) for f in frames]
+    i = 0
+    while i < len(views):
+        sent = sock.sendmsg(views[i:i + IOV_MAX])
+        # 跳过已整帧发出的部分，剩下的半帧切片后继续
+        while i < len(views) and sent >= len(views[i]):
+            sent -= len(views[i])
+            i += 1
+        if sent:
+            views[i] = views[i][sent:]
+
+class OutboundQueue:
+    """
+    有界发送队列（非线程安全，由所属连接加锁）
+    bytes 统计“已入队但尚未确认发出”的字节数：出队后需调用 done() 扣减
+
+    帧分两类：
+    - 可靠帧（回合开始 / 结果、题目、聊天、玩家列表等）：按序送达，积压过久才断开
+    - 可丢弃帧（绘图帧）：积压超过高水位时，队列里尚未发出的绘图帧全部丢弃并标记 resync，
+      之后的绘图帧直接丢弃，等队列排空后由连接请服务器补发一份画布快照（最新状态为准）
+    - 大块帧（画布快照）：按序送达但不计入 bytes，不触发高水位 / 断开；
+      每次补发或入房只有一份，大小受画布上限约束，不会无限堆积
+    """
+    def __init__(self, high_water=HIGH_WATER, max_bytes=MAX_QUEUE_BYTES, lag_timeout=LAG_TIMEOUT):
+        self.high_water = high_water
+        self.max_bytes = max_bytes
+        self.lag_timeout = lag_timeout
+        self.frames = deque()
+        self.droppable = deque()   # 与 frames 一一对应：该帧能否丢弃
+        self.counted = deque()     # 与 frames 一一对应：计入 bytes 的字节数（大块帧为 0）
+        self.bytes = 0
+        self.uncounted = 0         # 已出队、尚未 done() 的大块帧字节
+        self.lagging_since = None  # 首次超过高水位的时间
+        self.resync = False        # 丢过绘图帧，排空后需要补发画布
+        self.shed = 0              # 累计丢弃的绘图帧数
+
+    def __len__(self):
+        return len(self.frames)
+
+    def push(self, data, droppable=False, bulk=False):
+        """入队，返回 False 表示积压超限，该连接应被断开"""
+        if bulk:
+            self.frames.append(data)
+            self.droppable.append(False)
+            self.counted.append(0)
+            return True
+        if droppable:
+            if self.resync:
+                self.shed += 1
+                return True
+            if self.bytes + len(data) > self.high_water:
+                self._shed()
+                self.shed += 1
+                return self._check()
+        self.frames.append(data)
+        self.droppable.append(droppable)
+        self.counted.append(len(data))
+        self.bytes += len(data)
+        return self._check()
+
+    def _shed(self):
+        """丢掉队列中所有未发出的绘图帧，可靠帧保持原有顺序"""
+        kept = deque()
+        counted = deque()
+        for data, droppable, size in zip(self.frames, self.droppable, self.counted):
+            if droppable:
+                self.bytes -= size
+                self.shed += 1
+            else:
+                kept.append(data)
+                counted.append(size)
+        self.frames = kept
+        self.counted = counted
+        self.droppable = deque([False]) * len(kept)
+        self.resync = True
+
+    def popleft(self):
+        self.droppable.popleft()
+        data = self.frames.popleft()
+        self.uncounted += len(data) - self.counted.popleft()
+        return data
+
+    def pop_all(self):
+        frames = list(self.frames)
+        self.uncounted += sum(len(f) for f in frames) - sum(self.counted)
+        self.frames.clear()
+        self.droppable.clear()
+        self.counted.clear()
+        return frames
+
+    def wants_resync(self):
+        """已丢过绘图帧且积压已排空：该补发画布了"""
+        return self.resync and not self.frames
+
+    def finish_resync(self):
+        """补发的画布快照入队前调用：之后的绘图帧恢复正常入队"""
+        self.resync = False
+
+    def done(self, nbytes):
+        """确认 nbytes 已交给内核（出队后的帧长之和，大块帧部分不扣 bytes）"""
+        uncounted = min(self.uncounted, nbytes)
+        self.uncounted -= uncounted
+        self.bytes -= nbytes - uncounted
+        if self.bytes <= self.high_water:
+            self.lagging_since = None
+
+    def _check(self):
+        if self.bytes > self.max_bytes:
+            return False
+        # 丢弃绘图帧后积压通常回到高水位以下；只剩可靠帧也排不空的连接照样会被断开
+        if self.bytes > self.high_water:
+            now = time.monotonic()
+            if self.lagging_since is None:
+                self.lagging_since = now
+            elif now - self.lagging_since > self.lag_timeout:
+                return False
+        return True
+
+    def stats(self):
+        return {
+            "frames": len(self.frames),
+            "bytes": self.bytes,
+            "lagging": self.lagging_since is not None,
+            "shed": self.shed
+        }
+
+class ThreadedConnection:
+    """
+    线程引擎下的客户端连接：
+    读仍在 handle_client 线程里阻塞 recv，写由独立的 writer 线程排空发送队列
+    tick 大于 0 时按定时批量写出：队列里来了第一帧后再等 tick 秒，期间入队的帧一次 sendmsg 发出
+    """
+    def __init__(self, sock, addr=None, tick=0.0, on_resync=None):
+        self.sock = sock
+        self.addr = addr
+        self.tick = tick
+        self.on_resync = on_resync      # 丢过绘图帧、队列排空后调用，由服务器补发画布
+        self.player_name = None
+        self.room = None                # 所在房间的 GameState
+        self.draw_format = FORMAT_JSON  # 握手时协商的绘图编码
+        self.snapshot_png = False       # 能否接收 PNG 画布快照
+        self.canvas_resync = False      # 落后时能否丢弃绘图帧、改发画布快照
+        self.rehome = None              # 分片模式下待移交的 (房间号, 昵称)
+        self.limiter = None             # 登录后由服务器设置的限流状态
+        self.queue = OutboundQueue()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._detaching = False         # 准备交出 socket：writer 发完队列后退出
+        set_nodelay(sock)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def recv(self, bufsize):
+        return self.sock.recv(bufsize)
+
+    def send(self, data, droppable=False, bulk=False):
+        """
+        入队后立即返回，不会阻塞调用方；droppable 表示落后时可丢弃的绘图帧，
+        bulk 表示不计入积压上限的画布快照
+        """
+        with self._cond:
+            if self._closed:
+                return
+            ok = self.queue.push(data, droppable, bulk)
+            # writer 只在队列为空时等待；tick 攒批期间不必反复唤醒它
+            if len(self.queue) == 1 or self.queue.wants_resync():
+                self._cond.notify()
+        if not ok:
+            self._drop("发送队列积压超限")
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self.queue and not self.queue.resync and not self._closed and not self._detaching:
+                    self._cond.wait()
+                if self.tick and self.queue and not self._detaching:
+                    # 攒批窗口：close / detach 时被 notify 提前结束
+                    deadline = time.monotonic() + self.tick
+                    while not self._closed and not self._detaching:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                if self._closed:
+                    return
+                if self._detaching and not self.queue:
+                    # 队列已发完：之后入队的帧直接丢弃，不会与接手的进程交错写入
+                    self._closed = True
+                    return
+                frames = self.queue.pop_all()
+
+            if frames:
+                nbytes = sum(len(f) for f in frames)
+                try:
+                    send_frames(self.sock, frames)
+                except OSError:
+                    self._drop(None)
+                    return
+            with self._cond:
+                if frames:
+                    self.queue.done(nbytes)
+                resync = self.queue.wants_resync() and not self._detaching
+            if resync:
+                # 不持有本连接的锁：服务器要先取房间的画布锁，再回调 resync_done
+                if self.on_resync is not None:
+                    self.on_resync(self)
+                else:
+                    self.resync_done(None)
+
+    def resync_done(self, data):
+        """
+        补发画布：快照 data 作为大块帧入队（不计入积压上限），之后的绘图帧恢复正常转发
+        调用方持有房间画布锁，两步之间不会有绘图帧插进来
+        """
+        with self._cond:
+            self.queue.finish_resync()
+        if data is not None:
+            self.send(data, bulk=True)
+
+    def _drop(self, reason):
+        """关闭读写两端，让 handle_client 的 recv 返回并走正常的离开流程"""
+        if reason:
+            print(f"[SERVER] 断开慢客户端 {self.addr}: {reason}")
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def queue_stats(self):
+        with self._cond:
+            return self.queue.stats()
+
+    def detach(self, on_detached):
+        """
+        交出底层 socket：等 writer 把发送队列发完并退出后，以 dup 出来的新对象调用 on_detached(sock)，
+        原 socket 随即关闭，但 TCP 连接本身保持不变
+        接手的进程会往同一条 TCP 流继续写，先发完才不会留下半截帧；
+        writer 在 LAG_TIMEOUT 内没能退出（对端不收）时断开连接，以 None 调用
+        """
+        with self._cond:
+            self._detaching = True
+            self._cond.notify()
+        self._writer.join(LAG_TIMEOUT)
+        if self._writer.is_alive():
+            self._drop("换房间前发送队列未能排空")
+            self.close()
+            on_detached(None)
+            return
+        sock = self.sock.dup()
+        self.sock.close()
+        on_detached(sock)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
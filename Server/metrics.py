@@ -0,0 +1,272 @@
+"""
+metrics.py
+服务器内置的计数器与直方图：按消息类型统计收发条数 / 字节、广播扇出耗时、
+房间锁等待时间、连接数与回合数。
+通过控制台的 stats 命令或本机 HTTP 端点（--stats-port）查看。
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from Shared import protocol
+
+# 协议里定义过的消息类型；客户端乱填的 type 统一记为 other，防止计数表无限增长
+MESSAGE_TYPES = {v for k, v in vars(protocol).items() if k.startswith("MSG_")}
+
+# 直方图桶按 2 的幂划分（微秒）：桶 i 收 [2^(i-1), 2^i) 微秒，最后一桶约 8 秒以上
+BUCKETS = 24
+
+class Histogram:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+        for i, n in enumerate(list(other.buckets)):
+            self.buckets[i] += n
+
+    def percentile(self, p):
+        """按桶估算的分位数（取所在桶的上界，不超过最大值），单位秒"""
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count * 1e6 if self.count else 0.0,
+            "p50_us": self.percentile(50) * 1e6,
+            "p99_us": self.percentile(99) * 1e6,
+            "max_us": self.max * 1e6,
+        }
+
+class _Shard:
+    """单个线程私有的一份计数；只有所属线程写，合并时由 snapshot() 读"""
+    __slots__ = ("thread", "counters", "histograms", "traffic")
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}
+        self.histograms = {}
+        self.traffic = {}  # 消息类型 -> [收条数, 收字节, 发条数, 发字节]
+
+    def absorb(self, other):
+        """把另一分片的数据累加进来（读取时先复制，避免对方线程同时写入）"""
+        for name, n in dict(other.counters).items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        for mtype, row in dict(other.traffic).items():
+            mine = self.traffic.get(mtype)
+            if mine is None:
+                mine = self.traffic[mtype] = [0, 0, 0, 0]
+            for i, v in enumerate(list(row)):
+                mine[i] += v
+        for name, hist in dict(other.histograms).items():
+            mine = self.histograms.get(name)
+            if mine is None:
+                mine = self.histograms[name] = Histogram()
+            mine.merge(hist)
+
+class Metrics:
+    """
+    指标表：每个线程写自己的分片，热路径上不取共享锁；
+    _lock 只在线程首次登记分片和 snapshot() 合并时持有。asyncio 引擎只有一个分片
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard(None)  # 已退出线程的分片并到这里，列表不随连接数增长
+        self.started = time.time()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._retire_dead()
+                self._shards.append(shard)
+        return shard
+
+    def _retire_dead(self):
+        """调用方持有 _lock；线程已退出的分片不会再被写，可以安全合并"""
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                self._retired.absorb(shard)
+        self._shards = alive
+
+    def inc(self, name, n=1):
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        histograms = self._shard().histograms
+        hist = histograms.get(name)
+        if hist is None:
+            hist = histograms[name] = Histogram()
+        hist.observe(seconds)
+
+    def count_in(self, mtype, nbytes):
+        self._count(mtype, 0, 1, nbytes)
+
+    def count_out(self, mtype, msgs, nbytes):
+        """发出 msgs 条（广播时按接收方计），共 nbytes 字节"""
+        if msgs:
+            self._count(mtype, 2, msgs, nbytes)
+
+    def _count(self, mtype, offset, msgs, nbytes):
+        if mtype not in MESSAGE_TYPES:
+            mtype = "other"
+        traffic = self._shard().traffic
+        row = traffic.get(mtype)
+        if row is None:
+            row = traffic[mtype] = [0, 0, 0, 0]
+        row[offset] += msgs
+        row[offset + 1] += nbytes
+
+    def snapshot(self):
+        """合并各线程分片；其他线程可能正在写，结果是近似的瞬时值"""
+        total = _Shard(None)
+        with self._lock:
+            self._retire_dead()
+            total.absorb(self._retired)
+            for shard in self._shards:
+                total.absorb(shard)
+        return {
+            "uptime": time.time() - self.started,
+            "counters": total.counters,
+            "traffic": {
+                t: {"in_msgs": r[0], "in_bytes": r[1], "out_msgs": r[2], "out_bytes": r[3]}
+                for t, r in total.traffic.items()
+            },
+            "timings": {name: h.summary() for name, h in total.histograms.items()},
+        }
+
+class TimedLock:
+    """threading.Lock 的替身，把获取锁前的等待时间记入直方图（写本线程分片，不再多取一把锁）"""
+    def __init__(self, metrics, name):
+        self._lock = threading.Lock()
+        self.metrics = metrics
+        self.name = name
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        ok = self._lock.acquire(blocking, timeout)
+        if ok:
+            self.metrics.observe(self.name, time.perf_counter() - start)
+        return ok
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+# === 输出 ===
+def render_text(report, top=5):
+    """把 GuessDrawServer.stats_report() 的结果排成便于阅读的文本"""
+    counters = report["counters"]
+    lines = [
+        f"uptime {report['uptime']:.0f}s, engine {report['engine']}",
+        f"connections: active {report['connections']} "
+        f"(opened {counters.get('connections_opened', 0)}, closed {counters.get('connections_closed', 0)})",
+        f"rooms: {report['rooms']}, rounds started {counters.get('rounds_started', 0)}, "
+        f"finished {counters.get('rounds_finished', 0)}",
+        "",
+        f"{'type':<16}{'in_msgs':>10}{'in_bytes':>12}{'out_msgs':>10}{'out_bytes':>12}",
+    ]
+    for mtype, row in sorted(report["traffic"].items()):
+        lines.append(f"{mtype:<16}{row['in_msgs']:>10}{row['in_bytes']:>12}"
+                     f"{row['out_msgs']:>10}{row['out_bytes']:>12}")
+
+    lines += ["", f"{'timing (us)':<28}{'count':>9}{'mean':>9}{'p50':>9}{'p99':>9}{'max':>10}"]
+    for name, t in sorted(report["timings"].items()):
+        lines.append(f"{name:<28}{t['count']:>9}{t['mean_us']:>9.1f}{t['p50_us']:>9.0f}"
+                     f"{t['p99_us']:>9.0f}{t['max_us']:>10.0f}")
+
+    limited = sorted((k[len("ratelimit."):], v) for k, v in counters.items() if k.startswith("ratelimit."))
+    if limited:
+        lines += ["", "rate limited: " + ", ".join(f"{k} {v}" for k, v in limited)]
+
+    queues = report["queues"]
+    lagging = sum(1 for q in queues if q["lagging"])
+    lines += ["", f"outbound queues: {len(queues)} clients, "
+                  f"{sum(q['frames'] for q in queues)} frames / {sum(q['bytes'] for q in queues)} bytes queued, "
+                  f"{lagging} lagging; {sum(q.get('shed', 0) for q in queues)} draw frames shed, "
+                  f"{counters.get('canvas_resyncs', 0)} canvas resyncs"]
+    for q in sorted(queues, key=lambda q: q["bytes"], reverse=True)[:top]:
+        if not q["bytes"]:
+            break
+        flag = " (lagging)" if q["lagging"] else ""
+        lines.append(f"  [{q['room']}] {q['name']}: {q['frames']} frames / {q['bytes']} bytes{flag}")
+    return "\n".join(lines)
+
+class _StatsHandler(BaseHTTPRequestHandler):
+    server_version = "DrawGuessStats"
+
+    def do_GET(self):
+        if self.path in ("/", "/stats"):
+            body = render_text(self.server.source()).encode("utf-8")
+            ctype = "text/plain; charset=utf-8"
+        elif self.path == "/json":
+            body = json.dumps(self.server.source(), ensure_ascii=False).encode("utf-8")
+            ctype = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不刷屏
+
+def start_stats_server(source, port, host="127.0.0.1"):
+    """
+    在后台线程提供 HTTP 统计端点：/ 为文本，/json 为 JSON
+    source 是无参函数，每次请求调用一次取最新报告；默认只监听本机
+    """
+    httpd = ThreadingHTTPServer((host, port), _StatsHandler)
+    httpd.daemon_threads = True
+    httpd.source = source
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
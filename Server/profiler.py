@@ -0,0 +1,166 @@
+"""
+profiler.py
+低开销的采样分析器：后台线程按固定间隔读取所有线程的 Python 调用栈
+（线程引擎的各 handler 线程、asyncio 引擎的事件循环线程都在内），
+停止时写出 collapsed stack（flamegraph.pl / speedscope 可直接读取），
+以及采样期间 _handle_frame 按消息类型统计的处理耗时。
+不需要重启服务器：控制台 profile 命令、SIGUSR1 或启动参数 --profile 都可以开始 / 停止。
+"""
+
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from metrics import MESSAGE_TYPES
+
+SAMPLE_INTERVAL = 0.005  # 采样间隔（秒），约 200 Hz
+MAX_STACK_DEPTH = 64
+
+# 叶子帧是这些等待点的样本视为空闲（阻塞在 recv / 条件变量 / select 上），单独计数不进火焰图
+IDLE_LEAVES = {
+    ("threading", "wait"),
+    ("threading", "_wait_for_tstate_lock"),
+    ("selectors", "select"),
+    ("connection", "recv"),
+    ("socket", "accept"),
+    ("socket", "recv_fds"),
+    ("server", "start"),     # 不监听端口时的 sleep 循环
+    ("server", "<module>"),  # 控制台主线程等待 input()
+}
+
+class SamplingProfiler:
+    def __init__(self, output_dir="."):
+        self.output_dir = Path(output_dir)
+        self.running = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._timer = None
+        self._labels = {}  # code 对象 -> "模块:函数"，避免每次采样都拆路径
+        self._reset()
+
+    def _reset(self):
+        self.stacks = {}    # "a;b;c" -> 样本数
+        self.handlers = {}  # 消息类型 -> [次数, 总耗时, 最大耗时]
+        self.samples = 0
+        self.idle = 0
+        self.started = None
+
+    # === 开始 / 停止 ===
+    def start(self, duration=None):
+        """开始采样；给出 duration（秒）时到点自动停止并写出结果。已在运行返回 False"""
+        with self._lock:
+            if self.running:
+                return False
+            self._reset()
+            self.started = time.time()
+            self._stop_event.clear()
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+            if duration:
+                self._timer = threading.Timer(duration, self.stop)
+                self._timer.daemon = True
+                self._timer.start()
+        print(f"[PROFILE] 开始采样" + (f"，{duration:g} 秒后自动停止" if duration else ""))
+        return True
+
+    def stop(self):
+        """停止采样并写出结果，返回 (火焰图文件, 耗时表文件)；未在运行返回 None"""
+        with self._lock:
+            if not self.running:
+                return None
+            self.running = False
+            self._stop_event.set()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            thread = self._thread
+        thread.join()
+        return self._write()
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def toggle_from_signal(self, signum=None, frame=None):
+        """
+        可直接作为 SIGUSR1 处理函数：处理函数跑在被打断的主线程上，
+        若主线程正持有 _lock（如控制台的 profile 命令），在这里取锁会自锁，
+        所以只起一个线程去切换
+        """
+        threading.Thread(target=self.toggle, daemon=True).start()
+
+    def status(self):
+        if not self.running:
+            return "未在采样"
+        return f"采样中 {time.time() - self.started:.0f}s, {self.samples} 个样本"
+
+    # === 采样 ===
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self._sample(frame)
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (Path(code.co_filename).stem, code.co_name)
+        return label
+
+    def _sample(self, frame):
+        if self._label(frame.f_code) in IDLE_LEAVES:
+            self.idle += 1
+            return
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            names.append("%s:%s" % self._label(frame.f_code))
+            frame = frame.f_back
+        key = ";".join(reversed(names))
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def record_handler(self, mtype, seconds):
+        """由 _handle_frame 在采样期间调用：记录一条消息的处理耗时"""
+        if mtype not in MESSAGE_TYPES:
+            mtype = "other"
+        with self._lock:
+            row = self.handlers.get(mtype)
+            if row is None:
+                row = self.handlers[mtype] = [0, 0.0, 0.0]
+            row[0] += 1
+            row[1] += seconds
+            if seconds > row[2]:
+                row[2] = seconds
+
+    # === 输出 ===
+    def _write(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        base = self.output_dir / f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}"
+        folded = base.with_suffix(".folded")
+        with open(folded, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        elapsed = time.time() - self.started
+        table = base.with_suffix(".handlers.txt")
+        with self._lock:
+            handlers = sorted(self.handlers.items(), key=lambda kv: kv[1][1], reverse=True)
+        with open(table, "w", encoding="utf-8") as f:
+            f.write(f"# {elapsed:.1f}s, {self.samples} busy samples, {self.idle} idle samples\n")
+            f.write(f"{'handler':<16}{'count':>9}{'total_ms':>12}{'mean_us':>10}{'max_us':>10}\n")
+            for mtype, (count, total, worst) in handlers:
+                f.write(f"{mtype:<16}{count:>9}{total * 1e3:>12.2f}"
+                        f"{total / count * 1e6:>10.1f}{worst * 1e6:>10.0f}\n")
+
+        print(f"[PROFILE] 停止采样：{self.samples} 个样本 -> {folded}, {table}")
+        return folded, table
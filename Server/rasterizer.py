@@ -0,0 +1,175 @@
+"""
+rasterizer.py
+无 Qt 的服务器端光栅化（纯 Python + NumPy，NumPy 为可选依赖）。
+把笔迹画进 RGBA 缓冲区并编码为 PNG，语义与 DrawWidget 的绘画层一致：
+圆头圆角、抗锯齿边缘，背景色笔迹（橡皮擦）把像素清成透明。
+"""
+
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from Shared.protocol import CANVAS_WIDTH, CANVAS_HEIGHT, ERASER_COLOR
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PNG_LEVEL = 6  # zlib 压缩等级：笔迹图大片透明，中等等级已足够
+MAX_CANVAS_SIZE = 4096  # 画布扩展上限，防止异常坐标撑爆内存
+
+def available():
+    return np is not None
+
+def _parse_color(color):
+    """'#rrggbb' -> (r, g, b)，格式不对返回 None"""
+    if not isinstance(color, str) or len(color) != 7 or color[0] != "#":
+        return None
+    try:
+        value = int(color[1:], 16)
+    except ValueError:
+        return None
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+def item_extent(data):
+    """一个 poly / move 块右下角需要的画布尺寸 (宽, 高)，均为不超过 MAX_CANVAS_SIZE 的整数"""
+    points = _item_points(data)
+    if not points:
+        return 0, 0
+    try:
+        margin = int(data.get("width", 3)) // 2 + 1
+        width = int(max(points[0::2])) + margin
+        height = int(max(points[1::2])) + margin
+    except (TypeError, ValueError, OverflowError):
+        return 0, 0
+    return min(max(width, 0), MAX_CANVAS_SIZE), min(max(height, 0), MAX_CANVAS_SIZE)
+
+def _item_points(data):
+    """poly / move 统一成扁平点列表"""
+    if data.get("action") == "move":
+        try:
+            return [int(data["x1"]), int(data["y1"]), int(data["x2"]), int(data["y2"])]
+        except (KeyError, TypeError, ValueError):
+            return None
+    points = data.get("points")
+    if not isinstance(points, list) or len(points) < 4:
+        return None
+    return points
+
+class CanvasRaster:
+    """RGBA 画布（非预乘 alpha），初始全透明"""
+    def __init__(self, width=CANVAS_WIDTH, height=CANVAS_HEIGHT):
+        if np is None:
+            raise RuntimeError("rasterizer requires numpy")
+        self.width = width
+        self.height = height
+        self.pixels = np.zeros((height, width, 4), dtype=np.uint8)
+
+    def clear(self):
+        self.pixels.fill(0)
+
+    def ensure_size(self, width, height):
+        """画布只增不减（客户端窗口放大后笔迹可能超出默认尺寸）"""
+        width, height = int(width), int(height)
+        if width <= self.width and height <= self.height:
+            return
+        width = min(max(width, self.width), MAX_CANVAS_SIZE)
+        height = min(max(height, self.height), MAX_CANVAS_SIZE)
+        pixels = np.zeros((height, width, 4), dtype=np.uint8)
+        pixels[:self.height, :self.width] = self.pixels
+        self.pixels = pixels
+        self.width = width
+        self.height = height
+
+    def draw(self, data):
+        """画一个 poly / move 块"""
+        points = _item_points(data)
+        if points is None:
+            return
+        try:
+            width = max(float(data.get("width", 3)), 1.0)
+        except (TypeError, ValueError):
+            return
+        color = data.get("color", "#000000")
+        rgb = _parse_color(color)
+        if rgb is None:
+            return
+        try:
+            pts = np.asarray(points[:len(points) // 2 * 2], dtype=np.float64).reshape(-1, 2)
+        except (TypeError, ValueError):
+            return
+        self._draw_polyline(pts, width / 2.0, rgb, color.lower() == ERASER_COLOR)
+
+    def _draw_polyline(self, pts, radius, rgb, eraser):
+        # 整块折线的覆盖率取各线段的最大值再一次性合成，
+        # 相当于 Qt 的 RoundJoin：线段交接处不会因重复叠加而变深
+        pad = radius + 1.0
+        x0 = max(int(np.floor(pts[:, 0].min() - pad)), 0)
+        y0 = max(int(np.floor(pts[:, 1].min() - pad)), 0)
+        x1 = min(int(np.ceil(pts[:, 0].max() + pad)) + 1, self.width)
+        y1 = min(int(np.ceil(pts[:, 1].max() + pad)) + 1, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        coverage = np.zeros((y1 - y0, x1 - x0), dtype=np.float32)
+
+        for (ax, ay), (bx, by) in zip(pts[:-1], pts[1:]):
+            sx0 = max(int(np.floor(min(ax, bx) - pad)), x0)
+            sy0 = max(int(np.floor(min(ay, by) - pad)), y0)
+            sx1 = min(int(np.ceil(max(ax, bx) + pad)) + 1, x1)
+            sy1 = min(int(np.ceil(max(ay, by) + pad)) + 1, y1)
+            if sx0 >= sx1 or sy0 >= sy1:
+                continue
+            # 像素中心到线段的距离（线段退化为点时即圆点，对应 RoundCap）
+            px = np.arange(sx0, sx1, dtype=np.float32)[None, :] + 0.5 - ax
+            py = np.arange(sy0, sy1, dtype=np.float32)[:, None] + 0.5 - ay
+            dx, dy = bx - ax, by - ay
+            length2 = dx * dx + dy * dy
+            if length2 > 0:
+                t = np.clip((px * dx + py * dy) / length2, 0.0, 1.0)
+                px = px - t * dx
+                py = py - t * dy
+            dist = np.sqrt(px * px + py * py)
+            # 边缘 1 像素内线性过渡，近似抗锯齿
+            cov = np.clip(radius + 0.5 - dist, 0.0, 1.0)
+            region = coverage[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0]
+            np.maximum(region, cov, out=region)
+
+        target = self.pixels[y0:y1, x0:x1]
+        alpha = target[..., 3].astype(np.float32) / 255.0
+        if eraser:
+            # CompositionMode_Clear：按覆盖率削减 alpha
+            new_alpha = alpha * (1.0 - coverage)
+            target[..., 3] = np.rint(new_alpha * 255.0).astype(np.uint8)
+            return
+
+        # SourceOver（非预乘）：out_a = c + a(1-c)，out_rgb = (rgb*c + dst*a(1-c)) / out_a
+        out_alpha = coverage + alpha * (1.0 - coverage)
+        safe = np.where(out_alpha > 0, out_alpha, 1.0)
+        for ch in range(3):
+            dst = target[..., ch].astype(np.float32)
+            val = (rgb[ch] * coverage + dst * alpha * (1.0 - coverage)) / safe
+            target[..., ch] = np.rint(val).astype(np.uint8)
+        target[..., 3] = np.rint(out_alpha * 255.0).astype(np.uint8)
+
+    def encode_png(self):
+        """编码为 RGBA PNG（每行 filter=0，zlib 压缩）"""
+        pixels = self.pixels.copy()
+        # 完全透明的像素颜色无意义，清零以利于压缩
+        pixels[pixels[..., 3] == 0] = 0
+        raw = np.zeros((self.height, self.width * 4 + 1), dtype=np.uint8)
+        raw[:, 1:] = pixels.reshape(self.height, -1)
+
+        def chunk(tag, body):
+            return (struct.pack(">I", len(body)) + tag + body +
+                    struct.pack(">I", zlib.crc32(tag + body) & 0xFFFFFFFF))
+
+        header = struct.pack(">IIBBBBB", self.width, self.height, 8, 6, 0, 0, 0)
+        return (b"\x89PNG\r\n\x1a\n" +
+                chunk(b"IHDR", header) +
+                chunk(b"IDAT", zlib.compress(raw.tobytes(), PNG_LEVEL)) +
+                chunk(b"IEND", b""))
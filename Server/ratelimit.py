@@ -0,0 +1,116 @@
+"""
+ratelimit.py
+按连接、按消息类型的令牌桶限流。
+超出速率的绘图数据不直接丢弃，而是合并成较少的 poly 块，等有令牌时一起转发；
+超出速率的聊天 / 猜词直接丢弃。限流次数记入服务器指标。
+"""
+
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from Shared.protocol import MSG_DRAW, MSG_CHAT, MSG_GUESS
+from metrics import MESSAGE_TYPES
+
+# 消息类型 -> (每秒令牌数, 桶容量)
+# 客户端约每 30ms 发一个 poly 块，正常作画远低于绘图限额
+DEFAULT_LIMITS = {
+    MSG_DRAW: (60.0, 120),
+    MSG_CHAT: (2.0, 5),
+    MSG_GUESS: (3.0, 6),
+}
+OTHER_LIMIT = (5.0, 20)  # 未单独配置的类型（准备、房间操作等）共用此限额
+
+MAX_PENDING_POINTS = 8192  # 合并中的绘图数据上限，再多直接丢弃
+WARN_INTERVAL = 5.0        # 提示“发送过快”的最短间隔
+
+def parse_limit(text):
+    """'draw=60/120' -> ('draw', (60.0, 120))，格式错误抛出 ValueError"""
+    mtype, _, spec = text.partition("=")
+    rate, _, burst = spec.partition("/")
+    if not mtype or not rate:
+        raise ValueError(f"限流配置格式应为 类型=速率/容量: {text}")
+    rate = float(rate)
+    return mtype.strip(), (rate, int(burst) if burst else max(1, int(rate)))
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+class RateLimiter:
+    """
+    单个连接的限流状态（只在处理该连接的线程 / 事件循环里访问，无需加锁）
+    pending 是被限流后合并起来的 poly 块，记下所属回合，换回合后作废
+    """
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else DEFAULT_LIMITS
+        self.buckets = {}
+        self.pending = []
+        self.pending_points = 0
+        self.pending_round = None
+        self.stroke_open = False  # 已转发或已合并了 poly、还没转发 end
+        self._warned = 0.0
+
+    def allow(self, mtype):
+        # 未知类型共用一个桶，客户端无法靠乱填 type 绕过限流或撑大桶表
+        if mtype not in MESSAGE_TYPES:
+            mtype = "other"
+        bucket = self.buckets.get(mtype)
+        if bucket is None:
+            bucket = self.buckets[mtype] = TokenBucket(*self.limits.get(mtype, OTHER_LIMIT))
+        return bucket.take()
+
+    def coalesce(self, data, round_id):
+        """把被限流的 poly 块并入待发数据，超出上限返回 False"""
+        if self.pending_round != round_id:
+            self.take_pending(round_id)
+        points = data.get("points")
+        if not isinstance(points, list) or len(points) < 4:
+            return True
+        if self.pending_points + len(points) // 2 > MAX_PENDING_POINTS:
+            return False
+        self.pending_round = round_id
+        self.stroke_open = True
+        color, width = data.get("color"), data.get("width")
+        last = self.pending[-1] if self.pending else None
+        if last is not None and last["color"] == color and last["width"] == width:
+            # 同一笔首尾相接的块合成一块；接不上时照旧另起一块
+            if last["points"][-2:] == points[:2]:
+                last["points"].extend(points[2:])
+                self.pending_points += len(points) // 2 - 1
+                return True
+        self.pending.append({"action": "poly", "color": color, "width": width, "points": list(points)})
+        self.pending_points += len(points) // 2
+        return True
+
+    def take_pending(self, round_id):
+        """取出本回合待发的合并数据；属于旧回合的直接丢弃"""
+        pending = self.pending if self.pending_round == round_id else []
+        self.pending = []
+        self.pending_points = 0
+        self.pending_round = None
+        return pending
+
+    def should_warn(self):
+        now = time.monotonic()
+        if now - self._warned >= WARN_INTERVAL:
+            self._warned = now
+            return True
+        return False
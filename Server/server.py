@@ -1,3 +1,6 @@
+import base64
+import math
+import signal
 import socket
 import threading
 import sys
@@ -10,37 +13,99 @@ ROOT_DIR = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT_DIR))
 
 from Shared.protocol import *
+from aio_engine import run_asyncio, adopt_socket
+from connection import ThreadedConnection
+from stroke_log import StrokeLog
+from metrics import Metrics, TimedLock, MESSAGE_TYPES, render_text, start_stats_server
+from profiler import SamplingProfiler
+from ratelimit import RateLimiter, DEFAULT_LIMITS, parse_limit
+import rasterizer
+
+MAX_ROOM_ID_LEN = 32
+
+def normalize_room_id(room_id):
+    """客户端给出的房间号：非法或为空时归入默认房间"""
+    if not isinstance(room_id, str) or not room_id.strip():
+        return DEFAULT_ROOM
+    return room_id.strip()[:MAX_ROOM_ID_LEN]
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def valid_draw_data(data):
+    """
+    绘图 data 的结构检查：动作已知；poly / move 的颜色是字符串、笔宽和坐标都是有限数值
+    不合格的帧直接丢弃，不进笔迹记录也不转发
+    """
+    if not isinstance(data, dict):
+        return False
+    action = data.get("action")
+    if action in ("end", "undo", "clear"):
+        return True
+    if action not in ("poly", "move"):
+        return False
+    if not isinstance(data.get("color", ""), str) or not _is_number(data.get("width", 3)):
+        return False
+    if action == "move":
+        return all(_is_number(data.get(k)) for k in ("x1", "y1", "x2", "y2"))
+    points = data.get("points")
+    return isinstance(points, list) and len(points) >= 4 and all(_is_number(v) for v in points)
+
+def _move_to_poly(data):
+    """旧版 move 线段转成两点的 poly 块，便于合并"""
+    try:
+        points = [int(data["x1"]), int(data["y1"]), int(data["x2"]), int(data["y2"])]
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return {}
+    return {"action": "poly", "color": data.get("color"), "width": data.get("width"), "points": points}
+
+def load_words():
+    """加载词库，所有房间共用一份"""
+    path = ROOT_DIR / "words.txt"
+    default_words = ["苹果", "香蕉", "电脑", "太阳", "月亮", "汽车", "房子"]
+    if not path.exists():
+        return default_words
+    try:
+        content = path.read_text(encoding="utf-8")
+        lines = [line.strip() for line in content.splitlines() if line.strip()]
+        return lines if lines else default_words
+    except Exception:
+        return default_words
 
 class GameState:
-    """维护游戏全局状态：玩家、分数、回合信息"""
-    def __init__(self):
-        self.lock = threading.Lock()
+    """维护单个房间的游戏状态：玩家、分数、回合信息"""
+    def __init__(self, room_id=DEFAULT_ROOM, words=None, rasterize=False, metrics=None):
+        self.room_id = room_id
+        # 传入 metrics 时记录获取房间锁的等待时间
+        # lock 保护玩家、分数、准备与回合状态；canvas_lock 保护本轮笔迹和绘图帧的转发顺序，
+        # 画手作画不再与准备、猜词争同一把锁。两把都要时先取 lock 再取 canvas_lock
+        self.lock = self._make_lock(metrics, "lock_wait.game")
+        self.canvas_lock = self._make_lock(metrics, "lock_wait.canvas")
         
-        self.clients = {}       # socket -> player_name
-        self.name_to_conn = {}  # player_name -> socket
+        self.clients = {}       # connection -> player_name
+        # 在线连接的不可变快照：加入 / 离开时在 lock 与 canvas_lock 内整体替换，广播时无锁直接读取；
+        # 绘图转发在 canvas_lock 内读取，离开房间后不会再收到旧房间的笔迹
+        self.members = ()
+        self.name_to_conn = {}  # player_name -> connection
         
         self.scores = {}        # player_name -> int
         self.ready_players = set() # set(player_name)
+        # 玩家列表版本号：每广播一条增量加 1，客户端据此发现丢失的增量
+        self.players_version = 0
+        self._player_changes = []  # 尚未广播的玩家列表变化
         
         self.game_in_progress = False
         self.current_drawer = None
         self.current_answer = None
         self.round_id = 0
+        self.strokes = StrokeLog(rasterize)  # 本轮笔迹，新玩家加入时据此补画布
         
         # 加载词库
-        self.words = self._load_words()
+        self.words = words if words is not None else load_words()
 
-    def _load_words(self):
-        path = ROOT_DIR / "words.txt"
-        default_words = ["苹果", "香蕉", "电脑", "太阳", "月亮", "汽车", "房子"]
-        if not path.exists():
-            return default_words
-        try:
-            content = path.read_text(encoding="utf-8")
-            lines = [line.strip() for line in content.splitlines() if line.strip()]
-            return lines if lines else default_words
-        except Exception:
-            return default_words
+    @staticmethod
+    def _make_lock(metrics, name):
+        return TimedLock(metrics, name) if metrics is not None else threading.Lock()
 
     def add_player(self, conn, name):
         with self.lock:
@@ -53,8 +118,13 @@ class GameState:
             
             self.clients[conn] = name
             self.name_to_conn[name] = conn
+            with self.canvas_lock:
+                self.members = self.members + (conn,)
             if name not in self.scores:
                 self.scores[name] = 0
+            self._player_changes.append({
+                "op": "add", "name": name, "score": self.scores[name], "is_ready": False
+            })
             return name
 
     def remove_player(self, conn):
@@ -62,7 +132,10 @@ class GameState:
             name = self.clients.pop(conn, None)
             if name:
                 self.name_to_conn.pop(name, None)
+                with self.canvas_lock:
+                    self.members = tuple(c for c in self.members if c is not conn)
                 self.ready_players.discard(name)
+                self._player_changes.append({"op": "remove", "name": name})
                 # 如果当前画手掉了，重置状态
                 if self.game_in_progress and name == self.current_drawer:
                     self.game_in_progress = False
@@ -76,6 +149,8 @@ class GameState:
                 self.ready_players.add(name)
             else:
                 self.ready_players.discard(name)
+            # 状态没变也照发，客户端点击后要等这条回执才重新启用按钮
+            self._set_player_field(name, "is_ready", bool(is_ready))
             
             # 检查是否所有人都准备好了
             total_players = len(self.clients)
@@ -87,48 +162,118 @@ class GameState:
     def reset_round_state(self):
         """回合结束或开始前重置准备状态"""
         with self.lock:
-            self.ready_players.clear()
+            self.clear_ready()
             self.game_in_progress = False
             self.current_drawer = None
             self.current_answer = None
 
+    # === 玩家列表增量（以下方法调用方需持有 lock） ===
+    def _set_player_field(self, name, field, value):
+        self._player_changes.append({"op": "set", "name": name, "field": field, "value": value})
+
+    def clear_ready(self):
+        if self.ready_players:
+            self.ready_players.clear()
+            self._player_changes.append({"op": "reset_ready"})
+
+    def add_score(self, name, points):
+        if name in self.scores:
+            self.scores[name] += points
+            self._set_player_field(name, "score", self.scores[name])
+
+    def take_player_delta(self):
+        """取出攒下的变化，打包成一条带新版本号的增量消息；没有变化返回 None"""
+        if not self._player_changes:
+            return None
+        self.players_version += 1
+        changes, self._player_changes = self._player_changes, []
+        return {"type": MSG_PLAYER_DELTA, "version": self.players_version, "changes": changes}
+
+    def player_count(self):
+        return len(self.members)
+
     def get_player_list_data(self):
-        """获取用于广播的完整玩家列表数据"""
+        """获取完整玩家列表数据"""
         with self.lock:
-            p_list = []
-            for name, score in self.scores.items():
-                # 只有在线的玩家才放进去
-                if name in self.name_to_conn:
-                    p_list.append({
-                        "name": name,
-                        "score": score,
-                        "is_ready": name in self.ready_players
-                    })
-            return p_list
+            return self._player_list()
+
+    def _player_list(self):
+        p_list = []
+        for name, score in self.scores.items():
+            # 只有在线的玩家才放进去
+            if name in self.name_to_conn:
+                p_list.append({
+                    "name": name,
+                    "score": score,
+                    "is_ready": name in self.ready_players
+                })
+        return p_list
+
+ENGINES = ("thread", "asyncio")
 
 class GuessDrawServer:
-    def __init__(self, host="0.0.0.0", port=9000):
+    def __init__(self, host="0.0.0.0", port=9000, engine="thread", listen=True):
+        if engine not in ENGINES:
+            raise ValueError(f"未知的服务器引擎: {engine}")
         self.host = host
         self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.game = GameState()
+        # thread: 一连接一线程；asyncio: 所有连接共享一个事件循环
+        self.engine = engine
+        # listen=False 用于分片模式的 worker：不监听端口，连接由 room_router 投递
+        self.sock = None
+        if listen:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # 房间表：room_id -> GameState；默认房间常驻，其余房间在最后一人离开时删除
+        self.words = load_words()
+        self.rooms_lock = threading.Lock()
+        # 装有 NumPy 时，中途加入的玩家收到 PNG 底图 + 少量尾部笔迹
+        self.rasterize = rasterizer.available()
+        # 收发流量、广播耗时、锁等待等运行指标（控制台 stats / --stats-port 查看）
+        self.metrics = Metrics()
+        # 采样分析器：控制台 profile 命令 / SIGUSR1 / --profile 启停
+        self.profiler = SamplingProfiler()
+        # 每连接、每消息类型的令牌桶限额；None 表示不限流
+        self.rate_limits = dict(DEFAULT_LIMITS)
+        # 大于 0 时各连接按该间隔（秒）批量写出，用少量延迟换更少的系统调用和 TCP 小包；0 为有数据立即发送
+        self.write_tick = 0.0
+        self.game = GameState(DEFAULT_ROOM, self.words, self.rasterize, self.metrics)
+        self.rooms = {DEFAULT_ROOM: self.game}
         self.running = False
+        self._loop = None  # asyncio 引擎运行时的事件循环
+        # 分片模式下由 sharding.WorkerLink 填充：负责跨进程换房间并上报房间生灭
+        self.room_router = None
+        self.room_id_prefix = "room-"
 
     def start(self):
         try:
-            self.sock.bind((self.host, self.port))
+            if self.sock is not None:
+                self.sock.bind((self.host, self.port))
+                print(f"[SERVER] 启动成功 {self.host}:{self.port} (engine={self.engine})")
+                print("[SERVER] 等待连接...")
+            self.running = True
+
+            if self.engine == "asyncio":
+                # 事件循环模式需要更大的 backlog 以承受突发连接
+                if self.sock is not None:
+                    self.sock.listen(socket.SOMAXCONN)
+                run_asyncio(self)
+                return
+
+            if self.sock is None:
+                # 不监听端口：连接全部经 adopt_connection 投递进来
+                while self.running:
+                    time.sleep(0.5)
+                return
+
             self.sock.listen(5)
             # 设置超时，让 accept 循环能响应停止信号
             self.sock.settimeout(1.0)
-            self.running = True
-            print(f"[SERVER] 启动成功 {self.host}:{self.port}")
-            print("[SERVER] 等待连接...")
-
             while self.running:
                 try:
-                    conn, addr = self.sock.accept()
+                    sock, addr = self.sock.accept()
                     print(f"[SERVER] 新连接: {addr}")
+                    conn = ThreadedConnection(sock, addr, self.write_tick, self.resync_canvas)
                     t = threading.Thread(target=self.handle_client, args=(conn,), daemon=True)
                     t.start()
                 except socket.timeout:
@@ -142,66 +287,303 @@ class GuessDrawServer:
 
     def stop(self):
         self.running = False
-        try:
-            self.sock.close()
-        except:
-            pass
+        if self._loop is not None and self._loop.is_running():
+            # 监听 socket 归事件循环所有，由它检测到 running=False 后自行关闭
+            return
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except:
+                pass
         print("[SERVER] 服务器已停止")
 
-    def broadcast(self, msg, exclude=None):
-        data = encode_message(msg)
-        # 这里为了防止遍历字典时修改，使用 list(keys)
-        with self.game.lock:
-            conns = list(self.game.clients.keys())
+    def adopt_connection(self, sock, initial=b""):
+        """
+        接管一个已建立的客户端 socket（分片模式由前端转交），线程安全
+        initial 为前端已经读走的字节，会先喂给解码器
+        """
+        if self.engine == "asyncio":
+            adopt_socket(self, sock, initial)
+            return
+        # 转交来的 socket 可能带着非阻塞标志（文件状态在进程间共享）
+        sock.setblocking(True)
+        try:
+            addr = sock.getpeername()
+        except OSError:
+            addr = None
+        conn = ThreadedConnection(sock, addr, self.write_tick, self.resync_canvas)
+        t = threading.Thread(target=self.handle_client, args=(conn, initial), daemon=True)
+        t.start()
+
+    def broadcast(self, game, msg, exclude=None):
+        """向房间 game 内的所有玩家广播"""
+        self.broadcast_raw(game, encode_message(msg), exclude, msg.get("type"))
+
+    def broadcast_raw(self, game, data, exclude=None, mtype=None):
+        """广播已编码好的帧（绘图帧直接原样转发），mtype 仅用于统计"""
+        # members 在加入 / 离开时整体替换，读到的元组不会再变，无需加锁或复制
+        conns = game.members
 
+        # send 只是放入各连接自己的发送队列，不会被慢客户端阻塞
+        start = time.perf_counter()
+        sent = 0
         for conn in conns:
             if conn == exclude:
                 continue
+            conn.send(data)
+            sent += 1
+        self.metrics.observe(f"fanout.{mtype}", time.perf_counter() - start)
+        self.metrics.count_out(mtype, sent, len(data) * sent)
+
+    def broadcast_draw(self, game, frame, exclude=None):
+        """
+        按各连接协商的编码向房间内转发绘图帧
+        源帧原样转发给同格式的客户端，另一种编码最多只转换一次
+        """
+        self._send_draw(game.members, frame, exclude)
+
+    def _send_draw(self, conns, frame, exclude=None):
+        start = time.perf_counter()
+        encoded = {FORMAT_BINARY if is_binary_frame(frame) else FORMAT_JSON: frame}
+        sent = 0
+        nbytes = 0
+        for conn in conns:
+            if conn == exclude:
+                continue
+            fmt = conn.draw_format
+            if fmt not in encoded:
+                encoded[fmt] = convert_draw_frame(frame, fmt)
+            data = encoded[fmt]
+            if data is not None:
+                # 支持重同步的接收方落后时，绘图帧可丢弃，由之后补发的画布快照代替
+                conn.send(data, droppable=conn.canvas_resync)
+                sent += 1
+                nbytes += len(data)
+        self.metrics.observe(f"fanout.{MSG_DRAW}", time.perf_counter() - start)
+        # 两种编码的帧长不同，按实际发出的字节统计
+        self.metrics.count_out(MSG_DRAW, sent, nbytes)
+
+    def send_to(self, conn, msg, bulk=False):
+        """bulk：画布快照这类一次性大块消息，不计入发送队列的积压上限"""
+        data = encode_message(msg)
+        conn.send(data, bulk=bulk)
+        self.metrics.count_out(msg.get("type"), 1, len(data))
+
+    def resync_canvas(self, conn):
+        """
+        给丢过绘图帧的落后连接补发本轮画布（reset=True：客户端先清空再铺快照）
+        在画布锁内取快照并入队，之前丢掉的帧都已包含在内，之后的帧照常转发
+        """
+        game = conn.room
+        if game is None:
+            conn.resync_done(None)
+            return
+        with game.canvas_lock:
+            data = self._reset_snapshot(game, conn.snapshot_png)
+            conn.resync_done(data)
+        self.metrics.inc("canvas_resyncs")
+        self.metrics.count_out(MSG_CANVAS_SNAPSHOT, 1, len(data))
+
+    def _reset_snapshot(self, game, image):
+        """编码一份 reset 画布快照（调用方持有画布锁）"""
+        png, ops = game.strokes.snapshot(image=image)
+        # 带上房间号：换房间途中到达的旧房间快照由客户端忽略
+        msg = {"type": MSG_CANVAS_SNAPSHOT, "ops": ops, "reset": True, "room": game.room_id}
+        if png:
+            msg["image"] = base64.b64encode(png).decode("ascii")
+        return encode_message(msg)
+
+    def _resync_png_members(self, game, exclude=None):
+        """
+        画手撤销到了 PNG 底图里的笔画：拿底图中途加入的玩家本地只有底图之后的笔迹，
+        跟着撤销也撤不掉，给他们补发一份 reset 快照（调用方持有画布锁）
+        """
+        data = None
+        for conn in game.members:
+            if conn is exclude or not conn.snapshot_png:
+                continue
+            if data is None:
+                # 底图刚作废，快照全部以笔迹发送
+                data = self._reset_snapshot(game, True)
+            conn.send(data, bulk=True)
+            self.metrics.inc("canvas_resyncs")
+            self.metrics.count_out(MSG_CANVAS_SNAPSHOT, 1, len(data))
+
+    def client_queue_stats(self):
+        """每个在线玩家的发送队列积压情况：[(room_id, name, stats), ...]"""
+        items = []
+        for game in self.room_snapshot():
+            with game.lock:
+                items.extend((game.room_id, name, conn) for conn, name in game.clients.items())
+        return [(room_id, name, conn.queue_stats()) for room_id, name, conn in items]
+
+    def stats_report(self):
+        """运行指标 + 当前状态（连接数、房间数、各连接发送队列），供 stats 命令和 HTTP 端点使用"""
+        report = self.metrics.snapshot()
+        counters = report["counters"]
+        report["engine"] = self.engine
+        report["connections"] = counters.get("connections_opened", 0) - counters.get("connections_closed", 0)
+        report["rooms"] = len(self.room_snapshot())
+        report["queues"] = [dict(stats, room=room_id, name=name)
+                            for room_id, name, stats in self.client_queue_stats()]
+        return report
+
+    # === 房间管理 ===
+    def room_snapshot(self):
+        with self.rooms_lock:
+            return list(self.rooms.values())
+
+    def _join_room(self, conn, room_id, raw_name):
+        """把连接加入房间（不存在则创建），返回 (GameState, 最终昵称)"""
+        room_id = normalize_room_id(room_id)
+        # 持有 rooms_lock 完成“查找/创建 + 加入”，避免房间刚好被清理
+        with self.rooms_lock:
+            game = self.rooms.get(room_id)
+            if game is None:
+                game = GameState(room_id, self.words, self.rasterize, self.metrics)
+                self.rooms[room_id] = game
+                print(f"[ROOM] 创建房间 {room_id}")
+            name = game.add_player(conn, raw_name)
+            if self.room_router is not None:
+                self.room_router.room_joined(room_id, game.player_count())
+        conn.room = game
+        conn.player_name = name
+        return game, name
+
+    def _leave_room(self, conn):
+        """把连接移出当前房间，空房间（默认房间除外）随即删除"""
+        game = conn.room
+        if game is None:
+            return None, None
+        with self.rooms_lock:
+            name = game.remove_player(conn)
+            players = game.player_count()
+            if game.room_id != DEFAULT_ROOM and players == 0:
+                self.rooms.pop(game.room_id, None)
+                print(f"[ROOM] 删除空房间 {game.room_id}")
+            if self.room_router is not None:
+                self.room_router.room_left(game.room_id, players)
+        conn.room = None
+        return game, name
+
+    def _generate_room_id(self):
+        with self.rooms_lock:
+            while True:
+                room_id = f"{self.room_id_prefix}{random.randint(1000, 9999)}"
+                if room_id not in self.rooms:
+                    return room_id
+
+    def _switch_room(self, conn, room_id):
+        """已登录玩家换房间：先按离开流程退出旧房间，再按加入流程进入新房间"""
+        room_id = normalize_room_id(room_id)
+        if conn.room is not None and conn.room.room_id == room_id:
+            return
+        old_name = conn.player_name
+        self._unregister_player(conn, old_name)
+        if self.room_router is not None:
+            # 分片模式：目标房间可能在别的进程，连接交回前端重新分配，
+            # 由收包循环在处理完当前帧后调用 _rehome 完成移交
+            conn.player_name = None
+            conn.rehome = (room_id, old_name)
+            return
+        self._join_room(conn, room_id, old_name)
+        self._welcome_player(conn, conn.player_name)
+
+    def _rehome(self, conn, rest=b""):
+        """
+        把换房间的连接交回前端：补一帧 set_name 让新进程按正常握手接入，
+        rest 为本连接尚未处理的字节，原样跟在后面
+        """
+        room_id, name = conn.rehome
+        hello = encode_message({
+            "type": MSG_SET_NAME,
+            "name": name,
+            "room": room_id,
+            "formats": [conn.draw_format] + ([SNAPSHOT_PNG] if conn.snapshot_png else [])
+                       + ([CANVAS_RESYNC] if conn.canvas_resync else [])
+        })
+        def hand_off(sock):
+            if sock is None:
+                return
             try:
-                conn.sendall(data)
-            except OSError:
-                pass # 发送失败由 handle_client 中的 recv 异常处理
+                self.room_router.rehome(sock, room_id, hello, rest)
+            finally:
+                sock.close()
+        # 先把发往本连接的数据发完再移交（asyncio 引擎下稍后回调）
+        conn.detach(hand_off)
 
-    def send_to(self, conn, msg):
-        try:
-            conn.sendall(encode_message(msg))
-        except OSError:
-            pass
+    def room_list_data(self):
+        if self.room_router is not None:
+            # 分片模式：房间分布在各进程，以路由器汇总的目录为准
+            return self.room_router.room_list()
+        data = []
+        for game in self.room_snapshot():
+            data.append({
+                "room": game.room_id,
+                "players": len(game.members),
+                "in_game": game.game_in_progress
+            })
+        return data
+
+    # === 玩家列表同步 ===
+    def broadcast_player_delta(self, game):
+        """
+        把攒下的玩家状态变化作为一条增量广播（只含变了的字段）
+        在房间锁内入队，各连接收到的版本号严格递增
+        """
+        with game.lock:
+            msg = game.take_player_delta()
+            if msg is None:
+                return
+            data = encode_message(msg)
+            conns = game.members
+            start = time.perf_counter()
+            for conn in conns:
+                conn.send(data)
+            self.metrics.observe(f"fanout.{MSG_PLAYER_DELTA}", time.perf_counter() - start)
+            self.metrics.count_out(MSG_PLAYER_DELTA, len(conns), len(data) * len(conns))
+
+    def send_player_list(self, conn):
+        """
+        私发完整玩家列表（客户端发现版本跳变时请求）
+        列表已包含尚未广播的变化，之后收到的同一批增量重复应用也不会出错
+        """
+        game = conn.room
+        with game.lock:
+            self.send_to(conn, {
+                "type": MSG_UPDATE_PLAYERS,
+                "players": game._player_list(),
+                "version": game.players_version
+            })
 
-    # === 新增：广播玩家列表 ===
-    def broadcast_player_list(self):
-        """向所有客户端同步最新的玩家列表（含状态）"""
-        p_list = self.game.get_player_list_data()
-        msg = {
-            "type": MSG_UPDATE_PLAYERS,
-            "players": p_list
-        }
-        self.broadcast(msg)
-
-    def start_new_round(self):
+    def start_new_round(self, game):
         """开始新的一轮：选人、选题、广播"""
-        with self.game.lock:
-            players = list(self.game.name_to_conn.keys())
+        with game.lock:
+            players = list(game.name_to_conn.keys())
             if not players:
                 return
             
-            self.game.round_id += 1
-            self.game.current_drawer = random.choice(players)
-            self.game.current_answer = random.choice(self.game.words)
-            self.game.game_in_progress = True
+            # 换画手与清空画布同时持有 canvas_lock，上一轮画手的帧不会混进新一轮笔迹
+            with game.canvas_lock:
+                game.round_id += 1
+                game.current_drawer = random.choice(players)
+                game.current_answer = random.choice(game.words)
+                game.game_in_progress = True
+                game.strokes.clear()
             # 开始后清空准备状态
-            self.game.ready_players.clear()
+            game.clear_ready()
 
-            drawer = self.game.current_drawer
-            answer = self.game.current_answer
-            round_id = self.game.round_id
+            drawer = game.current_drawer
+            answer = game.current_answer
+            round_id = game.round_id
             
-            drawer_conn = self.game.name_to_conn.get(drawer)
+            drawer_conn = game.name_to_conn.get(drawer)
 
-        print(f"[GAME] Round {round_id}: Drawer={drawer}, Answer={answer}")
+        print(f"[GAME] [{game.room_id}] Round {round_id}: Drawer={drawer}, Answer={answer}")
+        self.metrics.inc("rounds_started")
 
         # 1. 广播回合开始
-        self.broadcast({
+        self.broadcast(game, {
             "type": MSG_ROUND_START,
             "round": round_id,
             "drawer": drawer,
@@ -215,102 +597,269 @@ class GuessDrawServer:
                 "word": answer
             })
         
-        # 3. 游戏开始后，广播一次列表（更新大家的状态为未准备/游戏中）
-        self.broadcast_player_list()
+        # 3. 游戏开始后，广播准备状态的清空
+        self.broadcast_player_delta(game)
+
+    def _register_player(self, conn, msg):
+        """处理 MSG_SET_NAME：登记玩家并返回最终昵称（可能因重名被改写）"""
+        raw_name = msg.get("name", "Player")
+        if not raw_name.strip():
+            raw_name = "Player"
+        # 旧客户端不带 formats：只认 move 线段，poly 块拆开后以 JSON 发送
+        formats = msg.get("formats") or [FORMAT_LEGACY]
+        if FORMAT_LEGACY in formats:
+            conn.draw_format = FORMAT_LEGACY
+        else:
+            conn.draw_format = FORMAT_BINARY if FORMAT_BINARY in formats else FORMAT_JSON
+        conn.snapshot_png = SNAPSHOT_PNG in formats
+        conn.canvas_resync = CANVAS_RESYNC in formats
+        if self.rate_limits is not None:
+            conn.limiter = RateLimiter(self.rate_limits)
+        # 旧客户端不带 room，进入默认房间
+        game, name = self._join_room(conn, msg.get("room"), raw_name)
+        return name
+
+    def _welcome_player(self, conn, player_name):
+        """进入房间后：私发欢迎信息，并通知房间内其他玩家"""
+        game = conn.room
+        print(f"[SERVER] {player_name} 加入房间 {game.room_id}")
+
+        # 欢迎信息和画布快照在两把锁内一起入队：
+        # 玩家列表与 players_version 一致，画布与 _relay_draw_frame 的转发先后一致
+        with game.lock, game.canvas_lock:
+            self.send_to(conn, {
+                "type": MSG_WELCOME,
+                "player_name": player_name,
+                "room": game.room_id,
+                "players": game._player_list(),
+                "players_version": game.players_version,
+                "round": game.round_id,
+                "in_game": game.game_in_progress,
+                "drawer": game.current_drawer,
+                "draw_format": conn.draw_format
+            })
+
+            # 中途加入：一次补齐本轮画布，笔迹不重复也不遗漏
+            png, ops = game.strokes.snapshot(image=conn.snapshot_png)
+            if ops and conn.draw_format == FORMAT_LEGACY:
+                # 旧客户端不认识 canvas_snapshot：逐条作为绘图消息补发
+                frames = [convert_draw_frame(encode_message({"type": MSG_DRAW, "data": op}), FORMAT_LEGACY)
+                          for op in ops]
+                data = b"".join(f for f in frames if f)
+                conn.send(data, bulk=True)
+                self.metrics.count_out(MSG_CANVAS_SNAPSHOT, 1, len(data))
+            elif png or ops:
+                msg = {"type": MSG_CANVAS_SNAPSHOT, "ops": ops}
+                if png:
+                    msg["image"] = base64.b64encode(png).decode("ascii")
+                self.send_to(conn, msg, bulk=True)
+
+        self.broadcast(game, {
+            "type": MSG_PLAYER_JOIN,
+            "player_name": player_name
+        }, exclude=conn)
 
-    def handle_client(self, conn):
+        # 有人加入，广播增量（新玩家自己已在欢迎信息里拿到完整列表）
+        self.broadcast_player_delta(game)
+
+    def _unregister_player(self, conn, player_name):
+        """连接断开或换房间：移出房间并通知房间内其他人"""
+        game, _ = self._leave_room(conn)
+        if game is None:
+            return
+        print(f"[SERVER] {player_name} 离开房间 {game.room_id}")
+        self.broadcast(game, {
+            "type": MSG_PLAYER_LEAVE,
+            "player_name": player_name
+        })
+        # 有人离开，广播增量
+        self.broadcast_player_delta(game)
+
+    def handle_client(self, conn, initial=b""):
         player_name = None
-        buffer = ""
+        decoder = FrameDecoder()
+        self.metrics.inc("connections_opened")
 
         try:
             # 1. 握手阶段：等待 MSG_SET_NAME
-            while True:
-                data = conn.recv(1024)
+            pending = []
+            data = initial
+            while not player_name:
                 if not data:
-                    return
-                buffer += data.decode("utf-8")
-                msgs, buffer = decode_stream(buffer)
+                    data = conn.recv(1024)
+                    if not data:
+                        return
+                frames = decoder.feed(data)
+                data = b""
                 
-                # 寻找 set_name 消息
-                for msg in msgs:
-                    if msg.get("type") == MSG_SET_NAME:
-                        raw_name = msg.get("name", "Player")
-                        if not raw_name.strip(): 
-                            raw_name = "Player"
-                        player_name = self.game.add_player(conn, raw_name)
+                # 寻找 set_name 消息，同一批里排在它之后的帧留到握手后处理
+                for i, frame in enumerate(frames):
+                    msg = parse_frame(frame)
+                    if msg and msg.get("type") == MSG_SET_NAME:
+                        self.metrics.count_in(MSG_SET_NAME, len(frame))
+                        player_name = self._register_player(conn, msg)
+                        pending = frames[i + 1:]
                         break
-                if player_name:
-                    break
             
             # 2. 发送欢迎信息
-            print(f"[SERVER] {player_name} 加入游戏")
-            
-            self.send_to(conn, {
-                "type": MSG_WELCOME,
-                "player_name": player_name,
-                "players": self.game.get_player_list_data(),
-                "round": self.game.round_id,
-                "in_game": self.game.game_in_progress,
-                "drawer": self.game.current_drawer
-            })
-            
-            self.broadcast({
-                "type": MSG_PLAYER_JOIN,
-                "player_name": player_name
-            }, exclude=conn)
-            
-            # 有人加入，刷新列表
-            self.broadcast_player_list()
+            self._welcome_player(conn, player_name)
+            for i, frame in enumerate(pending):
+                self._handle_frame(conn, frame)
+                if conn.rehome is not None:
+                    self._rehome(conn, b"".join(pending[i + 1:]) + decoder.pending())
+                    return
 
             # 3. 游戏循环
-            while True:
+            while conn.rehome is None:
                 data = conn.recv(4096)
                 if not data:
                     break
-                buffer += data.decode("utf-8")
-                msgs, buffer = decode_stream(buffer)
 
-                for msg in msgs:
-                    self._process_message(conn, player_name, msg)
+                frames = decoder.feed(data)
+                for i, frame in enumerate(frames):
+                    self._handle_frame(conn, frame)
+                    if conn.rehome is not None:
+                        # 换到其他进程的房间：剩余数据随连接一起移交
+                        rest = b"".join(frames[i + 1:]) + decoder.pending()
+                        self._rehome(conn, rest)
+                        return
 
         except (ConnectionResetError, BrokenPipeError):
             pass
         except Exception as e:
             print(f"[ERROR] {player_name}: {e}")
         finally:
-            if player_name:
-                print(f"[SERVER] {player_name} 断开连接")
-                self.game.remove_player(conn)
-                self.broadcast({
-                    "type": MSG_PLAYER_LEAVE,
-                    "player_name": player_name
-                })
-                # 有人离开，刷新列表
-                self.broadcast_player_list()
+            if conn.player_name:
+                # 换过房间后昵称可能变化，以连接上记录的为准
+                print(f"[SERVER] {conn.player_name} 断开连接")
+                self._unregister_player(conn, conn.player_name)
             conn.close()
+            self.metrics.inc("connections_closed")
+
+    def _handle_frame(self, conn, frame):
+        """
+        处理已登录连接的一帧原始数据：每帧只解码一次，绘图帧连同 data 一路传下去转发，
+        其余交给 _process_message
+        """
+        start = time.perf_counter()
+        msg = decode_frame(frame)
+        if msg is None:
+            return
+        mtype = msg.get("type")
+        self.metrics.count_in(mtype, len(frame))
+        if mtype == MSG_DRAW:
+            data = msg.get("data")
+            if not is_binary_frame(frame):
+                # 按解析结果重新编码，不原样转发客户端的 JSON 字节：
+                # 转义写法的重复键（"ty\u0070e"）等能让接收方解析出另一种消息，冒充服务器广播
+                frame = encode_message({"type": MSG_DRAW, "data": data})
+            # 绘图消息在 _limited_draw 里限流（超额合并而非丢弃）
+            self._limited_draw(conn, frame, data)
+        elif conn.limiter is None or conn.limiter.allow(mtype):
+            self._process_message(conn, conn.player_name, msg)
+        else:
+            self._rate_limited(conn, mtype, "dropped")
+        if self.profiler.running:
+            # 采样期间按消息类型（即 _process_message 的分支）记录处理耗时
+            self.profiler.record_handler(mtype, time.perf_counter() - start)
+
+    # === 限流 ===
+    def _rate_limited(self, conn, mtype, outcome):
+        """记录一次限流；被丢弃时偶尔提醒发送者"""
+        if mtype not in MESSAGE_TYPES:
+            mtype = "other"
+        self.metrics.inc(f"ratelimit.{mtype}.{outcome}")
+        if outcome == "dropped" and conn.limiter.should_warn():
+            self.send_to(conn, {"type": MSG_SYSTEM, "text": "发送过快，部分消息已被丢弃"})
+
+    def _limited_draw(self, conn, frame, data):
+        """
+        按令牌桶转发绘图数据：
+        - poly / move 超额时合并进待发数据，下次拿到令牌时与新块一起发出
+        - end 总是放行（先带出待发数据），没有未结束的笔画时是空操作，直接忽略
+        - undo / clear 从不限流（先带出待发数据再转发），丢掉会让各端画布从此不一致
+        """
+        limiter = conn.limiter
+        if limiter is None:
+            self._relay_draw_frame(conn, conn.player_name, frame, data)
+            return
+        if not valid_draw_data(data):
+            return
+
+        game = conn.room
+        action = data.get("action")
+        if action in ("poly", "move"):
+            if limiter.allow(MSG_DRAW):
+                self._flush_pending_draw(conn)
+                limiter.stroke_open = True
+                self._relay_draw_frame(conn, conn.player_name, frame, data)
+            elif action == "move" and limiter.coalesce(_move_to_poly(data), game.round_id):
+                self._rate_limited(conn, MSG_DRAW, "coalesced")
+            elif action == "poly" and limiter.coalesce(data, game.round_id):
+                self._rate_limited(conn, MSG_DRAW, "coalesced")
+            else:
+                self._rate_limited(conn, MSG_DRAW, "dropped")
+        elif action == "end":
+            self._flush_pending_draw(conn)
+            if limiter.stroke_open:
+                limiter.stroke_open = False
+                self._relay_draw_frame(conn, conn.player_name, frame, data)
+        else:
+            self._flush_pending_draw(conn)
+            self._relay_draw_frame(conn, conn.player_name, frame, data)
+
+    def _flush_pending_draw(self, conn):
+        """把限流期间合并的 poly 块按发送者的编码转发出去"""
+        for data in conn.limiter.take_pending(conn.room.round_id):
+            frame = None
+            if conn.draw_format == FORMAT_BINARY:
+                frame = encode_draw_binary(data)
+            if frame is None:
+                frame = encode_message({"type": MSG_DRAW, "data": data})
+            self._relay_draw_frame(conn, conn.player_name, frame, data)
+
+    def _relay_draw_frame(self, conn, player_name, frame, data):
+        """
+        绘图帧（二进制帧或服务器重新编码的 JSON 帧）原样转发：同格式的接收方省去一次序列化
+        data 是同一帧解码后的内容，记入本轮笔迹
+        """
+        game = conn.room
+        # 只取 canvas_lock：回合状态在开局时连同此锁一起修改，这里读取即可
+        with game.canvas_lock:
+            # 只有当前画手能画
+            if not (game.game_in_progress and player_name == game.current_drawer):
+                return
+            if not valid_draw_data(data):
+                return
+            rebased = game.strokes.apply(data)
+            # 在锁内入队，保证与新玩家收到的画布快照先后一致
+            self._send_draw(game.members, frame, exclude=conn)
+            if rebased:
+                self._resync_png_members(game, exclude=conn)
 
     def _process_message(self, conn, player_name, msg):
         mtype = msg.get("type")
+        game = conn.room
 
         if mtype == MSG_READY:
             # 只有不在游戏中才能准备
-            if not self.game.game_in_progress:
+            if not game.game_in_progress:
                 # 读取客户端传来的状态，True为准备，False为取消
                 wanted_status = msg.get("status", True)
                 
-                start_game = self.game.set_player_ready(player_name, wanted_status)
+                start_game = game.set_player_ready(player_name, wanted_status)
                 
-                # 状态变了，立刻广播全员列表，实现同步变绿
-                self.broadcast_player_list()
+                # 状态变了，立刻广播增量，实现同步变绿
+                self.broadcast_player_delta(game)
                 
                 if start_game:
-                    self.start_new_round()
+                    self.start_new_round(game)
 
         elif mtype == MSG_CHAT:
             # 普通聊天
             text = msg.get("text", "")
             if text:
-                self.broadcast({
+                self.broadcast(game, {
                     "type": MSG_CHAT,
                     "from": player_name,
                     "text": text
@@ -319,31 +868,30 @@ class GuessDrawServer:
         elif mtype == MSG_GUESS:
             # 猜词
             guess_word = msg.get("text", "").strip()
-            answer = self.game.current_answer
+            answer = game.current_answer
             
             # 如果不在游戏中，或者画手自己猜（防作弊）
-            if (not self.game.game_in_progress) or (player_name == self.game.current_drawer):
+            if (not game.game_in_progress) or (player_name == game.current_drawer):
                 # 当作普通聊天转发
-                self.broadcast({
+                self.broadcast(game, {
                     "type": MSG_CHAT,
                     "from": player_name,
                     "text": guess_word
                 })
                 return
 
-            print(f"[GUESS] {player_name} guess: {guess_word} (Ans: {answer})")
+            print(f"[GUESS] [{game.room_id}] {player_name} guess: {guess_word} (Ans: {answer})")
             
             if answer and guess_word == answer:
                 # 猜对了
-                with self.game.lock:
-                    self.game.scores[player_name] += 1
+                with game.lock:
+                    game.add_score(player_name, 1)
                     # 也可以给画手加分
-                    if self.game.current_drawer in self.game.scores:
-                        self.game.scores[self.game.current_drawer] += 1
+                    game.add_score(game.current_drawer, 1)
                     
-                    scores_snapshot = self.game.scores.copy()
+                    scores_snapshot = game.scores.copy()
                 
-                self.broadcast({
+                self.broadcast(game, {
                     "type": MSG_ROUND_RESULT,
                     "winner": player_name,
                     "answer": answer,
@@ -351,30 +899,142 @@ class GuessDrawServer:
                 })
                 
                 # 结束当前回合状态，等待再次准备
-                self.game.reset_round_state()
-                # 回合结束，刷新列表（更新分数，重置准备状态）
-                self.broadcast_player_list()
+                game.reset_round_state()
+                self.metrics.inc("rounds_finished")
+                # 回合结束，广播分数变化和准备状态重置
+                self.broadcast_player_delta(game)
             else:
                 # 猜错了，告诉所有人他猜错了
-                self.broadcast({
+                self.broadcast(game, {
                     "type": MSG_SYSTEM,
                     "text": f"{player_name} 猜了：{guess_word} (错误)"
                 })
 
-        elif mtype == MSG_DRAW:
-            # 只有当前画手能画
-            if self.game.game_in_progress and player_name == self.game.current_drawer:
-                self.broadcast(msg, exclude=conn)
+        elif mtype == MSG_JOIN_ROOM:
+            self._switch_room(conn, msg.get("room"))
+
+        elif mtype == MSG_CREATE_ROOM:
+            self._switch_room(conn, self._generate_room_id())
+
+        elif mtype == MSG_PLAYER_SYNC:
+            self.send_player_list(conn)
+
+        elif mtype == MSG_ROOM_LIST:
+            self.send_to(conn, {
+                "type": MSG_ROOM_LIST,
+                "rooms": self.room_list_data()
+            })
 
 if __name__ == "__main__":
-    server = GuessDrawServer()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="DrawGuess 服务器")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--engine", choices=ENGINES, default="thread",
+                        help="thread: 一连接一线程; asyncio: 单事件循环承载所有连接")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="大于 0 时按房间分片到多个 worker 进程（仅 Unix）")
+    parser.add_argument("--stats-port", type=int, default=None,
+                        help="在 127.0.0.1 的该端口提供 HTTP 统计端点（分片模式下 worker i 用 该端口+i）")
+    parser.add_argument("--profile", type=float, default=None, metavar="SECONDS",
+                        help="启动后立即采样分析这么多秒")
+    parser.add_argument("--profile-dir", default=".", help="分析结果的输出目录")
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="TYPE=RATE/BURST",
+                        help="覆盖某类消息的每连接限额，如 draw=60/120、chat=2/5，可重复")
+    parser.add_argument("--no-rate-limit", action="store_true", help="关闭限流")
+    parser.add_argument("--tick", type=float, default=0, metavar="MS",
+                        help="每个连接按该间隔（毫秒，如 10~30）批量写出；默认 0 为立即发送")
+    args = parser.parse_args()
+    if not 0 <= args.tick <= 1000:
+        parser.error("--tick 应在 0~1000 毫秒之间")
+
+    rate_limits = None
+    if not args.no_rate_limit:
+        rate_limits = dict(DEFAULT_LIMITS)
+        try:
+            rate_limits.update(parse_limit(text) for text in args.rate_limit)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.workers > 0:
+        from sharding import ShardedServer
+        server = ShardedServer(args.host, args.port, workers=args.workers, engine=args.engine,
+                               stats_port=args.stats_port, profile=args.profile,
+                               profile_dir=args.profile_dir, rate_limits=rate_limits,
+                               write_tick=args.tick / 1000)
+        # kill -USR1 <前端 pid> 相当于控制台的 profile 命令
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: server.signal_workers(signal.SIGUSR1))
+    else:
+        server = GuessDrawServer(args.host, args.port, engine=args.engine)
+        server.profiler.output_dir = Path(args.profile_dir)
+        server.rate_limits = rate_limits
+        server.write_tick = args.tick / 1000
+        if args.tick:
+            print(f"[SERVER] 批量写出间隔 {args.tick:g} ms")
+        if args.stats_port is not None:
+            start_stats_server(server.stats_report, args.stats_port)
+            print(f"[SERVER] 统计端点 http://127.0.0.1:{args.stats_port}/ （/json 为 JSON）")
+        # kill -USR1 <pid>：开始 / 停止采样，无需进入控制台
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, server.profiler.toggle_from_signal)
+        if args.profile:
+            server.profiler.start(args.profile)
     # 启动服务器线程
     t = threading.Thread(target=server.start, daemon=True)
     t.start()
     
-    print("输入 'q' 退出服务器")
+    print("输入 'q' 退出服务器, 'clients' 查看各客户端发送队列, 'rooms' 查看房间, 'stats' 查看运行指标, "
+          "'profile [start 秒数|stop]' 采样分析")
     while True:
-        cmd = input()
-        if cmd.strip().lower() == 'q':
+        cmd = input().strip().lower()
+        if cmd == 'q':
+            if args.workers == 0:
+                server.profiler.stop()
             server.stop()
-            break
\ No newline at end of file
+            t.join(5.0)
+            break
+        elif cmd.startswith('profile'):
+            parts = cmd.split()
+            action = parts[1] if len(parts) > 1 else "toggle"
+            if args.workers > 0:
+                # 分片模式：逐个 worker 切换采样，结果由各 worker 写出
+                pids = server.signal_workers(signal.SIGUSR1)
+                print(f"  已向 worker {pids} 发送 SIGUSR1（切换采样状态）")
+                continue
+            profiler = server.profiler
+            if action == "start":
+                try:
+                    duration = float(parts[2]) if len(parts) > 2 else None
+                except ValueError:
+                    print("  用法: profile start [秒数]")
+                    continue
+                if not profiler.start(duration):
+                    print("  已在采样中")
+            elif action == "stop":
+                if profiler.stop() is None:
+                    print("  未在采样")
+            elif action == "status":
+                print(f"  {profiler.status()}")
+            else:
+                profiler.toggle()
+        elif cmd == 'clients':
+            if args.workers > 0:
+                print("  分片模式下连接位于各 worker 进程中")
+                continue
+            for room_id, name, stats in server.client_queue_stats():
+                flag = " (落后)" if stats["lagging"] else ""
+                print(f"  [{room_id}] {name}: {stats['frames']} 帧 / {stats['bytes']} 字节{flag}")
+        elif cmd == 'stats':
+            if args.workers > 0:
+                print("  分片模式下指标位于各 worker 进程中，请使用 --stats-port")
+                continue
+            print(render_text(server.stats_report()))
+        elif cmd == 'rooms':
+            for room in server.room_list_data():
+                if "worker" in room:
+                    print(f"  {room['room']}: {room['players']} 人, worker {room['worker']}")
+                    continue
+                state = "游戏中" if room["in_game"] else "等待中"
+                print(f"  {room['room']}: {room['players']} 人, {state}")
\ No newline at end of file
@@ -0,0 +1,398 @@
+"""
+sharding.py
+多进程分片模式：前端进程只负责 accept 和按房间分配连接，
+每个房间整体落在某一个 worker 进程里，游戏逻辑仍由 GuessDrawServer 承担。
+前端读到 set_name 后通过 Unix 域 socket（SCM_RIGHTS）把连接的文件描述符
+直接交给 worker，此后客户端数据不再经过前端。仅支持 Unix 平台。
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from Shared.protocol import MSG_SET_NAME, DEFAULT_ROOM, FrameDecoder, parse_frame
+from server import GuessDrawServer, normalize_room_id
+from metrics import start_stats_server
+from ratelimit import DEFAULT_LIMITS
+
+HANDSHAKE_TIMEOUT = 10.0       # 前端等待 set_name 的最长时间
+HANDSHAKE_MAX_BYTES = 64 * 1024
+MAX_HANDOFF_BYTES = 64 * 1024  # 随连接一起移交的未处理数据上限
+CTRL_MSG_SIZE = 256 * 1024     # 控制通道单条消息的接收缓冲
+ROOMS_PER_CTRL_MSG = 500       # 房间目录分段推送，每段远小于 CTRL_MSG_SIZE
+
+def _pack(header, payload=b""):
+    """控制消息：一行 JSON 头 + 原始字节（移交连接时前端已读走的数据）"""
+    return json.dumps(header).encode("utf-8") + b"\n" + payload
+
+def _unpack(data):
+    head, _, payload = data.partition(b"\n")
+    return json.loads(head), payload
+
+def _recv_ctrl(ctrl):
+    """
+    读一条控制消息，返回 (header, payload, socket 或 None)；对端关闭时返回 None
+    消息被截断或解析失败时抛出 ValueError（随附的连接已关闭），调用方跳过即可
+    """
+    data, fds, flags, _ = socket.recv_fds(ctrl, CTRL_MSG_SIZE, 1)
+    if not data or flags & socket.MSG_TRUNC:
+        for fd in fds:
+            os.close(fd)
+        if data:
+            raise ValueError(f"control message larger than {CTRL_MSG_SIZE} bytes")
+        return None
+    try:
+        header, payload = _unpack(data)
+        if not isinstance(header, dict):
+            raise ValueError("control header is not an object")
+    except ValueError:
+        for fd in fds:
+            os.close(fd)
+        raise
+    sock = socket.socket(fileno=fds[0]) if fds else None
+    return header, payload, sock
+
+def _send_ctrl(ctrl, header, payload=b"", sock=None):
+    data = _pack(header, payload)
+    if sock is None:
+        ctrl.send(data)
+    else:
+        socket.send_fds(ctrl, [data], [sock.fileno()])
+
+class WorkerLink:
+    """
+    worker 进程一侧的控制通道，挂在 GuessDrawServer.room_router 上：
+    - 接收前端转交的连接并交给 server.adopt_connection
+    - 上报房间人数变化，换房间时把连接交回前端
+    """
+    def __init__(self, server, ctrl):
+        self.server = server
+        self.ctrl = ctrl
+        self.directory = []  # 前端汇总的全部房间 [{room, players, worker}]
+        self._incoming = []  # 正在接收的分段目录
+        self._send_lock = threading.Lock()
+
+    def start(self):
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def _run(self):
+        # 等 server 就绪（asyncio 引擎需要事件循环已经建立）再开始接收连接
+        server = self.server
+        while not server.running or (server.engine == "asyncio" and server._loop is None):
+            time.sleep(0.05)
+        while True:
+            try:
+                msg = _recv_ctrl(self.ctrl)
+            except OSError:
+                break
+            except ValueError as e:
+                print(f"[SHARD] 忽略无法解析的控制消息: {e}")
+                continue
+            if msg is None:
+                break
+            header, payload, sock = msg
+            op = header.get("op")
+            if op == "adopt" and sock is not None:
+                server.adopt_connection(sock, payload)
+            elif op == "rooms":
+                self._receive_rooms(header)
+            elif sock is not None:
+                sock.close()
+        # 前端退出（控制通道关闭）时 worker 随之停止
+        server.stop()
+
+    def _receive_rooms(self, header):
+        """目录分段到达：part 为 0 时重新开始，收到最后一段（more 为假）才替换目录"""
+        if not header.get("part"):
+            self._incoming = []
+        rooms = header.get("rooms")
+        if isinstance(rooms, list):
+            self._incoming.extend(r for r in rooms if isinstance(r, dict) and "room" in r)
+        if not header.get("more"):
+            self.directory, self._incoming = self._incoming, []
+
+    def _send(self, header, payload=b"", sock=None):
+        with self._send_lock:
+            try:
+                _send_ctrl(self.ctrl, header, payload, sock)
+            except OSError as e:
+                print(f"[SHARD] 控制通道发送失败: {e}")
+
+    # === GuessDrawServer 调用的钩子 ===
+    def room_joined(self, room_id, players):
+        self._send({"op": "joined", "room": room_id, "players": players})
+
+    def room_left(self, room_id, players):
+        self._send({"op": "left", "room": room_id, "players": players})
+
+    def rehome(self, sock, room_id, hello, rest=b""):
+        if len(rest) > MAX_HANDOFF_BYTES:
+            print(f"[SHARD] 换房间时丢弃 {len(rest)} 字节未处理数据")
+            rest = b""
+        self._send({"op": "rehome", "room": room_id}, hello + rest, sock)
+
+    def room_list(self):
+        """全局房间列表：人数以前端目录为准，本进程内的房间补上游戏状态"""
+        local = {game.room_id: game for game in self.server.room_snapshot()}
+        data = []
+        for entry in self.directory:
+            item = {"room": entry["room"], "players": entry["players"]}
+            game = local.pop(entry["room"], None)
+            if game is not None:
+                item["players"] = len(game.members)
+                item["in_game"] = game.game_in_progress
+            data.append(item)
+        # 目录还没同步到的本地房间
+        for game in local.values():
+            data.append({
+                "room": game.room_id,
+                "players": len(game.members),
+                "in_game": game.game_in_progress
+            })
+        return data
+
+def _worker_main(index, ctrl, engine, stats_port=None, profile=None, profile_dir=".", rate_limits=DEFAULT_LIMITS,
+                 write_tick=0.0):
+    """worker 进程入口：不监听端口，只处理前端转交来的连接"""
+    # Ctrl+C 由前端统一处理，worker 在控制通道关闭后退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = GuessDrawServer(engine=engine, listen=False)
+    server.profiler.output_dir = Path(profile_dir)
+    server.rate_limits = rate_limits
+    server.write_tick = write_tick
+    # 前端的 profile 命令向各 worker 发 SIGUSR1，开始 / 停止采样
+    signal.signal(signal.SIGUSR1, server.profiler.toggle_from_signal)
+    if profile:
+        server.profiler.start(profile)
+    # 不同进程各自生成房间号，加上编号前缀避免重复
+    server.room_id_prefix = f"room-{index}-"
+    link = WorkerLink(server, ctrl)
+    server.room_router = link
+    link.start()
+    print(f"[SHARD] worker {index} 启动 (pid={os.getpid()}, engine={engine})")
+    if stats_port is not None:
+        # 各 worker 的指标互相独立，分别在自己的端口提供
+        start_stats_server(server.stats_report, stats_port)
+        print(f"[SHARD] worker {index} 统计端点 http://127.0.0.1:{stats_port}/")
+    server.start()
+
+class ShardedServer:
+    """
+    前端进程：accept 连接、读出 set_name 里的房间号，
+    按 房间 -> worker 的放置表把连接交给对应进程；新房间放到当前人数最少的 worker
+    """
+    def __init__(self, host="0.0.0.0", port=9000, workers=2, engine="thread", stats_port=None,
+                 profile=None, profile_dir=".", rate_limits=DEFAULT_LIMITS, write_tick=0.0):
+        self.host = host
+        self.port = port
+        self.engine = engine
+        self.worker_count = workers
+        self.stats_port = stats_port  # 设置时 worker i 在 stats_port + i 提供统计端点
+        self.profile = profile        # 设置时各 worker 启动后采样这么多秒
+        self.profile_dir = profile_dir
+        self.rate_limits = rate_limits  # 传给各 worker 的 GuessDrawServer.rate_limits
+        self.write_tick = write_tick    # 传给各 worker 的 GuessDrawServer.write_tick
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        self.lock = threading.Lock()  # 控制台线程也会读取放置表
+        self.placement = {}  # room_id -> worker 编号
+        self.players = {}    # room_id -> worker 上报的人数
+        self.inflight = {}   # room_id -> 已转交但 worker 尚未确认加入的连接数
+        self.workers = []    # [(Process, 控制通道)]
+        self.running = False
+        self._loop = None
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        try:
+            for i in range(self.worker_count):
+                parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+                stats_port = self.stats_port + i if self.stats_port is not None else None
+                proc = ctx.Process(target=_worker_main, daemon=True, args=(
+                    i, child, self.engine, stats_port, self.profile, self.profile_dir, self.rate_limits,
+                    self.write_tick))
+                proc.start()
+                child.close()
+                self.workers.append((proc, parent))
+
+            self.sock.bind((self.host, self.port))
+            self.sock.listen(socket.SOMAXCONN)
+            self.running = True
+            print(f"[SERVER] 启动成功 {self.host}:{self.port} (workers={self.worker_count}, engine={self.engine})")
+            print("[SERVER] 等待连接...")
+            asyncio.run(self._serve())
+        except Exception as e:
+            print(f"[SERVER] 错误: {e}")
+        finally:
+            self.running = False
+            self._shutdown()
+
+    def stop(self):
+        # 事件循环检测到 running=False 后退出，由 start 收尾
+        self.running = False
+
+    def signal_workers(self, signum):
+        """向所有存活的 worker 发信号（控制台 profile 命令用 SIGUSR1 切换采样），返回 pid 列表"""
+        pids = []
+        for proc, _ in self.workers:
+            if proc.is_alive():
+                os.kill(proc.pid, signum)
+                pids.append(proc.pid)
+        return pids
+
+    def _shutdown(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for proc, ctrl in self.workers:
+            ctrl.close()
+        for proc, ctrl in self.workers:
+            proc.join(2.0)
+            if proc.is_alive():
+                proc.terminate()
+        self.workers = []
+        print("[SERVER] 服务器已停止")
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self.sock.setblocking(False)
+        for i, (proc, ctrl) in enumerate(self.workers):
+            loop.add_reader(ctrl.fileno(), self._on_ctrl, i)
+        try:
+            while self.running:
+                try:
+                    client, addr = await asyncio.wait_for(loop.sock_accept(self.sock), 0.5)
+                except asyncio.TimeoutError:
+                    continue
+                print(f"[SERVER] 新连接: {addr}")
+                loop.create_task(self._handshake(client))
+        finally:
+            for proc, ctrl in self.workers:
+                loop.remove_reader(ctrl.fileno())
+            self._loop = None
+
+    async def _handshake(self, client):
+        """读到 set_name 为止，连同已读字节一起交给房间所在的 worker"""
+        buf = bytearray()
+        try:
+            room_id = await asyncio.wait_for(self._read_room(client, buf), HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, ValueError, OSError):
+            room_id = None
+        if room_id is not None:
+            self._dispatch(client, room_id, bytes(buf))
+        client.close()
+
+    async def _read_room(self, client, buf):
+        loop = asyncio.get_running_loop()
+        decoder = FrameDecoder(HANDSHAKE_MAX_BYTES)
+        while True:
+            data = await loop.sock_recv(client, 4096)
+            if not data:
+                return None
+            buf += data
+            for frame in decoder.feed(data):
+                msg = parse_frame(frame)
+                if msg and msg.get("type") == MSG_SET_NAME:
+                    return normalize_room_id(msg.get("room"))
+
+    def _worker_load(self, index):
+        return sum(self.players.get(room, 0) + self.inflight.get(room, 0)
+                   for room, w in self.placement.items() if w == index)
+
+    def _dispatch(self, sock, room_id, payload):
+        with self.lock:
+            index = self.placement.get(room_id)
+            if index is None:
+                index = min(range(len(self.workers)), key=self._worker_load)
+                self.placement[room_id] = index
+                print(f"[SHARD] 房间 {room_id} -> worker {index}")
+            self.inflight[room_id] = self.inflight.get(room_id, 0) + 1
+        try:
+            _send_ctrl(self.workers[index][1], {"op": "adopt", "room": room_id}, payload, sock)
+        except OSError as e:
+            print(f"[SHARD] 转交连接到 worker {index} 失败: {e}")
+            self._room_joined(index, room_id, self.players.get(room_id, 0))
+
+    def _on_ctrl(self, index):
+        """控制通道可读：SEQPACKET 一次读出一条完整消息，不会阻塞"""
+        ctrl = self.workers[index][1]
+        try:
+            msg = _recv_ctrl(ctrl)
+        except OSError:
+            msg = None
+        except ValueError as e:
+            print(f"[SHARD] 忽略 worker {index} 无法解析的控制消息: {e}")
+            return
+        if msg is None:
+            print(f"[SHARD] worker {index} 已退出")
+            self._loop.remove_reader(ctrl.fileno())
+            return
+        header, payload, sock = msg
+        op = header.get("op")
+        room_id = header.get("room")
+        if op == "rehome" and sock is not None:
+            self._dispatch(sock, normalize_room_id(room_id), payload)
+            sock.close()
+        elif op == "joined":
+            self._room_joined(index, room_id, header.get("players", 0))
+        elif op == "left":
+            self._room_left(room_id, header.get("players", 0))
+        elif sock is not None:
+            sock.close()
+
+    def _room_joined(self, index, room_id, players):
+        with self.lock:
+            pending = self.inflight.get(room_id, 0)
+            if pending > 1:
+                self.inflight[room_id] = pending - 1
+            else:
+                self.inflight.pop(room_id, None)
+            if players:
+                self.placement.setdefault(room_id, index)
+                self.players[room_id] = players
+            elif room_id not in self.inflight and room_id != DEFAULT_ROOM:
+                self.placement.pop(room_id, None)
+                self.players.pop(room_id, None)
+        self._publish_rooms()
+
+    def _room_left(self, room_id, players):
+        with self.lock:
+            self.players[room_id] = players
+            # 房间在 worker 中已删除；若还有连接在路上则保留放置，让它在原 worker 重建
+            if players == 0 and room_id != DEFAULT_ROOM and room_id not in self.inflight:
+                self.placement.pop(room_id, None)
+                self.players.pop(room_id, None)
+        self._publish_rooms()
+
+    def room_list_data(self):
+        with self.lock:
+            return [{"room": room, "players": self.players.get(room, 0), "worker": index}
+                    for room, index in sorted(self.placement.items())]
+
+    def _publish_rooms(self):
+        """房间目录推送给所有 worker，用于回答客户端的 room_list；房间多时分段发送"""
+        rooms = self.room_list_data()
+        starts = range(0, len(rooms), ROOMS_PER_CTRL_MSG) or [0]
+        headers = [{"op": "rooms", "rooms": rooms[i:i + ROOMS_PER_CTRL_MSG], "part": n,
+                    "more": i + ROOMS_PER_CTRL_MSG < len(rooms)}
+                   for n, i in enumerate(starts)]
+        for proc, ctrl in self.workers:
+            try:
+                for header in headers:
+                    _send_ctrl(ctrl, header)
+            except OSError:
+                pass
@@ -0,0 +1,186 @@
+"""
+stroke_log.py
+服务器端的本轮笔迹记录，供中途加入的玩家一次性补齐画布。
+理解 end / undo / clear：撤销和清空掉的笔画直接丢弃，
+同一笔里首尾相接的 poly 块合并为一块，旧版 move 线段也并入 poly。
+装有 NumPy 时较早的笔画烘焙成 PNG 底图，补画布的代价不再随画的时长增长。
+烘焙在后台线程里随笔画完成增量进行，不占房间锁；取快照时只拿现成的底图引用。
+"""
+
+import queue
+import threading
+
+from rasterizer import CanvasRaster, MAX_CANVAS_SIZE, item_extent, available as raster_available
+
+# 快照中保留为笔迹的最近完成笔画数：新玩家仍能跟着画手撤销这些笔画，
+# 更早的笔画烘焙进底图
+SNAPSHOT_TAIL_STROKES = 16
+# 尾部之外攒够这么多完成笔画才烘焙一次，PNG 编码分摊到多笔
+BAKE_BATCH = 8
+
+class _Baker:
+    """进程内共用的后台烘焙线程（首次使用时启动），逐个处理提交上来的 StrokeLog"""
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, log):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stroke-baker", daemon=True)
+                self._thread.start()
+        self._queue.put(log)
+
+    def _run(self):
+        while True:
+            log = self._queue.get()
+            try:
+                log._bake_pending()
+            except Exception as e:
+                print(f"[ROOM] 烘焙画布底图失败: {e}")
+
+_baker = _Baker()
+
+class StrokeLog:
+    def __init__(self, rasterize=False):
+        self.strokes = []  # 已完成的笔画，每笔是若干 poly 块（完成后不再修改）
+        self.current = []  # 画手正在画、还没收到 end 的一笔
+        self.rasterize = rasterize and raster_available()
+        # _state_lock 保护 strokes 的增删与已发布的底图；调用方的房间锁不会被烘焙占住
+        self._state_lock = threading.Lock()
+        self._png = None       # 已发布的底图 PNG，包含 strokes[:_baked]
+        self._baked = 0
+        self._generation = 0   # 底图作废（撤销进底图 / 清空）时加 1，进行中的烘焙结果随之丢弃
+        self._bake_target = 0  # 本代烘焙线程已经或正在画进底图的笔画数（≥ _baked）
+        self._scheduled = False
+        # 以下只由烘焙线程访问
+        self._raster = None
+        self._raster_count = 0
+        self._raster_generation = -1
+
+    def apply(self, data):
+        """
+        按画手发来的顺序记录一条绘图 data，语义与 DrawWidget 的远程绘制一致
+        返回 True 表示撤销到了已发布底图里的笔画：拿这张底图中途加入的玩家本地撤销不掉，需要重同步
+        """
+        action = data.get("action")
+        if action in ("move", "poly"):
+            self._append(data)
+        elif action == "end":
+            if self.current:
+                with self._state_lock:
+                    self.strokes.append(self.current)
+                    self.current = []
+                    self._schedule_bake()
+        elif action == "undo":
+            # 与客户端一致：撤销最近一笔已完成的笔画
+            with self._state_lock:
+                if self.strokes:
+                    self.strokes.pop()
+                    rebased = self._baked > len(self.strokes)
+                    if self._bake_target > len(self.strokes):
+                        # 撤销到了底图（或正在烘焙的部分）里的笔画：底图作废，后台重画，期间快照全部以笔迹发送
+                        self._reset_raster()
+                        self._schedule_bake()
+                    return rebased
+        elif action == "clear":
+            self.clear()
+
+    def clear(self):
+        with self._state_lock:
+            self.strokes = []
+            self.current = []
+            self._reset_raster()
+
+    def _reset_raster(self):
+        self._generation += 1
+        self._baked = 0
+        self._bake_target = 0
+        self._png = None
+
+    def _schedule_bake(self):
+        """尾部之外攒够 BAKE_BATCH 笔时交给后台烘焙（调用方持有 _state_lock）"""
+        if not self.rasterize or self._scheduled:
+            return
+        if len(self.strokes) - SNAPSHOT_TAIL_STROKES - self._baked >= BAKE_BATCH:
+            self._scheduled = True
+            _baker.submit(self)
+
+    def _append(self, data):
+        if data.get("action") == "move":
+            points = [data.get("x1"), data.get("y1"), data.get("x2"), data.get("y2")]
+        else:
+            points = data.get("points")
+            if not isinstance(points, list) or len(points) < 4:
+                return
+        # 统一成画布范围内的整数坐标：浮点或越界坐标不会进入快照和底图
+        try:
+            points = [min(max(int(v), 0), MAX_CANVAS_SIZE) for v in points[:len(points) // 2 * 2]]
+        except (TypeError, ValueError, OverflowError):
+            return
+        color = data.get("color")
+        width = data.get("width")
+
+        if self.current:
+            last = self.current[-1]
+            # 客户端每块都从上一块的末点开始，接得上就直接续在后面
+            if last["color"] == color and last["width"] == width and last["points"][-2:] == points[:2]:
+                last["points"].extend(points[2:])
+                return
+        self.current.append({
+            "action": "poly",
+            "color": color,
+            "width": width,
+            "points": points
+        })
+
+    def snapshot(self, image=False):
+        """
+        返回 (PNG 底图或 None, 操作序列)
+        操作序列是底图之后的笔画：每笔后跟一个 end，正在画的一笔不加 end
+        image=False 或未启用光栅化时没有底图，操作序列即全部笔画
+        """
+        start = 0
+        png = None
+        if image and self.rasterize:
+            with self._state_lock:
+                png, start = self._png, self._baked
+        ops = []
+        for stroke in self.strokes[start:]:
+            ops.extend(stroke)
+            ops.append({"action": "end"})
+        ops.extend(self.current)
+        return png, ops
+
+    def _bake_pending(self):
+        """烘焙线程：把尾部之前尚未烘焙的完成笔画画进底图，编码后发布"""
+        with self._state_lock:
+            self._scheduled = False
+            generation = self._generation
+            target = len(self.strokes) - SNAPSHOT_TAIL_STROKES
+            start = self._raster_count if self._raster_generation == generation else 0
+            if target <= start:
+                return
+            todo = self.strokes[start:target]
+            # 之后撤销到 target 以内的笔画会作废本代底图，下面的发布随之放弃
+            self._bake_target = target
+
+        if start == 0:
+            self._raster = CanvasRaster()
+            self._raster_generation = generation
+        for stroke in todo:
+            for item in stroke:
+                self._raster.ensure_size(*item_extent(item))
+                self._raster.draw(item)
+        self._raster_count = target
+        png = self._raster.encode_png()
+
+        with self._state_lock:
+            if self._generation != generation:
+                # 烘焙期间清空或撤销进了底图：作废时已另行排队。
+                # 只比较笔画数不够，撤销后又画一笔时数量不变，底图里却还是被撤销的那笔
+                return
+            self._png = png
+            self._baked = target
+            self._schedule_bake()  # 烘焙期间又攒够了新的笔画
@@ -16,9 +16,43 @@ MSG_ROUND_START = "round_start"  # 回合开始（广播提示）
 MSG_ASSIGN_WORD = "assign_word"  # 私发给画手（具体答案）
 MSG_ROUND_RESULT = "round_result" # 回合结束（广播结果）
 MSG_SYSTEM = "system"          # 系统消息
-MSG_SET_NAME = "set_name"      # 客户端发送昵称
+MSG_SET_NAME = "set_name"      # 客户端发送昵称（可附带 formats 声明支持的绘图编码、room 指定房间）
 MSG_READY = "ready"            # 客户端发送准备状态
-MSG_UPDATE_PLAYERS = "update_players"       # 专门用于同步玩家列表（分数、准备状态）
+MSG_UPDATE_PLAYERS = "update_players"       # 完整玩家列表（分数、准备状态）及其版本号
+MSG_PLAYER_DELTA = "player_delta"  # 玩家列表增量：版本号 + 若干变化（add / remove / set / reset_ready）
+MSG_PLAYER_SYNC = "player_sync"    # 客户端发现版本号跳变时请求完整列表
+MSG_CREATE_ROOM = "create_room"  # 客户端请求新建房间（服务器分配房间号）并加入
+MSG_JOIN_ROOM = "join_room"      # 客户端请求加入指定房间（不存在则创建）
+MSG_ROOM_LIST = "room_list"      # 客户端请求 / 服务器返回房间列表
+MSG_CANVAS_SNAPSHOT = "canvas_snapshot"  # 中途加入或接收落后（reset）时服务器补发的本轮画布（压缩后的绘图操作序列）
+
+DEFAULT_ROOM = "lobby"           # MSG_SET_NAME 不带 room 时进入的默认房间
+
+# ---- 绘图数据编码格式（握手时协商） ----
+FORMAT_JSON = "json"     # 默认：换行分隔的 JSON
+FORMAT_BINARY = "bin1"   # 长度前缀二进制帧，仅用于绘图数据
+FORMAT_LEGACY = "move"   # 不带 formats 的旧客户端：JSON，且只会画逐段的 move，poly 块需拆开发送
+# 画布快照能力：客户端能显示 PNG 底图，中途加入时服务器可发图片 + 少量尾部笔迹
+SNAPSHOT_PNG = "png"
+# 画布重同步能力：客户端能处理 reset 快照，接收落后时服务器可丢弃排队的绘图帧，追上后补发整张画布
+CANVAS_RESYNC = "resync"
+
+# 画布尺寸与背景色（与 DrawWidget 一致；背景色的笔迹即橡皮擦）
+CANVAS_WIDTH = 800
+CANVAS_HEIGHT = 600
+ERASER_COLOR = "#fcf6e5"
+
+# 二进制帧首字节：UTF-8 续字节，不可能出现在 JSON 行首
+BIN_FRAME_TAG = 0xB1
+
+# 调色板：常用颜色只占 1 字节，顺序一经发布不可修改
+DRAW_PALETTE = [
+    "#000000", "#1e1e2e", "#e78284", "#89b4fa",
+    "#a6e3a1", "#f9e2af", "#cba6f7", "#fcf6e5",
+]
+_PALETTE_INDEX = {c: i for i, c in enumerate(DRAW_PALETTE)}
+_CUSTOM_COLOR = 0xFF                         # 后跟 3 字节 RGB
+_DRAW_ACTIONS = ["poly", "end", "undo", "clear"]  # 动作码 = 下标 + 1
 
 # ---- JSON 编 / 解码工具 ----
 def encode_message(obj):
@@ -48,4 +82,258 @@ def decode_stream(buffer):
 
     # 剩下的最后一部分（可能不完整）留到下一次
     remaining = lines[-1]
-    return msgs, remaining
\ No newline at end of file
+    return msgs, remaining
+
+# ---- 字节级分帧工具 ----
+MAX_FRAME_SIZE = 4 * 1024 * 1024  # 单帧上限，防止对端只发数据不发分隔符撑爆内存
+
+class FrameDecoder:
+    """
+    增量分帧器：按 recv 到的字节块喂入，吐出完整帧
+    - 内部用 bytearray 累积数据，只扫描新到的字节寻找换行，大帧不会被反复扫描
+    - 工作在字节层面，多字节 UTF-8 字符被拆在两次 recv 之间也不会出错
+    - 二进制帧头只解析一次：声明长度超过 max_frame_size 立即报错，未收全时记下帧尾位置
+    - JSON 帧保留末尾换行，二进制帧保留帧头，均可原样转发
+    """
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buf = bytearray()
+        self._scanned = 0       # 当前未完成的 JSON 帧中已确认没有换行的位置
+        self._frame_end = None  # 当前未完成的二进制帧（总在缓冲区开头）的结束位置
+
+    def feed(self, data):
+        """喂入 bytes / bytearray / memoryview，返回本次凑齐的帧列表"""
+        buf = self._buf
+        buf += data
+        frames = []
+        start = 0
+        size = len(buf)
+        while start < size:
+            if buf[start] == BIN_FRAME_TAG:
+                if start == 0 and self._frame_end is not None:
+                    end = self._frame_end
+                else:
+                    try:
+                        length, pos = _read_varint(buf, start + 1)
+                    except IndexError:
+                        break  # 帧头还没收全
+                    end = pos + length
+                    if end - start > self.max_frame_size:
+                        raise ValueError("frame exceeds max_frame_size")
+                if end > size:
+                    self._frame_end = end - start  # 下面删掉已处理的部分后，该帧从 0 开始
+                    break
+                self._frame_end = None
+                frames.append(bytes(buf[start:end]))
+                start = end
+            else:
+                end = buf.find(b"\n", max(start, self._scanned))
+                if end < 0:
+                    self._scanned = size
+                    break
+                frames.append(bytes(buf[start:end + 1]))
+                start = end + 1
+
+        if start:
+            del buf[:start]
+            self._scanned = max(self._scanned - start, 0)
+        if len(buf) > self.max_frame_size:
+            raise ValueError("frame exceeds max_frame_size")
+        return frames
+
+    def pending(self):
+        """尚未凑成完整帧的剩余字节"""
+        return bytes(self._buf)
+
+def split_frames(buffer):
+    """
+    一次性切割字节缓冲区（无状态版本，持续收包请用 FrameDecoder）
+    返回：(frames_list, remaining_bytes)
+    """
+    decoder = FrameDecoder(max_frame_size=float("inf"))
+    frames = decoder.feed(buffer)
+    return frames, decoder.pending()
+
+def decode_frame(frame):
+    """将单帧（JSON 或二进制）还原为消息字典，无法解析返回 None"""
+    if is_binary_frame(frame):
+        try:
+            return {"type": MSG_DRAW, "data": decode_draw_binary(frame)}
+        except ValueError:
+            return None
+    return parse_frame(frame)
+
+def parse_frame(frame):
+    """解析单帧 JSON，空行或格式错误返回 None"""
+    frame = frame.strip()
+    if not frame:
+        return None
+    try:
+        msg = json.loads(frame)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return msg if isinstance(msg, dict) else None
+
+def is_binary_frame(frame):
+    return len(frame) > 0 and frame[0] == BIN_FRAME_TAG
+
+# ---- 二进制绘图帧 ----
+# 帧结构：TAG | varint(payload 长度) | payload
+# payload：动作码 1 字节；poly 额外带 颜色(调色板下标或 0xFF+RGB) | varint(width)
+#          | varint(点数) | 首点 zigzag varint | 其余点相对前一点的 zigzag varint 差值
+MAX_VARINT_BYTES = 5  # varint 最长 5 字节（35 位），更长的视为格式错误，防止对端用超长 varint 拖慢解析
+
+def _write_varint(out, n):
+    if n >> (7 * MAX_VARINT_BYTES):
+        raise ValueError("value too large for varint")
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(buf, pos):
+    """返回 (value, next_pos)；数据不足时抛出 IndexError，超过 MAX_VARINT_BYTES 字节抛出 ValueError"""
+    result = 0
+    for shift in range(0, 7 * MAX_VARINT_BYTES, 7):
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+    raise ValueError("varint too long")
+
+def _zigzag(n):
+    return (n << 1) if n >= 0 else ((-n) << 1) - 1
+
+def _unzigzag(n):
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+
+def encode_draw_binary(data):
+    """
+    将绘图 data 编码为完整二进制帧
+    遇到无法编码的动作（如旧版 move）返回 None，调用方应退回 JSON；
+    坐标或笔宽超出 varint 范围时抛出 ValueError
+    """
+    action = data.get("action")
+    if action not in _DRAW_ACTIONS:
+        return None
+
+    payload = bytearray([_DRAW_ACTIONS.index(action) + 1])
+    if action == "poly":
+        color = str(data.get("color", "#000000")).lower()
+        idx = _PALETTE_INDEX.get(color)
+        if idx is not None:
+            payload.append(idx)
+        else:
+            try:
+                rgb = bytes.fromhex(color.lstrip("#"))
+            except ValueError:
+                return None
+            if len(rgb) != 3:
+                return None
+            payload.append(_CUSTOM_COLOR)
+            payload += rgb
+        _write_varint(payload, max(0, int(data.get("width", 3))))
+
+        pts = data.get("points", [])
+        count = len(pts) // 2
+        _write_varint(payload, count)
+        px = py = 0
+        for i in range(count):
+            x = int(pts[2 * i])
+            y = int(pts[2 * i + 1])
+            _write_varint(payload, _zigzag(x - px))
+            _write_varint(payload, _zigzag(y - py))
+            px, py = x, y
+
+    frame = bytearray([BIN_FRAME_TAG])
+    _write_varint(frame, len(payload))
+    frame += payload
+    return bytes(frame)
+
+def decode_draw_binary(frame):
+    """解析完整二进制帧（含帧头），返回绘图 data 字典；格式错误抛出 ValueError"""
+    try:
+        length, pos = _read_varint(frame, 1)
+        if pos + length != len(frame):
+            raise ValueError("binary frame length mismatch")
+
+        code = frame[pos]
+        pos += 1
+        if not 1 <= code <= len(_DRAW_ACTIONS):
+            raise ValueError(f"unknown draw action code {code}")
+        action = _DRAW_ACTIONS[code - 1]
+        if action != "poly":
+            return {"action": action}
+
+        idx = frame[pos]
+        pos += 1
+        if idx == _CUSTOM_COLOR:
+            color = "#" + bytes(frame[pos:pos + 3]).hex()
+            pos += 3
+        elif idx < len(DRAW_PALETTE):
+            color = DRAW_PALETTE[idx]
+        else:
+            raise ValueError(f"unknown palette index {idx}")
+        width, pos = _read_varint(frame, pos)
+
+        count, pos = _read_varint(frame, pos)
+        points = []
+        px = py = 0
+        for _ in range(count):
+            dx, pos = _read_varint(frame, pos)
+            dy, pos = _read_varint(frame, pos)
+            px += _unzigzag(dx)
+            py += _unzigzag(dy)
+            points.append(px)
+            points.append(py)
+        if pos != len(frame):
+            raise ValueError("trailing bytes in binary frame")
+    except IndexError:
+        raise ValueError("truncated binary frame")
+    return {"action": "poly", "color": color, "width": width, "points": points}
+
+def poly_to_moves(data):
+    """poly 块拆成首尾相接的 move 线段；坐标无法转成整数时抛出 TypeError / ValueError"""
+    pts = [int(v) for v in data.get("points", [])]
+    color = data.get("color", "#000000")
+    width = data.get("width", 3)
+    return [{"action": "move", "x1": pts[i], "y1": pts[i + 1], "x2": pts[i + 2], "y2": pts[i + 3],
+             "color": color, "width": width}
+            for i in range(0, len(pts) - 3, 2)]
+
+def convert_draw_frame(frame, fmt):
+    """
+    将绘图帧转换为目标编码（服务器向不同格式的客户端转发时使用）
+    FORMAT_LEGACY 下一个 poly 块会变成连续的多帧 move
+    无法转换时返回 None
+    """
+    if fmt == FORMAT_LEGACY:
+        msg = decode_frame(frame)
+        if msg is None or not isinstance(msg.get("data"), dict):
+            return None
+        data = msg["data"]
+        if data.get("action") != "poly":
+            return frame if not is_binary_frame(frame) else encode_message({"type": MSG_DRAW, "data": data})
+        try:
+            moves = poly_to_moves(data)
+        except (TypeError, ValueError, OverflowError):
+            return None
+        return b"".join(encode_message({"type": MSG_DRAW, "data": m}) for m in moves) or None
+    if fmt == FORMAT_BINARY:
+        if is_binary_frame(frame):
+            return frame
+        msg = parse_frame(frame)
+        if msg is None or not isinstance(msg.get("data"), dict):
+            return None
+        # 不能编码的动作原样以 JSON 发送，二进制客户端同样能解析
+        try:
+            return encode_draw_binary(msg["data"]) or frame
+        except (TypeError, ValueError, OverflowError):
+            return None
+    if not is_binary_frame(frame):
+        return frame
+    try:
+        return encode_message({"type": MSG_DRAW, "data": decode_draw_binary(frame)})
+    except ValueError:
+        return None
@@ -0,0 +1,298 @@
+"""
+bench.py
+协议编解码、服务器广播和客户端绘制热点路径的微基准。
+数据集由固定种子生成，结果写成 JSON 文件，用 --compare 与旧版本的结果对比。
+Qt 部分使用 offscreen 平台，无需显示器；未安装 PyQt5 时跳过。
+
+用法：
+    python Tools/bench.py --output bench.json
+    python Tools/bench.py --output new.json --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import timeit
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(ROOT_DIR / "Server"))
+sys.path.append(str(ROOT_DIR / "Client"))
+
+from Shared.protocol import (
+    MSG_DRAW, FORMAT_JSON, FORMAT_BINARY, DRAW_PALETTE, CANVAS_WIDTH, CANVAS_HEIGHT,
+    encode_message, decode_stream, FrameDecoder, encode_draw_binary, decode_draw_binary
+)
+
+SEED = 20240601
+CHUNK_POINTS = 32  # 与 DrawWidget 的 POLY_MAX_POINTS 一致
+
+# === 固定数据集 ===
+def make_strokes(count, seed=SEED):
+    """随机游走生成 count 笔，每笔 (颜色, 笔宽, 扁平坐标)"""
+    rng = random.Random(seed)
+    strokes = []
+    for _ in range(count):
+        x = rng.uniform(50, CANVAS_WIDTH - 50)
+        y = rng.uniform(50, CANVAS_HEIGHT - 50)
+        dx, dy = rng.uniform(-4, 4), rng.uniform(-4, 4)
+        points = []
+        for _ in range(rng.randint(20, 80)):
+            dx = min(max(dx + rng.uniform(-1, 1), -6), 6)
+            dy = min(max(dy + rng.uniform(-1, 1), -6), 6)
+            x = min(max(x + dx, 0), CANVAS_WIDTH - 1)
+            y = min(max(y + dy, 0), CANVAS_HEIGHT - 1)
+            points += [round(x), round(y)]
+        strokes.append((rng.choice(DRAW_PALETTE), rng.choice((3, 6, 12)), points))
+    return strokes
+
+def make_chunks(strokes):
+    """把笔画切成客户端实际发送的 poly 块（块与块共用端点）"""
+    chunks = []
+    for color, width, points in strokes:
+        step = (CHUNK_POINTS - 1) * 2
+        for i in range(0, len(points) - 2, step):
+            chunks.append({"action": "poly", "color": color, "width": width,
+                           "points": points[i:i + step + 2]})
+    return chunks
+
+def make_segments(strokes):
+    """旧版 move 线段，DrawWidget._draw_line_on_pixmap 的输入"""
+    segments = []
+    for color, width, points in strokes:
+        for i in range(0, len(points) - 2, 2):
+            segments.append({"action": "move", "x1": points[i], "y1": points[i + 1],
+                             "x2": points[i + 2], "y2": points[i + 3],
+                             "color": color, "width": width})
+    return segments
+
+# === 计时 ===
+class Runner:
+    def __init__(self, repeat, scale, name_filter):
+        self.repeat = repeat
+        self.scale = scale
+        self.name_filter = name_filter
+        self.results = {}
+
+    def wants(self, name):
+        return not self.name_filter or self.name_filter in name
+
+    def run(self, name, fn, items, unit, number=1, setup=None):
+        """
+        fn 每调用一次处理 items 个单位，取 repeat 轮中最快的一轮
+        setup 在每轮计时前调用（不计时），用于清空队列等
+        """
+        if not self.wants(name):
+            return
+        number = max(1, int(number * self.scale))
+        best = None
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            t = timeit.timeit(fn, number=number)
+            best = t if best is None else min(best, t)
+        per_item = best / (number * items)
+        self.results[name] = {
+            "unit": unit,
+            "us_per_unit": per_item * 1e6,
+            "units_per_sec": 1.0 / per_item if per_item > 0 else 0.0,
+        }
+        print(f"  {name:<40} {per_item * 1e6:10.3f} us/{unit}")
+
+# === 协议 ===
+def bench_protocol(runner, chunks):
+    print("[BENCH] protocol")
+    msgs = [{"type": MSG_DRAW, "data": c} for c in chunks]
+    json_frames = [encode_message(m) for m in msgs]
+    bin_frames = [encode_draw_binary(c) for c in chunks]
+    json_text = b"".join(json_frames).decode("utf-8")
+    json_stream = b"".join(json_frames)
+    bin_stream = b"".join(bin_frames)
+    n = len(msgs)
+
+    runner.run("protocol.encode_message", lambda: [encode_message(m) for m in msgs], n, "msg", 5)
+    runner.run("protocol.decode_stream", lambda: decode_stream(json_text), n, "msg", 5)
+
+    def feed(stream):
+        decoder = FrameDecoder()
+        for i in range(0, len(stream), 4096):
+            decoder.feed(stream[i:i + 4096])
+    runner.run("protocol.frame_decoder.json", lambda: feed(json_stream), n, "frame", 5)
+    runner.run("protocol.frame_decoder.bin1", lambda: feed(bin_stream), n, "frame", 5)
+    runner.run("protocol.encode_draw_binary", lambda: [encode_draw_binary(c) for c in chunks], n, "frame", 5)
+    runner.run("protocol.decode_draw_binary", lambda: [decode_draw_binary(f) for f in bin_frames], n, "frame", 5)
+
+# === 服务器广播 ===
+class _QueueConn:
+    """只有发送队列的假连接：与 ThreadedConnection.send 一样加锁入队，不真正发出"""
+    def __init__(self, draw_format):
+        from connection import OutboundQueue
+        self.draw_format = draw_format
+        self.canvas_resync = False
+        self.queue = OutboundQueue(max_bytes=float("inf"), high_water=float("inf"))
+        self._cond = threading.Condition()
+
+    def send(self, data, droppable=False, bulk=False):
+        with self._cond:
+            self.queue.push(data, droppable, bulk)
+            self._cond.notify()
+
+    def drain(self):
+        with self._cond:
+            self.queue.done(sum(len(f) for f in self.queue.pop_all()))
+
+def bench_broadcast(runner, chunks):
+    print("[BENCH] server broadcast")
+    import server as server_mod
+    srv = server_mod.GuessDrawServer("127.0.0.1", 0, listen=False)
+    msg = {"type": MSG_DRAW, "data": chunks[0]}
+    frame = encode_message(msg)
+    bin_frame = encode_draw_binary(chunks[0])
+
+    for clients in (10, 100):
+        game = server_mod.GameState("bench", ["word"])
+        conns = [_QueueConn(FORMAT_BINARY if i % 2 else FORMAT_JSON) for i in range(clients)]
+        for i, conn in enumerate(conns):
+            game.add_player(conn, f"p{i}")
+
+        def drain():
+            for conn in conns:
+                conn.drain()
+        # 每次调用广播 100 条，单位是“每条消息每个客户端”
+        runner.run(f"server.broadcast.{clients}", lambda: [srv.broadcast(game, msg) for _ in range(100)],
+                   100 * clients, "msg*client", 5, setup=drain)
+        runner.run(f"server.broadcast_draw.json.{clients}",
+                   lambda: [srv.broadcast_draw(game, frame) for _ in range(100)],
+                   100 * clients, "msg*client", 5, setup=drain)
+        runner.run(f"server.broadcast_draw.bin1.{clients}",
+                   lambda: [srv.broadcast_draw(game, bin_frame) for _ in range(100)],
+                   100 * clients, "msg*client", 5, setup=drain)
+        drain()
+
+# === 客户端绘制 ===
+def bench_widget(runner, strokes):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+    except ImportError:
+        print("[BENCH] 未安装 PyQt5，跳过 DrawWidget 基准")
+        return
+    app = QApplication.instance() or QApplication([])
+    from draw_widget import DrawWidget
+    from strokes import Stroke
+    print("[BENCH] DrawWidget")
+
+    widget = DrawWidget()
+    widget.resize(CANVAS_WIDTH, CANVAS_HEIGHT)
+    segments = make_segments(strokes[:50])
+
+    def draw_segments():
+        with widget._locked_layer():
+            for seg in segments:
+                widget._draw_line_on_pixmap(seg)
+    runner.run("widget.draw_line_on_pixmap", draw_segments, len(segments), "segment", 3)
+
+    def build(count, checkpoints):
+        """直接把笔画画进绘画层并记入历史（不经过鼠标事件和网络）"""
+        w = DrawWidget()
+        w.resize(CANVAS_WIDTH, CANVAS_HEIGHT)
+        with w._locked_layer():
+            painter = w._begin_layer_painter()
+            for color, width, points in strokes[:count]:
+                stroke = Stroke(color, width)
+                stroke.extend(points)
+                w._draw_stroke(stroke, painter)
+                if checkpoints:
+                    w._commit_stroke(stroke)
+                else:
+                    w.history.append(stroke)
+            painter.end()
+        return w
+
+    for count in (50, 200, 1000):
+        # 无快照：从头重放全部历史（最坏情况）；有快照：撤销时的实际路径
+        for label, checkpoints in (("full", False), ("checkpoint", True)):
+            name = f"widget.redraw_from_history.{label}.{count}"
+            if not runner.wants(name):
+                continue
+            w = build(count, checkpoints)
+            # 先撤销一笔再计时：count 恰好落在快照点上时，不撤销就只是铺一张快照（最好情况），
+            # 撤销后最近的快照失效，要从上一个快照重放 CHECKPOINT_INTERVAL - 1 笔
+            w.history.pop()
+
+            def redraw(w=w):
+                with w._locked_layer():
+                    w._redraw_from_history()
+            runner.run(name, redraw, 1, "redraw", 3)
+            w.stop_render_thread()
+    widget.stop_render_thread()
+    app.processEvents()
+
+# === 输出与对比 ===
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(results, baseline_path, threshold):
+    """打印与基线的对比，返回变慢超过 threshold 的条目数"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+    print(f"[BENCH] 与 {baseline_path} 对比（正数表示变慢）")
+    regressions = 0
+    for name, res in results.items():
+        old = baseline.get(name)
+        if not old or not old.get("us_per_unit"):
+            print(f"  {name:<40} (新增)")
+            continue
+        change = res["us_per_unit"] / old["us_per_unit"] - 1.0
+        flag = ""
+        if change > threshold:
+            flag = "  <-- 变慢"
+            regressions += 1
+        print(f"  {name:<40} {change * 100:+7.1f}%{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DrawGuess 微基准")
+    parser.add_argument("--output", default="bench.json", help="结果 JSON 文件")
+    parser.add_argument("--compare", help="与之对比的旧结果文件")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="变慢超过该比例记为退化（默认 0.10）")
+    parser.add_argument("--repeat", type=int, default=5, help="每项测几轮取最快")
+    parser.add_argument("--quick", action="store_true", help="减少循环次数，快速冒烟")
+    parser.add_argument("--filter", default="", help="只运行名字包含该子串的基准")
+    args = parser.parse_args()
+
+    strokes = make_strokes(1000)
+    chunks = make_chunks(strokes[:200])
+    runner = Runner(2 if args.quick else args.repeat, 0.2 if args.quick else 1.0, args.filter)
+
+    bench_protocol(runner, chunks)
+    bench_broadcast(runner, chunks)
+    bench_widget(runner, strokes)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": SEED,
+        "results": runner.results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"[BENCH] 结果已写入 {args.output}")
+
+    if args.compare:
+        sys.exit(1 if compare(runner.results, args.compare, args.threshold) else 0)
@@ -0,0 +1,305 @@
+"""
+loadgen.py
+无界面的压测工具：在一个 asyncio 事件循环里模拟 N 个玩家，分散到若干房间。
+机器人会准备、由画手按真实鼠标采样率画随机笔迹、其余人不断猜词，
+结束时报告吞吐量以及绘图扇出延迟（画手发出 -> 猜词者收到）的 p50 / p99。
+
+用法：
+    python Tools/loadgen.py --players 40 --rooms 10 --duration 30
+    python Tools/loadgen.py --spawn-server --engine asyncio --format bin1
+
+延迟测量：画手把递增序号编进 poly 块的颜色（#rrggbb 共 24 位），
+同一进程内的猜词者按序号查到发送时刻。颜色只影响显示，服务器照常转发和记录。
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from Shared.protocol import (
+    MSG_DRAW, MSG_GUESS, MSG_WELCOME, MSG_ROUND_START, MSG_ASSIGN_WORD,
+    MSG_ROUND_RESULT, MSG_SET_NAME, MSG_READY, FORMAT_JSON, FORMAT_BINARY,
+    CANVAS_WIDTH, CANVAS_HEIGHT,
+    encode_message, encode_draw_binary, FrameDecoder, decode_frame
+)
+
+# 与 DrawWidget 的 POLY_FLUSH_MS / POLY_MAX_POINTS 一致
+CHUNK_MS = 30
+CHUNK_MAX_POINTS = 32
+SEQ_MASK = 0xFFFFFF  # 序号占满颜色的 24 位
+WRONG_GUESSES = ["apple", "house", "cat", "tree", "car", "sun", "fish", "book"]
+
+class Stats:
+    """所有机器人共用的计数器"""
+    def __init__(self):
+        self.connected = 0
+        self.errors = 0
+        self.rounds = 0
+        self.draw_sent = 0
+        self.draw_received = 0
+        self.messages = 0
+        self.bytes = 0
+        self.latencies = []  # 秒
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        data = sorted(self.latencies)
+        return data[min(len(data) - 1, int(len(data) * p / 100))]
+
+class RoomState:
+    """同一房间的机器人之间共享的信息（它们本来可以各自从协议里得到，这里只为测量与收尾方便）"""
+    def __init__(self):
+        self.answer = None
+        self.solving = False
+        self.seq = 0
+        self.sent_at = {}  # 序号 -> 发送时刻
+
+class Bot:
+    def __init__(self, name, room_id, room, stats, args):
+        self.name = name
+        self.room_id = room_id
+        self.room = room
+        self.stats = stats
+        self.args = args
+        self.draw_format = FORMAT_JSON
+        self.writer = None
+        self._task = None  # 当前回合的画画 / 猜词协程
+
+    async def run(self, deadline):
+        try:
+            reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        except OSError as e:
+            print(f"[LOADGEN] {self.name} 无法连接: {e}")
+            self.stats.errors += 1
+            return
+        self.stats.connected += 1
+        formats = [FORMAT_JSON, FORMAT_BINARY] if self.args.format == FORMAT_BINARY else [FORMAT_JSON]
+        await self._send({"type": MSG_SET_NAME, "name": self.name, "room": self.room_id, "formats": formats})
+
+        decoder = FrameDecoder()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    data = await asyncio.wait_for(reader.read(65536), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    print(f"[LOADGEN] {self.name} 被服务器断开")
+                    self.stats.errors += 1
+                    break
+                self.stats.bytes += len(data)
+                for frame in decoder.feed(data):
+                    msg = decode_frame(frame)
+                    if msg is not None:
+                        self.stats.messages += 1
+                        await self._on_msg(msg)
+        except (OSError, ValueError) as e:
+            print(f"[LOADGEN] {self.name} 连接出错: {e}")
+            self.stats.errors += 1
+        finally:
+            self._stop_task()
+            self.writer.close()
+
+    async def _send(self, obj):
+        data = None
+        if self.draw_format == FORMAT_BINARY and obj.get("type") == MSG_DRAW:
+            data = encode_draw_binary(obj["data"])
+        self.writer.write(data or encode_message(obj))
+        await self.writer.drain()
+
+    def _stop_task(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _start(self, coro):
+        self._stop_task()
+        self._task = asyncio.ensure_future(coro)
+
+    async def _on_msg(self, msg):
+        mtype = msg.get("type")
+        if mtype == MSG_DRAW:
+            self._on_draw(msg.get("data") or {})
+        elif mtype == MSG_WELCOME:
+            # 重名时服务器会改写昵称
+            self.name = msg.get("player_name", self.name)
+            self.draw_format = msg.get("draw_format", FORMAT_JSON)
+            await self._send({"type": MSG_READY, "status": True})
+        elif mtype == MSG_ASSIGN_WORD:
+            self.room.answer = msg.get("word")
+            self._start(self._draw())
+        elif mtype == MSG_ROUND_START:
+            self.room.solving = False
+            if msg.get("drawer") != self.name:
+                self._start(self._guess())
+        elif mtype == MSG_ROUND_RESULT:
+            self._stop_task()
+            if self.room.answer is not None:
+                # 每个房间只记一次
+                self.room.answer = None
+                self.stats.rounds += 1
+            self._start(self._ready_again())
+
+    def _on_draw(self, data):
+        if data.get("action") != "poly":
+            return
+        self.stats.draw_received += 1
+        try:
+            seq = int(str(data.get("color", ""))[1:], 16)
+        except ValueError:
+            return
+        sent = self.room.sent_at.get(seq)
+        if sent is not None:
+            self.stats.latencies.append(time.perf_counter() - sent)
+
+    async def _ready_again(self):
+        await asyncio.sleep(random.uniform(0.1, 0.5))
+        await self._send({"type": MSG_READY, "status": True})
+
+    async def _guess(self):
+        """隔一段时间猜一个错词；回合够长后由房间里第一个轮到的猜词者说出答案"""
+        round_end = time.monotonic() + self.args.round_seconds
+        while True:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.args.guess_interval)
+            answer = self.room.answer
+            if answer and time.monotonic() >= round_end and not self.room.solving:
+                self.room.solving = True
+                await self._send({"type": MSG_GUESS, "text": answer})
+                return
+            await self._send({"type": MSG_GUESS, "text": random.choice(WRONG_GUESSES)})
+
+    async def _send_chunk(self, points, width):
+        room = self.room
+        room.seq = (room.seq + 1) & SEQ_MASK
+        room.sent_at[room.seq] = time.perf_counter()
+        self.stats.draw_sent += 1
+        await self._send({"type": MSG_DRAW, "data": {
+            "action": "poly", "color": f"#{room.seq:06x}", "width": width, "points": points
+        }})
+
+    async def _draw(self):
+        """随机游走的笔迹：每 CHUNK_MS 补上这段时间内的鼠标采样点，攒成一个 poly 块发出"""
+        samples = max(1, round(self.args.mouse_hz * CHUNK_MS / 1000))
+        while True:
+            x = random.uniform(50, CANVAS_WIDTH - 50)
+            y = random.uniform(50, CANVAS_HEIGHT - 50)
+            angle = random.uniform(0, 2 * math.pi)
+            width = random.choice((3, 6, 12))
+            points = [round(x), round(y)]
+            stroke_end = time.monotonic() + random.uniform(0.5, 2.0)
+            while time.monotonic() < stroke_end:
+                await asyncio.sleep(CHUNK_MS / 1000)
+                for _ in range(samples):
+                    angle += random.gauss(0, 0.3)
+                    speed = random.uniform(2, 8)
+                    x = min(max(x + speed * math.cos(angle), 0), CANVAS_WIDTH - 1)
+                    y = min(max(y + speed * math.sin(angle), 0), CANVAS_HEIGHT - 1)
+                    points += [round(x), round(y)]
+                    if len(points) >= CHUNK_MAX_POINTS * 2:
+                        await self._send_chunk(points, width)
+                        points = points[-2:]
+                if len(points) >= 4:
+                    await self._send_chunk(points, width)
+                    points = points[-2:]
+            await self._send({"type": MSG_DRAW, "data": {"action": "end"}})
+            if random.random() < 0.05:
+                await self._send({"type": MSG_DRAW, "data": {"action": "undo"}})
+            await asyncio.sleep(random.uniform(0.2, 0.6))
+
+async def run_bots(args):
+    stats = Stats()
+    rooms = {}
+    bots = []
+    for i in range(args.players):
+        room_id = f"load-{i % args.rooms}"
+        room = rooms.setdefault(room_id, RoomState())
+        bots.append(Bot(f"bot-{i}", room_id, room, stats, args))
+
+    start = time.monotonic()
+    deadline = start + args.duration
+    await asyncio.gather(*(bot.run(deadline) for bot in bots))
+    return stats, time.monotonic() - start
+
+def wait_for_port(host, port, timeout=10.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def spawn_server(args):
+    cmd = [sys.executable, str(ROOT_DIR / "Server" / "server.py"),
+           "--host", args.host, "--port", str(args.port), "--engine", args.engine]
+    if args.workers:
+        cmd += ["--workers", str(args.workers)]
+    if args.tick:
+        cmd += ["--tick", str(args.tick)]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.STDOUT, text=True)
+    if not wait_for_port(args.host, args.port):
+        proc.kill()
+        raise SystemExit("[LOADGEN] 服务器未能启动")
+    return proc
+
+def stop_server(proc):
+    try:
+        proc.communicate("q\n", timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def report(stats, elapsed, args):
+    ms = lambda p: stats.percentile(p) * 1000
+    print(f"[LOADGEN] {elapsed:.1f}s, {args.players} bots / {args.rooms} rooms, format {args.format}")
+    print(f"  connected {stats.connected}/{args.players}, errors {stats.errors}, rounds {stats.rounds}")
+    print(f"  draw sent     {stats.draw_sent} ({stats.draw_sent / elapsed:.1f}/s)")
+    print(f"  draw received {stats.draw_received} ({stats.draw_received / elapsed:.1f}/s)")
+    print(f"  messages      {stats.messages} ({stats.messages / elapsed:.1f}/s), "
+          f"{stats.bytes / 1024:.1f} KB ({stats.bytes / 1024 / elapsed:.1f} KB/s)")
+    print(f"  fan-out latency ms: p50 {ms(50):.2f}  p99 {ms(99):.2f}  max {ms(100):.2f}  (n={len(stats.latencies)})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DrawGuess 压测：无界面机器人客户端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=30.0, help="运行秒数")
+    parser.add_argument("--format", choices=(FORMAT_JSON, FORMAT_BINARY), default=FORMAT_BINARY,
+                        help="机器人声明的绘图编码")
+    parser.add_argument("--mouse-hz", type=float, default=120.0, help="画手的鼠标采样率")
+    parser.add_argument("--guess-interval", type=float, default=2.0, help="猜词者平均每隔几秒猜一次")
+    parser.add_argument("--round-seconds", type=float, default=15.0, help="回合进行多久后说出答案")
+    parser.add_argument("--spawn-server", action="store_true",
+                        help="在子进程里启动本地服务器，结束后关闭")
+    parser.add_argument("--engine", default="thread", help="配合 --spawn-server 使用")
+    parser.add_argument("--workers", type=int, default=0, help="配合 --spawn-server 使用")
+    parser.add_argument("--tick", type=float, default=0, help="配合 --spawn-server 使用：服务器批量写出间隔（毫秒）")
+    args = parser.parse_args()
+
+    if args.players < 2 or args.rooms < 1 or args.players < 2 * args.rooms:
+        parser.error("每个房间至少需要 2 名玩家")
+
+    proc = spawn_server(args) if args.spawn_server else None
+    try:
+        stats, elapsed = asyncio.run(run_bots(args))
+    finally:
+        if proc is not None:
+            stop_server(proc)
+    report(stats, elapsed, args)
@@ -0,0 +1,98 @@
+"""
+test_connection.py
+发送队列的积压上限：补发的画布快照超过上限时不应断开落后的客户端
+运行：python -m unittest discover tests
+"""
+
+import socket
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(ROOT_DIR / "Server"))
+
+from connection import MAX_QUEUE_BYTES, OutboundQueue, ThreadedConnection
+
+BIG = MAX_QUEUE_BYTES * 2
+
+class OutboundQueueTest(unittest.TestCase):
+    def test_bulk_frame_not_counted(self):
+        q = OutboundQueue(high_water=1000, max_bytes=2000)
+        self.assertTrue(q.push(b"r" * 100))
+        self.assertTrue(q.push(b"x" * 10 * 1024, bulk=True))
+        self.assertEqual(q.bytes, 100)
+        frames = q.pop_all()
+        q.done(sum(len(f) for f in frames))
+        self.assertEqual(q.bytes, 0)
+        self.assertEqual(q.uncounted, 0)
+
+    def test_oversized_reliable_frame_still_drops(self):
+        q = OutboundQueue(high_water=1000, max_bytes=2000)
+        self.assertFalse(q.push(b"r" * 3000))
+
+    def test_resync_larger_than_cap(self):
+        q = OutboundQueue(high_water=1000, max_bytes=2000)
+        q.push(b"d" * 600, droppable=True)
+        q.push(b"d" * 600, droppable=True)  # 超过高水位：丢弃绘图帧，等待补发
+        self.assertTrue(q.resync)
+        self.assertTrue(q.wants_resync())
+        q.finish_resync()
+        self.assertTrue(q.push(b"s" * 5000, bulk=True))
+        # 快照还在发送途中，之后的帧照常计数
+        snapshot = q.popleft()
+        self.assertTrue(q.push(b"d" * 500, droppable=True))
+        self.assertEqual(q.bytes, 500)
+        q.done(len(snapshot))
+        self.assertEqual(q.bytes, 500)
+
+class ThreadedConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.server_sock, self.client_sock = socket.socketpair()
+
+    def tearDown(self):
+        self.client_sock.close()
+
+    def _read_all(self, expected):
+        buf = bytearray()
+        self.client_sock.settimeout(5)
+        while len(buf) < expected:
+            data = self.client_sock.recv(1 << 20)
+            if not data:
+                break
+            buf += data
+        return bytes(buf)
+
+    def test_resync_larger_than_cap_keeps_client(self):
+        conn = ThreadedConnection(self.server_sock)
+        resynced = threading.Event()
+        conn.on_resync = lambda c: resynced.set()
+        with conn._cond:
+            conn.queue.resync = True  # 模拟落后后丢过绘图帧
+        conn.send(b"hello\n")
+        self.assertTrue(resynced.wait(5))
+        snapshot = b"s" * BIG + b"\n"
+        conn.resync_done(snapshot)
+        conn.send(b"after\n")
+        data = self._read_all(6 + len(snapshot) + 6)
+        self.assertEqual(data, b"hello\n" + snapshot + b"after\n")
+        self.assertFalse(conn.queue_stats()["lagging"])
+        conn.close()
+
+    def test_reliable_frame_larger_than_cap_drops(self):
+        conn = ThreadedConnection(self.server_sock)
+        conn.send(b"r" * BIG)
+        self.client_sock.settimeout(5)
+        received = 0
+        while True:
+            data = self.client_sock.recv(1 << 20)
+            if not data:
+                break
+            received += len(data)
+        self.assertLess(received, BIG)
+        conn.close()
+
+if __name__ == "__main__":
+    unittest.main()
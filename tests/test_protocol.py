@@ -0,0 +1,110 @@
+"""
+test_protocol.py
+二进制绘图帧的编解码、varint 长度上限、增量分帧与旧客户端的 move 转换
+运行：python -m unittest discover tests
+"""
+
+import json
+import sys
+import unittest
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from Shared.protocol import (BIN_FRAME_TAG, FORMAT_BINARY, FORMAT_JSON, FORMAT_LEGACY, MSG_DRAW,
+                             FrameDecoder, convert_draw_frame, decode_draw_binary, decode_frame,
+                             encode_draw_binary, encode_message, split_frames)
+
+POLY = {"action": "poly", "color": "#000000", "width": 3, "points": [10, 20, 8, 25, -3, 0, 799, 599]}
+
+def binary_header(length):
+    """只有帧头的二进制帧：TAG + varint(length)"""
+    out = bytearray([BIN_FRAME_TAG])
+    while length >= 0x80:
+        out.append((length & 0x7F) | 0x80)
+        length >>= 7
+    out.append(length)
+    return bytes(out)
+
+class BinaryDrawTest(unittest.TestCase):
+    def test_poly_round_trip(self):
+        frame = encode_draw_binary(POLY)
+        self.assertEqual(frame[0], BIN_FRAME_TAG)
+        self.assertEqual(decode_draw_binary(frame), POLY)
+        self.assertLess(len(frame), len(encode_message({"type": MSG_DRAW, "data": POLY})))
+
+    def test_custom_color_round_trip(self):
+        data = dict(POLY, color="#12AB9f")
+        self.assertEqual(decode_draw_binary(encode_draw_binary(data))["color"], "#12ab9f")
+
+    def test_other_actions(self):
+        for action in ("end", "undo", "clear"):
+            self.assertEqual(decode_draw_binary(encode_draw_binary({"action": action})), {"action": action})
+        self.assertIsNone(encode_draw_binary({"action": "move", "x1": 0, "y1": 0, "x2": 1, "y2": 1}))
+        self.assertIsNone(encode_draw_binary(dict(POLY, color="red")))
+
+    def test_malformed_frames_rejected(self):
+        frame = encode_draw_binary(POLY)
+        for bad in (frame[:-1], frame + b"\x00", binary_header(1) + b"\x09"):
+            with self.assertRaises(ValueError):
+                decode_draw_binary(bad)
+        self.assertIsNone(decode_frame(frame[:-1]))
+
+    def test_varint_capped_at_five_bytes(self):
+        with self.assertRaises(ValueError):
+            encode_draw_binary(dict(POLY, width=1 << 40))
+        with self.assertRaises(ValueError):
+            decode_draw_binary(bytes([BIN_FRAME_TAG]) + b"\xff" * 6 + b"\x01")
+
+class FrameDecoderTest(unittest.TestCase):
+    def test_split_across_feeds(self):
+        stream = encode_message({"type": "chat", "text": "你好"}) + encode_draw_binary(POLY) + encode_message({"type": "ready"})
+        decoder = FrameDecoder()
+        frames = []
+        for i in range(len(stream)):
+            frames += decoder.feed(stream[i:i + 1])
+        self.assertEqual(frames, split_frames(stream)[0])
+        self.assertEqual([decode_frame(f)["type"] for f in frames], ["chat", MSG_DRAW, "ready"])
+        self.assertEqual(decoder.pending(), b"")
+
+    def test_oversize_json_line(self):
+        decoder = FrameDecoder(max_frame_size=100)
+        self.assertEqual(decoder.feed(b"x" * 60), [])
+        with self.assertRaises(ValueError):
+            decoder.feed(b"x" * 60)
+
+    def test_oversize_binary_rejected_on_header(self):
+        # 声明的长度超限时只凭帧头就报错，不必等数据收齐
+        decoder = FrameDecoder(max_frame_size=1000)
+        with self.assertRaises(ValueError):
+            decoder.feed(binary_header(1 << 20))
+
+    def test_overlong_length_varint(self):
+        decoder = FrameDecoder()
+        with self.assertRaises(ValueError):
+            decoder.feed(bytes([BIN_FRAME_TAG]) + b"\x80" * 6)
+
+class ConvertDrawFrameTest(unittest.TestCase):
+    def test_json_and_binary(self):
+        json_frame = encode_message({"type": MSG_DRAW, "data": POLY})
+        bin_frame = encode_draw_binary(POLY)
+        self.assertEqual(convert_draw_frame(json_frame, FORMAT_BINARY), bin_frame)
+        self.assertEqual(decode_frame(convert_draw_frame(bin_frame, FORMAT_JSON))["data"], POLY)
+
+    def test_legacy_gets_moves(self):
+        frames = split_frames(convert_draw_frame(encode_draw_binary(POLY), FORMAT_LEGACY))[0]
+        moves = [json.loads(f)["data"] for f in frames]
+        self.assertEqual(len(moves), 3)
+        self.assertEqual([(m["x1"], m["y1"], m["x2"], m["y2"]) for m in moves],
+                         [(10, 20, 8, 25), (8, 25, -3, 0), (-3, 0, 799, 599)])
+        self.assertTrue(all(m["action"] == "move" and m["width"] == 3 for m in moves))
+
+    def test_legacy_other_actions_as_json(self):
+        frame = convert_draw_frame(encode_draw_binary({"action": "undo"}), FORMAT_LEGACY)
+        self.assertEqual(json.loads(frame), {"type": MSG_DRAW, "data": {"action": "undo"}})
+        self.assertIsNone(convert_draw_frame(encode_message({"type": MSG_DRAW, "data": dict(POLY, points=[1, 2])}),
+                                             FORMAT_LEGACY))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+test_ratelimit.py
+令牌桶与被限流绘图数据的合并
+运行：python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(ROOT_DIR / "Server"))
+
+import ratelimit
+from ratelimit import MAX_PENDING_POINTS, RateLimiter, TokenBucket, parse_limit
+from Shared.protocol import MSG_CHAT, MSG_DRAW
+
+def poly(points, color="#000000", width=3):
+    return {"action": "poly", "color": color, "width": width, "points": list(points)}
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_refill(self):
+        with mock.patch.object(ratelimit.time, "monotonic", return_value=100.0) as clock:
+            bucket = TokenBucket(2.0, 3)
+            self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+            clock.return_value = 100.5  # 0.5 秒补 1 个令牌
+            self.assertEqual([bucket.take() for _ in range(2)], [True, False])
+            clock.return_value = 200.0  # 不超过桶容量
+            self.assertEqual(sum(bucket.take() for _ in range(5)), 3)
+
+class RateLimiterTest(unittest.TestCase):
+    def test_types_have_separate_buckets(self):
+        limiter = RateLimiter({MSG_CHAT: (0.001, 1), MSG_DRAW: (0.001, 2)})
+        self.assertTrue(limiter.allow(MSG_CHAT))
+        self.assertFalse(limiter.allow(MSG_CHAT))
+        self.assertTrue(limiter.allow(MSG_DRAW))
+        # 未知类型共用 other 桶
+        self.assertTrue(limiter.allow("bogus-1"))
+        self.assertEqual(sorted(limiter.buckets), sorted([MSG_CHAT, MSG_DRAW, "other"]))
+        limiter.allow("bogus-2")
+        self.assertEqual(len(limiter.buckets), 3)
+
+    def test_coalesce_joins_connected_chunks(self):
+        limiter = RateLimiter()
+        self.assertTrue(limiter.coalesce(poly([0, 0, 1, 1]), 1))
+        self.assertTrue(limiter.coalesce(poly([1, 1, 2, 2]), 1))
+        self.assertTrue(limiter.coalesce(poly([5, 5, 6, 6]), 1))
+        self.assertTrue(limiter.coalesce(poly([6, 6, 7, 7], color="#e78284"), 1))
+        self.assertEqual([p["points"] for p in limiter.pending],
+                         [[0, 0, 1, 1, 2, 2], [5, 5, 6, 6], [6, 6, 7, 7]])
+        self.assertTrue(limiter.stroke_open)
+
+    def test_pending_dropped_on_new_round(self):
+        limiter = RateLimiter()
+        limiter.coalesce(poly([0, 0, 1, 1]), 1)
+        self.assertEqual(limiter.take_pending(2), [])
+        limiter.coalesce(poly([0, 0, 1, 1]), 2)
+        self.assertEqual(len(limiter.take_pending(2)), 1)
+        self.assertEqual(limiter.pending_points, 0)
+
+    def test_pending_capped(self):
+        limiter = RateLimiter()
+        self.assertTrue(limiter.coalesce(poly(range(2 * MAX_PENDING_POINTS)), 1))
+        self.assertFalse(limiter.coalesce(poly([0, 0, 1, 1]), 1))
+        self.assertEqual(limiter.pending_points, MAX_PENDING_POINTS)
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit("draw=60/120"), ("draw", (60.0, 120)))
+        self.assertEqual(parse_limit("chat=2.5"), ("chat", (2.5, 2)))
+        for bad in ("draw", "=5/1", "draw=fast"):
+            with self.assertRaises(ValueError):
+                parse_limit(bad)
+
+if __name__ == "__main__":
+    unittest.main()
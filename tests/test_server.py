@@ -0,0 +1,191 @@
+"""
+test_server.py
+绘图帧的转发：接收方只会收到服务器认可的绘图消息
+运行：python -m unittest discover tests
+"""
+
+import json
+import sys
+import time
+import unittest
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(ROOT_DIR / "Server"))
+
+from Shared.protocol import (FORMAT_JSON, FORMAT_BINARY, FORMAT_LEGACY, MSG_DRAW, MSG_SET_NAME,
+                             MSG_CANVAS_SNAPSHOT, SNAPSHOT_PNG, CANVAS_RESYNC,
+                             decode_frame, encode_draw_binary, encode_message, split_frames)
+from server import GuessDrawServer
+from ratelimit import RateLimiter
+from stroke_log import SNAPSHOT_TAIL_STROKES, BAKE_BATCH
+import rasterizer
+
+class FakeConn:
+    """只记录发出的帧，不走网络"""
+    def __init__(self, draw_format=FORMAT_JSON):
+        self.draw_format = draw_format
+        self.snapshot_png = False
+        self.canvas_resync = False
+        self.limiter = None
+        self.room = None
+        self.player_name = None
+        self.sent = []
+
+    def send(self, data, droppable=False, bulk=False):
+        # 一次入队可能带多帧（给旧客户端拆开的 move）
+        self.sent.extend(split_frames(data)[0])
+
+class _DrawingRoom(unittest.TestCase):
+    """A 是画手，B 用 JSON、C 用二进制接收"""
+    def setUp(self):
+        self.server = GuessDrawServer(listen=False)
+        self.server.rate_limits = None
+        self.drawer = FakeConn()
+        self.json_peer = FakeConn()
+        self.bin_peer = FakeConn(FORMAT_BINARY)
+        for conn, name in ((self.drawer, "A"), (self.json_peer, "B"), (self.bin_peer, "C")):
+            self.server._join_room(conn, None, name)
+        game = self.server.game
+        game.game_in_progress = True
+        game.current_drawer = "A"
+        for conn in (self.json_peer, self.bin_peer):
+            conn.sent.clear()
+
+    def received(self, conn):
+        return [decode_frame(f) for f in conn.sent]
+
+class DrawRelayTest(_DrawingRoom):
+    def test_escaped_type_key_cannot_forge_message(self):
+        frame = (b'{"type": "draw", "data": {"action": "poly", "color": "#000000", "width": 3, '
+                 b'"points": [1, 2, 3, 4]}, "ty\\u0070e": "round_result", "answer": "x"}\n')
+        self.assertEqual(json.loads(frame)["type"], "round_result")
+        self.server._handle_frame(self.drawer, frame)
+        for conn in (self.json_peer, self.bin_peer):
+            self.assertTrue(all(m["type"] != "round_result" for m in self.received(conn)))
+        # 冒充的消息也不会被当作绘图转发
+        self.assertEqual(self.server.game.strokes.current, [])
+
+    def test_json_frame_is_reencoded(self):
+        frame = (b'{"type": "draw", "data": {"action": "poly", "color": "#000000", "width": 3, '
+                 b'"points": [1, 2, 3, 4]}, "word": "secret"}\n')
+        self.server._handle_frame(self.drawer, frame)
+        self.assertEqual(len(self.json_peer.sent), 1)
+        self.assertNotIn(b"secret", self.json_peer.sent[0])
+        self.assertEqual(self.received(self.json_peer)[0]["type"], MSG_DRAW)
+        self.assertEqual(self.received(self.bin_peer)[0]["data"]["points"], [1, 2, 3, 4])
+
+    def test_binary_frame_relayed(self):
+        frame = encode_draw_binary({"action": "poly", "color": "#000000", "width": 3, "points": [5, 6, 7, 8]})
+        self.server._handle_frame(self.drawer, frame)
+        self.assertEqual(self.bin_peer.sent, [frame])
+        self.assertEqual(self.received(self.json_peer)[0]["data"]["points"], [5, 6, 7, 8])
+
+    def test_non_drawer_ignored(self):
+        frame = encode_draw_binary({"action": "clear"})
+        self.server._handle_frame(self.json_peer, frame)
+        self.assertEqual(self.bin_peer.sent, [])
+
+class RateLimitedDrawTest(_DrawingRoom):
+    """绘图令牌用完后 poly 被合并，undo / clear 仍然立即转发"""
+    def setUp(self):
+        super().setUp()
+        self.drawer.limiter = RateLimiter({MSG_DRAW: (0.001, 1)})
+
+    def draw(self, data):
+        self.server._handle_frame(self.drawer, encode_message({"type": MSG_DRAW, "data": data}))
+
+    def actions(self):
+        return [m["data"]["action"] for m in self.received(self.json_peer)]
+
+    def test_undo_and_clear_never_limited(self):
+        self.draw({"action": "poly", "color": "#000000", "width": 3, "points": [1, 2, 3, 4]})
+        self.draw({"action": "poly", "color": "#000000", "width": 3, "points": [3, 4, 5, 6]})
+        self.assertEqual(self.actions(), ["poly"])
+        self.draw({"action": "end"})
+        for action in ("undo", "clear", "undo"):
+            self.draw({"action": action})
+        self.assertEqual(self.actions(), ["poly", "poly", "end", "undo", "clear", "undo"])
+        self.assertEqual(self.server.game.strokes.strokes, [])
+
+@unittest.skipUnless(rasterizer.available(), "需要 NumPy")
+class UndoIntoBaseTest(unittest.TestCase):
+    """画手撤销到 PNG 底图里的笔画时，拿底图加入的玩家收到 reset 快照"""
+    def test_png_joiner_resynced(self):
+        server = GuessDrawServer(listen=False)
+        server.rate_limits = None
+        drawer = FakeConn()
+        server._register_player(drawer, {"type": MSG_SET_NAME, "name": "A", "formats": [FORMAT_JSON]})
+        game = server.game
+        game.game_in_progress = True
+        game.current_drawer = "A"
+        total = SNAPSHOT_TAIL_STROKES + BAKE_BATCH
+        for i in range(total):
+            poly = {"action": "poly", "color": "#000000", "width": 3, "points": [i, 0, i + 1, 1]}
+            server._handle_frame(drawer, encode_message({"type": MSG_DRAW, "data": poly}))
+            server._handle_frame(drawer, encode_message({"type": MSG_DRAW, "data": {"action": "end"}}))
+        deadline = time.monotonic() + 5
+        while game.strokes._baked < BAKE_BATCH and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        joiners = {}
+        for name, formats in (("B", [FORMAT_JSON, SNAPSHOT_PNG, CANVAS_RESYNC]), ("C", [FORMAT_JSON])):
+            conn = FakeConn()
+            server._register_player(conn, {"type": MSG_SET_NAME, "name": name, "formats": formats})
+            server._welcome_player(conn, conn.player_name)
+            conn.sent.clear()
+            joiners[name] = conn
+        self.assertTrue(joiners["B"].snapshot_png)
+
+        undo = encode_message({"type": MSG_DRAW, "data": {"action": "undo"}})
+        for _ in range(SNAPSHOT_TAIL_STROKES + 1):
+            server._handle_frame(drawer, undo)
+        resets = [m for m in map(decode_frame, joiners["B"].sent) if m["type"] == MSG_CANVAS_SNAPSHOT]
+        self.assertEqual(len(resets), 1)
+        self.assertTrue(resets[0]["reset"])
+        self.assertNotIn("image", resets[0])
+        self.assertEqual(len([op for op in resets[0]["ops"] if op["action"] == "poly"]), BAKE_BATCH - 1)
+        # 没拿底图的玩家本地有全部笔画，跟着撤销即可
+        self.assertTrue(all(decode_frame(f)["type"] == MSG_DRAW for f in joiners["C"].sent))
+        self.assertFalse(any(decode_frame(f)["type"] == MSG_CANVAS_SNAPSHOT for f in drawer.sent))
+
+class LegacyClientTest(unittest.TestCase):
+    """不带 formats 登录的旧客户端只会画 move 线段"""
+    def setUp(self):
+        self.server = GuessDrawServer(listen=False)
+        self.server.rate_limits = None
+        self.drawer = FakeConn()
+        self.server._register_player(self.drawer, {"type": MSG_SET_NAME, "name": "A", "formats": [FORMAT_JSON]})
+        game = self.server.game
+        game.game_in_progress = True
+        game.current_drawer = "A"
+
+    def join_legacy(self, name):
+        conn = FakeConn()
+        self.server._register_player(conn, {"type": MSG_SET_NAME, "name": name})
+        self.server._welcome_player(conn, conn.player_name)
+        return conn
+
+    def draws(self, conn):
+        return [m["data"] for m in map(decode_frame, conn.sent) if m["type"] == MSG_DRAW]
+
+    def test_poly_split_into_moves(self):
+        legacy = self.join_legacy("B")
+        self.assertEqual(legacy.draw_format, FORMAT_LEGACY)
+        poly = {"action": "poly", "color": "#000000", "width": 3, "points": [1, 2, 3, 4, 5, 6]}
+        self.server._handle_frame(self.drawer, encode_message({"type": MSG_DRAW, "data": poly}))
+        self.server._handle_frame(self.drawer, encode_message({"type": MSG_DRAW, "data": {"action": "end"}}))
+        self.assertEqual([d["action"] for d in self.draws(legacy)], ["move", "move", "end"])
+        self.assertEqual([(d["x1"], d["y1"], d["x2"], d["y2"]) for d in self.draws(legacy)[:2]],
+                         [(1, 2, 3, 4), (3, 4, 5, 6)])
+
+    def test_late_join_replayed_as_moves(self):
+        poly = {"action": "poly", "color": "#000000", "width": 3, "points": [1, 2, 3, 4]}
+        self.server._handle_frame(self.drawer, encode_message({"type": MSG_DRAW, "data": poly}))
+        self.server._handle_frame(self.drawer, encode_message({"type": MSG_DRAW, "data": {"action": "end"}}))
+        legacy = self.join_legacy("C")
+        self.assertEqual([d["action"] for d in self.draws(legacy)], ["move", "end"])
+
+if __name__ == "__main__":
+    unittest.main()
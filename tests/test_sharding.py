@@ -0,0 +1,76 @@
+"""
+test_sharding.py
+worker 一侧的控制通道：坏消息被跳过，分段推送的房间目录完整拼回
+运行：python -m unittest discover tests
+"""
+
+import socket
+import sys
+import threading
+import unittest
+from unittest import mock
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(ROOT_DIR / "Server"))
+
+import sharding
+from sharding import ROOMS_PER_CTRL_MSG, WorkerLink, _send_ctrl
+
+class FakeServer:
+    engine = "thread"
+    running = True
+
+    def __init__(self):
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+class WorkerLinkTest(unittest.TestCase):
+    def setUp(self):
+        self.front, worker = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.server = FakeServer()
+        self.link = WorkerLink(self.server, worker)
+        self.thread = threading.Thread(target=self.link._run, daemon=True)
+
+    def tearDown(self):
+        self.front.close()
+        if self.thread.is_alive():
+            self.thread.join(2)
+        self.link.ctrl.close()
+
+    def finish(self):
+        """关闭前端一侧，等 worker 的接收线程读完所有消息后退出"""
+        self.front.close()
+        self.thread.join(2)
+        self.assertFalse(self.thread.is_alive())
+        self.assertTrue(self.server.stopped.is_set())
+
+    @mock.patch.object(sharding, "CTRL_MSG_SIZE", 1024)
+    def test_bad_messages_skipped(self):
+        self.thread.start()
+        self.front.send(b"{not json\n")
+        self.front.send(b"[1, 2]\n")
+        # 超过接收缓冲的消息会被截断；把缓冲调小来模拟
+        _send_ctrl(self.front, {"op": "rooms", "rooms": [{"room": "lobby", "players": 1, "worker": 0}],
+                                "part": 0, "more": True})
+        _send_ctrl(self.front, {"op": "rooms", "rooms": [{"room": "big", "players": 1, "worker": 0}],
+                                "part": 1, "more": True}, b"x" * 2048)
+        _send_ctrl(self.front, {"op": "rooms", "rooms": [], "part": 2})
+        self.finish()
+        self.assertEqual([r["room"] for r in self.link.directory], ["lobby"])
+
+    def test_rooms_in_parts(self):
+        self.thread.start()
+        rooms = [{"room": f"r{i}", "players": 1, "worker": 0} for i in range(ROOMS_PER_CTRL_MSG + 3)]
+        # 上一次推送中途失败留下的半截目录会在 part 0 时丢弃
+        _send_ctrl(self.front, {"op": "rooms", "rooms": rooms[:2], "part": 0, "more": True})
+        _send_ctrl(self.front, {"op": "rooms", "rooms": rooms[:ROOMS_PER_CTRL_MSG], "part": 0, "more": True})
+        _send_ctrl(self.front, {"op": "rooms", "rooms": rooms[ROOMS_PER_CTRL_MSG:], "part": 1, "more": False})
+        self.finish()
+        self.assertEqual(self.link.directory, rooms)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+test_stroke_log.py
+本轮笔迹记录：end / undo / clear 的语义、快照内容，以及后台烘焙底图与撤销的配合
+运行：python -m unittest discover tests
+"""
+
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(ROOT_DIR / "Server"))
+
+import rasterizer
+import stroke_log
+from stroke_log import StrokeLog, SNAPSHOT_TAIL_STROKES, BAKE_BATCH
+
+def poly(x, color="#000000"):
+    return {"action": "poly", "color": color, "width": 3, "points": [x, 0, x + 1, 1]}
+
+def draw_strokes(log, start, count):
+    for i in range(start, start + count):
+        log.apply(poly(i))
+        log.apply({"action": "end"})
+
+def stroke_xs(ops):
+    return [op["points"][0] for op in ops if op["action"] == "poly"]
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+class StrokeLogTest(unittest.TestCase):
+    def test_end_undo_clear(self):
+        log = StrokeLog()
+        draw_strokes(log, 0, 3)
+        log.apply(poly(10))
+        _, ops = log.snapshot()
+        self.assertEqual(stroke_xs(ops), [0, 1, 2, 10])
+        self.assertEqual([op["action"] for op in ops][-2:], ["end", "poly"])  # 正在画的一笔不带 end
+        log.apply({"action": "end"})
+        log.apply({"action": "undo"})
+        log.apply({"action": "undo"})
+        self.assertEqual(stroke_xs(log.snapshot()[1]), [0, 1])
+        log.apply({"action": "clear"})
+        self.assertEqual(log.snapshot(), (None, []))
+
+    def test_end_without_stroke_ignored(self):
+        log = StrokeLog()
+        log.apply({"action": "end"})
+        log.apply({"action": "undo"})
+        self.assertEqual(log.strokes, [])
+
+    def test_chunks_of_one_stroke_merged(self):
+        log = StrokeLog()
+        log.apply({"action": "poly", "color": "#000000", "width": 3, "points": [0, 0, 5, 5]})
+        log.apply({"action": "poly", "color": "#000000", "width": 3, "points": [5, 5, 9, 9]})
+        log.apply({"action": "move", "x1": 9, "y1": 9, "x2": 12, "y2": 12, "color": "#000000", "width": 3})
+        self.assertEqual(log.current, [{"action": "poly", "color": "#000000", "width": 3,
+                                        "points": [0, 0, 5, 5, 9, 9, 12, 12]}])
+
+    def test_coordinates_clamped_to_ints(self):
+        log = StrokeLog()
+        log.apply({"action": "poly", "color": "#000000", "width": 3, "points": [1.7, -5, 10 ** 9, 2]})
+        self.assertEqual(log.current[0]["points"], [1, 0, rasterizer.MAX_CANVAS_SIZE, 2])
+        log.apply({"action": "poly", "color": "#000000", "width": 3, "points": ["a", 1, 2, 3]})
+        self.assertEqual(len(log.current), 1)
+
+@unittest.skipUnless(rasterizer.available(), "需要 NumPy")
+class BakeTest(unittest.TestCase):
+    def baked_log(self):
+        log = StrokeLog(rasterize=True)
+        draw_strokes(log, 0, SNAPSHOT_TAIL_STROKES + BAKE_BATCH)
+        self.assertTrue(wait_for(lambda: log._baked == BAKE_BATCH))
+        return log
+
+    def test_snapshot_tail_after_bake(self):
+        log = self.baked_log()
+        png, ops = log.snapshot(image=True)
+        self.assertTrue(png.startswith(b"\x89PNG"))
+        self.assertEqual(stroke_xs(ops), list(range(BAKE_BATCH, BAKE_BATCH + SNAPSHOT_TAIL_STROKES)))
+        # 不要图片的连接仍拿到全部笔迹
+        self.assertEqual(len(stroke_xs(log.snapshot()[1])), SNAPSHOT_TAIL_STROKES + BAKE_BATCH)
+
+    def test_undo_into_base_reported(self):
+        log = self.baked_log()
+        results = []
+        for _ in range(SNAPSHOT_TAIL_STROKES):
+            results.append(log.apply({"action": "undo"}))
+        self.assertFalse(any(results))
+        # 下一次撤销的是底图里的笔画
+        self.assertTrue(log.apply({"action": "undo"}))
+        png, ops = log.snapshot(image=True)
+        self.assertIsNone(png)
+        self.assertEqual(stroke_xs(ops), list(range(BAKE_BATCH - 1)))
+
+    def test_undo_and_redraw_during_bake_discards_base(self):
+        """烘焙进行中撤销底图范围内的一笔又画一笔：笔画数不变，旧底图也不能发布"""
+        encoding = threading.Event()
+        release = threading.Event()
+        original = rasterizer.CanvasRaster.encode_png
+
+        def slow_encode(raster):
+            encoding.set()
+            release.wait(5)
+            return original(raster)
+
+        stroke_log.CanvasRaster = type("SlowRaster", (rasterizer.CanvasRaster,), {"encode_png": slow_encode})
+        try:
+            log = StrokeLog(rasterize=True)
+            draw_strokes(log, 0, SNAPSHOT_TAIL_STROKES + BAKE_BATCH)
+            self.assertTrue(encoding.wait(5))
+            # 第一次烘焙正在编码 strokes[:BAKE_BATCH]，此时撤销到其中并补画一笔
+            for _ in range(SNAPSHOT_TAIL_STROKES + 1):
+                log.apply({"action": "undo"})
+            draw_strokes(log, 100, SNAPSHOT_TAIL_STROKES + 1)
+            release.set()
+            self.assertTrue(wait_for(lambda: log._baked == BAKE_BATCH and not log._scheduled))
+        finally:
+            stroke_log.CanvasRaster = rasterizer.CanvasRaster
+            release.set()
+        png, ops = log.snapshot(image=True)
+        # 底图必须由当前的前 BAKE_BATCH 笔重新画出，不能含被撤销的那笔
+        expected = rasterizer.CanvasRaster()
+        for stroke in log.strokes[:BAKE_BATCH]:
+            for item in stroke:
+                expected.ensure_size(*rasterizer.item_extent(item))
+                expected.draw(item)
+        self.assertEqual(png, expected.encode_png())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+test_strokes.py
+画手端折线简化：首尾点保留，抖动点和近共线点被去掉，拐角保留
+运行：python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR / "Client"))
+
+from strokes import simplify
+
+class SimplifyTest(unittest.TestCase):
+    def test_short_chunk_unchanged(self):
+        self.assertEqual(list(simplify([1, 2, 3, 4])), [1, 2, 3, 4])
+
+    def test_collinear_points_removed(self):
+        line = [c for i in range(20) for c in (i * 5, i * 5)]
+        self.assertEqual(list(simplify(line)), [0, 0, 95, 95])
+
+    def test_jitter_removed_endpoints_kept(self):
+        points = [0, 0, 1, 0, 1, 1, 0, 1, 1, 1]
+        self.assertEqual(list(simplify(points, min_dist=2.0, epsilon=0)), [0, 0, 1, 1])
+
+    def test_corner_kept(self):
+        # L 形：沿 x 轴再沿 y 轴，拐点偏离首尾弦线很远
+        points = [c for i in range(11) for c in (i * 10, 0)] + [c for i in range(1, 11) for c in (100, i * 10)]
+        self.assertEqual(list(simplify(points)), [0, 0, 100, 0, 100, 100])
+
+    def test_within_epsilon(self):
+        points = [0, 0, 10, 1, 20, 0, 30, 1, 40, 0]
+        self.assertEqual(list(simplify(points, epsilon=1.0)), [0, 0, 40, 0])
+        self.assertEqual(len(simplify(points, epsilon=0.5)), 10)
+
+    def test_disabled(self):
+        points = [0, 0, 1, 0, 2, 0, 3, 0]
+        self.assertEqual(list(simplify(points, min_dist=0, epsilon=0)), points)
+
+if __name__ == "__main__":
+    unittest.main()